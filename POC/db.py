@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, func
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, func
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from sqlalchemy import create_engine
 from contextlib import contextmanager
@@ -45,6 +45,10 @@ class ChatHistory(Base):
    session = relationship("ChatSession", back_populates="chats")
    # Optionally, add this for reverse relationship
    user = relationship("User")
+   # Serves get_session_chat_history: one session's turns in timestamp order
+   __table_args__ = (
+       Index("ix_chat_history_session_timestamp", "session_id", "timestamp", "id"),
+   )
 
 @contextmanager
 def get_db():
@@ -55,4 +59,7 @@ def get_db():
         db.close()
 
 def create_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    # create_all skips existing tables, so add indexes declared after they were created
+    for index in ChatHistory.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
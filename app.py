@@ -3,13 +3,25 @@ import os
 import time
 import logging
 import traceback
-from concurrent.futures import ThreadPoolExecutor
-
+import json
+import uuid
 from db import create_tables, get_db, ChatHistory
 from auth import create_user, authenticate_user, validate_password_strength
 from chatbot import get_chatbot
-from utils import get_user_chat_history, format_chat_history, initialize_session_state, setup_logging
-from config import APP_TITLE, PAGE_ICON, LAYOUT, LOG_LEVEL, LOG_FORMAT, LOG_FILE
+from scheduler import get_scheduler
+from session_tokens import create_session, revoke_session, validate_session
+from rate_limit import check_rate_limit
+from exception import DatabaseError, ModelTimeoutError, RateLimitExceededError, ResourceExhaustedError, UserExistsError
+from history_cache import get_user_session_preview_pages
+from search import search_chats
+from logger import bind_log_context
+from utils import (
+    get_chat_context, get_client_ip, get_session_turns, format_session_previews, initialize_session_state, setup_logging
+)
+from config import (
+    APP_TITLE, PAGE_ICON, LAYOUT, LOG_LEVEL, LOG_FORMAT, LOG_FILE, STREAMING_ENABLED, SCHEDULER_REQUEST_TIMEOUT,
+    SESSION_COOKIE_NAME, SESSION_EXPIRY_DAYS
+)
 
 # Set up logging
 setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_FILE)
@@ -27,9 +39,6 @@ except Exception as e:
     logger.critical(f"Failed to initialize application: {str(e)}")
     st.error("Failed to initialize application. Please check the logs or contact an administrator.")
 
-# Thread pool for background tasks
-executor = ThreadPoolExecutor(max_workers=10)
-
 # Page configuration
 st.set_page_config(
    page_title=APP_TITLE,
@@ -53,6 +62,29 @@ def load_css():
 
 load_css()
 
+def login_wait(username: str) -> int:
+    """Seconds this browser must wait before trying `username`, or 0 to go ahead now.
+
+    Counts the attempt, raising RateLimitExceededError over a hard limit.
+    Over the soft limit on the username alone, the browser is paced to one
+    attempt per delay instead of being refused, so guesses from elsewhere
+    cannot lock the owner out. Nothing sleeps; the wait is kept in session
+    state and the attempt refused until it has passed.
+    """
+    not_before = st.session_state.login_not_before
+    waited = not_before is not None and not_before[0] == username
+    if waited and time.time() < not_before[1]:
+        return int(not_before[1] - time.time() + 0.999)
+
+    client_ip = get_client_ip()
+    delay = check_rate_limit("login", ip=client_ip, user=username,
+                             ip_user=f"{client_ip}|{username}" if client_ip else None)
+    if delay and not waited:
+        st.session_state.login_not_before = (username, time.time() + delay)
+        return int(delay + 0.999)
+    st.session_state.login_not_before = None
+    return 0
+
 # Login Form
 def login_form():
     st.title("Welcome to LangChain Hugging Face Chatbot")
@@ -71,32 +103,33 @@ def login_form():
                     st.warning("Please enter both username and password.")
                     return
                 
+                # Turned away here, before the password is hashed
+                wait = login_wait(username)
+                if wait:
+                    st.warning(f"Too many recent attempts for this account. Please try again in {wait} seconds.")
+                    return
                 with st.spinner("Authenticating..."):
-                    user = authenticate_user(username, password)
+                    user = authenticate_user(username, password, ip=get_client_ip())
                 
                 if user:
                     logger.info(f"User '{username}' logged in successfully")
                     st.session_state.user_id = user.id
                     st.session_state.username = user.username
                     st.session_state.authenticated = True
-                    st.session_state.login_attempts = 0  # Reset login attempts
+                    try:
+                        # Reloads sign back in with this token instead of the password
+                        st.session_state.session_token = create_session(user.id, user.username)
+                        st.session_state.session_cookie_pending = st.session_state.session_token
+                    except Exception as e:
+                        logger.error(f"Failed to create login session: {str(e)}")
                     st.success(f"Welcome back, {username}!")
                     time.sleep(1)
                     st.rerun()
                 else:
-                    # Track failed login attempts
-                    if 'login_attempts' not in st.session_state:
-                        st.session_state.login_attempts = 1
-                    else:
-                        st.session_state.login_attempts += 1
-                    
-                    logger.warning(f"Failed login attempt for username '{username}' (Attempt #{st.session_state.login_attempts})")
-                    
-                    if st.session_state.login_attempts >= 5:
-                        st.error("Too many failed login attempts. Please try again later.")
-                        time.sleep(3)  # Add a delay to discourage brute force attacks
-                    else:
-                        st.error("Invalid username or password.")
+                    logger.warning(f"Failed login attempt for username '{username}'")
+                    st.error("Invalid username or password.")
+            except (RateLimitExceededError, ResourceExhaustedError) as e:
+                st.warning(e.message)
             except Exception as e:
                 logger.error(f"Login error: {str(e)}")
                 st.error("An error occurred during login. Please try again later.")
@@ -124,36 +157,138 @@ def login_form():
                     st.error(password_validation['message'])
                     return
                 
+                client_ip = get_client_ip()
+                check_rate_limit("register", ip=client_ip)
                 with st.spinner("Creating account..."):
-                    user = create_user(new_username, new_email, new_password)
+                    user = create_user(new_username, new_email, new_password, ip=client_ip)
                 
                 if user:
                     logger.info(f"New user registered: {new_username}")
                     st.success("Registration successful! Please log in.")
                 else:
-                    st.error("Username or email already exists. Please choose another one.")
+                    st.error("Registration failed. Please check your details and try again.")
+            except UserExistsError as e:
+                st.error(e.message)
+            except (RateLimitExceededError, ResourceExhaustedError) as e:
+                st.warning(e.message)
             except Exception as e:
                 logger.error(f"Registration error: {str(e)}")
                 st.error("An error occurred during registration. Please try again later.")
 
-# Function to get chatbot response synchronously (for thread pool)
-def get_response_sync(chatbot, user_input, user_id):
+def write_session_cookie():
+    """Write the pending session cookie change to the browser.
+
+    Runs at the start of a script run rather than where the change is made,
+    as those places rerun straight away and the script might never reach the
+    browser. The token is kept out of the URL, where it would leak through
+    browser history, Referer headers, server logs and shared links.
+    """
+    token = st.session_state.session_cookie_pending
+    if token is None:
+        return
+    max_age = SESSION_EXPIRY_DAYS * 24 * 3600 if token else 0
+    st.html(
+        f"""<script>
+        document.cookie = {json.dumps(SESSION_COOKIE_NAME)} + "=" + {json.dumps(token)}
+            + "; Path=/; Max-Age={max_age}; SameSite=Strict"
+            + (location.protocol === "https:" ? "; Secure" : "");
+        </script>""",
+        unsafe_allow_javascript=True
+    )
+    st.session_state.session_cookie_pending = None
+
+def end_login_session():
+    """Revoke this browser's login session token and clear its cookie."""
+    revoke_session(st.session_state.session_token)
+    st.session_state.session_token = None
+    st.session_state.session_cookie_pending = ""
+
+def restore_login_session():
+    """Sign the browser in from its session token, without a password check or database write.
+
+    Signs it out if the token has expired or been revoked, but not if the
+    token could not be checked.
+    """
+    token = st.session_state.session_token
+    if not st.session_state.session_cookie_read:
+        # Cookies are only sent when the browser session opens, so after
+        # that the one in session state is the current token
+        st.session_state.session_cookie_read = True
+        token = token or st.context.cookies.get(SESSION_COOKIE_NAME)
+    if not token:
+        return
+    try:
+        auth_session = validate_session(token)
+    except DatabaseError:
+        # Keep whatever this browser session had; the token is checked again next run
+        logger.warning("Could not check login session; keeping it")
+        st.session_state.session_token = token
+        return
+    if auth_session is None:
+        logger.info("Login session is no longer valid")
+        st.session_state.user_id = None
+        st.session_state.username = None
+        st.session_state.authenticated = False
+        st.session_state.session_token = None
+        st.session_state.session_cookie_pending = ""
+        return
+    if not st.session_state.authenticated:
+        logger.info(f"User '{auth_session.username}' restored from login session")
+        # Rewritten so the cookie's lifetime follows the sliding expiry
+        st.session_state.session_cookie_pending = token
+    st.session_state.user_id = auth_session.user_id
+    st.session_state.username = auth_session.username
+    st.session_state.authenticated = True
+    st.session_state.session_token = token
+
+# Function to get chatbot response synchronously (run by the generation scheduler)
+def get_response_sync(chatbot, user_input, user_id, session_id, chat_session_id=None):
     try:
-        response = chatbot.get_response(user_input, user_id)
+        response = chatbot.get_response(user_input, user_id, session_id, chat_session_id=chat_session_id)
         return response
     except Exception as e:
         logger.error(f"Error getting chatbot response: {str(e)}\n{traceback.format_exc()}")
         return f"I'm sorry, I encountered an error while processing your request. Please try again later. Error: {str(e)}"
 
+def cancel_pending_request():
+    """Cancel this session's outstanding chatbot request, if any."""
+    pending = st.session_state.get('pending_request')
+    if pending is not None and not pending.done():
+        pending.cancel()
+        logger.info(f"Cancelled pending request for user '{st.session_state.username}'")
+    st.session_state.pending_request = None
+
+def open_chat_session(chat_session_id):
+    """Show a stored conversation in the main pane, or a new one when chat_session_id is None."""
+    st.session_state.chat_session_id = chat_session_id
+    st.session_state.messages = []
+    st.session_state.earlier_turns_cursor = None
+    st.session_state.loaded_history = False
+    st.session_state.search_focus = None
+
+def turns_to_messages(turns):
+    """Convert stored turns into chat pane messages."""
+    messages = []
+    for chat in turns:
+        messages.append({"role": "user", "content": chat.user_message})
+        messages.append({"role": "assistant", "content": chat.bot_response})
+    return messages
+
 # Chat Interface
 def chat_interface():
     try:
+        # Cancel a request left behind by a run the user navigated away from
+        cancel_pending_request()
+
         # Create a layout with sidebar for chat history
         st.sidebar.title(f"Welcome, {st.session_state.username}!")
         
         # Logout button in sidebar
         if st.sidebar.button("Logout", key="logout_button"):
             logger.info(f"User '{st.session_state.username}' logged out")
+            cancel_pending_request()
+            get_chatbot().reset_memory(st.session_state.user_id, st.session_state.session_id)
+            end_login_session()
             # Clear session state
             st.session_state.user_id = None
             st.session_state.username = None
@@ -161,30 +296,56 @@ def chat_interface():
             st.session_state.chat_history = []
             st.session_state.messages = []
             st.session_state.loaded_history = False
+            st.session_state.history_pages = 1
+            st.session_state.search_focus = None
+            st.session_state.chat_session_id = None
+            st.session_state.earlier_turns_cursor = None
             st.rerun()
         
         st.sidebar.markdown("---")
         st.sidebar.header("Chat History")
         
-        # Get user chat history from database
-        with st.spinner("Loading chat history..."):
-            try:
-                history = get_user_chat_history(st.session_state.user_id)
-            except Exception as e:
-                logger.error(f"Error loading chat history: {str(e)}")
-                st.sidebar.error("Failed to load chat history. Please refresh the page.")
-                history = []
+        if st.sidebar.button("New chat", key="new_chat_button"):
+            cancel_pending_request()
+            open_chat_session(None)
+            st.rerun()
+        
+        # Full-text search over all of the user's turns
+        search_query = st.sidebar.text_input("Search conversations", key="history_search")
+        if search_query:
+            results = search_chats(st.session_state.user_id, search_query)
+            if results:
+                for result in results:
+                    label = f"{result.timestamp.strftime('%m-%d %H:%M')}: {result.snippet}"
+                    if st.sidebar.button(label, key=f"search_result_{result.chat_id}"):
+                        st.session_state.search_focus = result.chat_id
+                        st.rerun()
+            else:
+                st.sidebar.info("No matching messages.")
+            st.sidebar.markdown("---")
+        
+        # Get the conversation list; pages are cached per user until the next saved message
+        try:
+            previews, has_more = get_user_session_preview_pages(st.session_state.user_id, st.session_state.history_pages)
+        except Exception as e:
+            logger.error(f"Error loading chat history: {str(e)}")
+            st.sidebar.error("Failed to load chat history. Please refresh the page.")
+            previews, has_more = [], False
         
         # Format history for sidebar display
-        if history:
+        if previews:
             try:
-                formatted_history = format_chat_history(history)
-                selected_chat_idx = st.sidebar.radio(
-                    "Select a previous conversation:",
-                    range(len(formatted_history)),
-                    format_func=lambda i: formatted_history[i],
-                    key="chat_history_radio"
-                )
+                formatted_history = format_session_previews(previews)
+                for chat_session, label in zip(previews, formatted_history):
+                    is_open = chat_session.id == st.session_state.chat_session_id
+                    if st.sidebar.button(label, key=f"chat_session_{chat_session.id}",
+                                         type="primary" if is_open else "secondary"):
+                        cancel_pending_request()
+                        open_chat_session(chat_session.id)
+                        st.rerun()
+                if has_more and st.sidebar.button("Load more", key="load_more_history"):
+                    st.session_state.history_pages += 1
+                    st.rerun()
             except Exception as e:
                 logger.error(f"Error formatting chat history: {str(e)}")
                 st.sidebar.error("Failed to display chat history properly.")
@@ -203,37 +364,66 @@ def chat_interface():
             st.error("Failed to initialize chatbot. Please try refreshing the page or contact an administrator.")
             return
         
-        # Load chat history into memory if needed
+        # Load the open conversation into memory and its latest turns into the message list once
         if 'loaded_history' not in st.session_state or not st.session_state.loaded_history:
             try:
                 with st.spinner("Loading conversation history..."):
-                    chatbot.load_conversation_history(st.session_state.user_id)
+                    if st.session_state.chat_session_id is None:
+                        chatbot.reset_memory(st.session_state.user_id, st.session_state.session_id)
+                    else:
+                        chatbot.load_conversation_history(
+                            st.session_state.user_id, st.session_state.session_id, st.session_state.chat_session_id
+                        )
+                        turns, st.session_state.earlier_turns_cursor = get_session_turns(
+                            st.session_state.user_id, st.session_state.chat_session_id
+                        )
+                        st.session_state.messages = turns_to_messages(turns)
                 st.session_state.loaded_history = True
             except Exception as e:
                 logger.error(f"Error loading conversation history: {str(e)}")
                 st.warning("Failed to load previous conversations. Starting with a fresh conversation.")
                 st.session_state.loaded_history = True  # Avoid repeated loading attempts
         
-        # Display messages
-        if history and ('messages' not in st.session_state or not st.session_state.messages):
-            try:
-                st.session_state.messages = []
-                for chat in history:
-                    st.session_state.messages.append({"role": "user", "content": chat.user_message})
-                    st.session_state.messages.append({"role": "assistant", "content": chat.bot_response})
-            except Exception as e:
-                logger.error(f"Error loading messages from history: {str(e)}")
-                st.warning("Failed to load message history properly.")
-        
         # Initialize messages if not already
         if 'messages' not in st.session_state:
             st.session_state.messages = []
         
+        # Show the conversation around a search result instead of the current chat
+        if st.session_state.get('search_focus') is not None:
+            context = get_chat_context(st.session_state.user_id, st.session_state.search_focus)
+            if st.button("Back to current chat", key="close_search_focus"):
+                st.session_state.search_focus = None
+                st.rerun()
+            if not context:
+                st.info("That conversation is no longer available.")
+            focused = next((chat for chat in context if chat.id == st.session_state.search_focus), None)
+            if focused is not None and focused.session_id is not None:
+                if st.button("Open this conversation", key="open_search_focus"):
+                    cancel_pending_request()
+                    open_chat_session(focused.session_id)
+                    st.rerun()
+            for chat in context:
+                with st.chat_message("user"):
+                    st.write(str(chat.user_message))
+                with st.chat_message("assistant"):
+                    st.write(str(chat.bot_response))
+            return
+        
+        # Older turns of a long conversation are only read when asked for
+        if st.session_state.earlier_turns_cursor is not None:
+            if st.button("Load earlier messages", key="load_earlier_turns"):
+                turns, st.session_state.earlier_turns_cursor = get_session_turns(
+                    st.session_state.user_id, st.session_state.chat_session_id, st.session_state.earlier_turns_cursor
+                )
+                st.session_state.messages = turns_to_messages(turns) + st.session_state.messages
+                st.rerun()
+        
         # Display chat messages
         try:
             for message in st.session_state.messages:
                 with st.chat_message(message["role"]):
-                    st.write(message["content"])
+                    # Stored bodies are decompressed here, when first rendered
+                    st.write(str(message["content"]))
         except Exception as e:
             logger.error(f"Error displaying chat messages: {str(e)}")
             st.error("Failed to display chat messages properly. Please refresh the page.")
@@ -242,25 +432,68 @@ def chat_interface():
         user_input = st.chat_input("Type your message here...")
         
         if user_input:
+            # Turned away here, before anything is stored or sent to the model
+            try:
+                check_rate_limit("chat", ip=get_client_ip(), user=st.session_state.user_id)
+            except RateLimitExceededError as e:
+                st.warning(e.message)
+                return
+            
+            # A new chat becomes a stored conversation with its first message
+            if st.session_state.chat_session_id is None:
+                st.session_state.chat_session_id = chatbot.create_chat_session(st.session_state.user_id)
+                if st.session_state.chat_session_id is None:
+                    st.error("Failed to start a new conversation. Please try again.")
+                    return
+            
             # Add user message to chat
             st.session_state.messages.append({"role": "user", "content": user_input})
             with st.chat_message("user"):
                 st.write(user_input)
             
-            # Get bot response using thread pool
+            if STREAMING_ENABLED:
+                # Stream bot response into the chat pane as tokens arrive
+                with st.chat_message("assistant"):
+                    try:
+                        bot_response = st.write_stream(get_scheduler().stream(
+                            st.session_state.user_id, chatbot.model_name, chatbot.stream_response,
+                            user_input, st.session_state.user_id, st.session_state.session_id, True,
+                            st.session_state.chat_session_id
+                        ))
+                        st.session_state.messages.append({"role": "assistant", "content": bot_response})
+                    except ResourceExhaustedError as e:
+                        st.warning(e.message)
+                    except ModelTimeoutError:
+                        logger.error(f"Timeout getting response for user '{st.session_state.username}'")
+                        st.error("The chatbot took too long to respond. Please try again with a shorter or clearer message.")
+                    except Exception as e:
+                        logger.error(f"Error in chat processing: {str(e)}")
+                        st.error("An error occurred while processing your message. Please try again.")
+                return
+
+            # Get bot response through the generation scheduler
             with st.spinner("Thinking..."):
                 try:
-                    # Submit task to thread pool
-                    future = executor.submit(get_response_sync, chatbot, user_input, st.session_state.user_id)
+                    # Queue the request behind this user's earlier ones
+                    future = get_scheduler().submit(
+                        st.session_state.user_id, chatbot.model_name, get_response_sync,
+                        chatbot, user_input, st.session_state.user_id, st.session_state.session_id,
+                        st.session_state.chat_session_id
+                    )
+                    st.session_state.pending_request = future
                     
                     # Add timeout to prevent blocking indefinitely
-                    bot_response = future.result(timeout=60)  # 60-second timeout
+                    bot_response = future.result(timeout=SCHEDULER_REQUEST_TIMEOUT)
+                    st.session_state.pending_request = None
                     
                     # Add bot response to chat
                     st.session_state.messages.append({"role": "assistant", "content": bot_response})
                     with st.chat_message("assistant"):
                         st.write(bot_response)
+                except ResourceExhaustedError as e:
+                    st.warning(e.message)
                 except TimeoutError:
+                    cancel_pending_request()
                     logger.error(f"Timeout getting response for user '{st.session_state.username}'")
                     st.error("The chatbot took too long to respond. Please try again with a shorter or clearer message.")
                 except Exception as e:
@@ -273,6 +506,11 @@ def chat_interface():
 # Main app logic
 def main():
     try:
+        # Correlates this run's log records, including those from scheduler threads it starts
+        bind_log_context(request_id=uuid.uuid4().hex, user_id=st.session_state.user_id)
+        restore_login_session()
+        write_session_cookie()
+        bind_log_context(user_id=st.session_state.user_id)
         if not st.session_state.authenticated:
             login_form()
         else:
@@ -0,0 +1,180 @@
+import os
+import gzip
+import json
+import datetime
+import threading
+import logging
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, exists, insert, select
+from db import ChatArchive, ChatHistory, ChatSession, engine, read_engine
+from read_models import CHAT_COLUMNS, ChatRecord
+from search import unindex_chats
+from config import ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SESSIONS, ARCHIVE_SEGMENT_MAX_BYTES
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Archived turns live in append-only segment files under ARCHIVE_DIR. Each
+# conversation is written as one gzip member of JSON lines, one line per turn.
+# Concatenated gzip members are themselves a valid gzip file, so a segment can
+# be read whole with standard tools, while chat_archive records the byte range
+# of every member so one conversation is read without touching the rest.
+
+# (timestamp, id) of the oldest turn already returned
+Cursor = Optional[Tuple[datetime.datetime, int]]
+
+# Serializes segment appends within this process; run one archival job at a time
+_write_lock = threading.Lock()
+
+def _segment_path(segment: str) -> str:
+    return os.path.join(ARCHIVE_DIR, segment)
+
+def _current_segment() -> str:
+    """Name of the segment to append to, starting a new one once the latest is full."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    segments = sorted(name for name in os.listdir(ARCHIVE_DIR)
+                      if name.startswith("segment-") and name.endswith(".jsonl.gz"))
+    if segments and os.path.getsize(_segment_path(segments[-1])) < ARCHIVE_SEGMENT_MAX_BYTES:
+        return segments[-1]
+    number = int(segments[-1][len("segment-"):-len(".jsonl.gz")]) + 1 if segments else 1
+    return f"segment-{number:06d}.jsonl.gz"
+
+def _encode(turns: List[ChatRecord]) -> bytes:
+    lines = [
+        json.dumps({
+            **turn._asdict(),
+            # Bodies may still be compressed LazyText
+            "user_message": str(turn.user_message),
+            "bot_response": str(turn.bot_response),
+            "timestamp": turn.timestamp.isoformat(),
+        })
+        for turn in turns
+    ]
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+
+@lru_cache(maxsize=64)
+def _read_member(segment: str, byte_offset: int, byte_length: int) -> Tuple[ChatRecord, ...]:
+    """Decode one archived conversation; members never change once written, so they are cached."""
+    with open(_segment_path(segment), "rb") as f:
+        f.seek(byte_offset)
+        data = gzip.decompress(f.read(byte_length))
+    turns = []
+    for line in data.decode("utf-8").splitlines():
+        turn = json.loads(line)
+        turn["timestamp"] = datetime.datetime.fromisoformat(turn["timestamp"])
+        turns.append(ChatRecord(**turn))
+    return tuple(turns)
+
+def fetch_archived_turns(db, user_id: int, session_id: Optional[int], cursor: Cursor, limit: int,
+                         after: Cursor = None) -> List[ChatRecord]:
+    """A user's archived turns before `cursor`, newest first; only one conversation's with `session_id`.
+
+    With `after`, only turns after it are returned.
+    """
+    query = select(ChatArchive.segment, ChatArchive.byte_offset, ChatArchive.byte_length,
+                   ChatArchive.last_timestamp).where(ChatArchive.user_id == user_id)
+    if session_id is not None:
+        query = query.where(ChatArchive.session_id == session_id)
+    if cursor is not None:
+        query = query.where(ChatArchive.first_timestamp <= cursor[0])
+    if after is not None:
+        query = query.where(ChatArchive.last_timestamp >= after[0])
+    query = query.order_by(ChatArchive.last_timestamp.desc(), ChatArchive.id.desc())
+
+    turns: List[ChatRecord] = []
+    for segment, byte_offset, byte_length, last_timestamp in db.execute(query).all():
+        # Members come newest first; stop once the rest are all older than what is already kept
+        if len(turns) >= limit and last_timestamp < turns[limit - 1].timestamp:
+            break
+        try:
+            member = _read_member(segment, byte_offset, byte_length)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read archived turns from {segment} at {byte_offset}: {str(e)}")
+            continue
+        turns.extend(turn for turn in member
+                     if (cursor is None or (turn.timestamp, turn.id) < cursor)
+                     and (after is None or (turn.timestamp, turn.id) > after))
+        turns.sort(key=lambda turn: (turn.timestamp, turn.id), reverse=True)
+    return turns[:limit]
+
+def _archive_batch(cutoff: datetime.datetime, batch_sessions: int) -> int:
+    """Archive the turns of up to `batch_sessions` conversations inactive since `cutoff`."""
+    with read_engine.connect() as conn:
+        session_ids = conn.execute(
+            select(ChatSession.id).where(
+                ChatSession.last_activity < cutoff,
+                exists().where(ChatHistory.session_id == ChatSession.id)
+            ).limit(batch_sessions)
+        ).scalars().all()
+        if not session_ids:
+            return 0
+        rows = conn.execute(
+            select(*CHAT_COLUMNS).where(ChatHistory.session_id.in_(session_ids))
+            .order_by(ChatHistory.session_id, ChatHistory.timestamp, ChatHistory.id)
+        ).all()
+
+    by_session: Dict[int, List[ChatRecord]] = defaultdict(list)
+    for row in rows:
+        by_session[row.session_id].append(ChatRecord._make(row))
+
+    # Write and sync the segment before the rows are deleted; a crash in between
+    # leaves unreferenced bytes in the segment and the turns still in the database
+    segment = _current_segment()
+    entries = []
+    with open(_segment_path(segment), "ab") as f:
+        byte_offset = f.tell()
+        for session_id, turns in by_session.items():
+            data = _encode(turns)
+            f.write(data)
+            entries.append({
+                "user_id": turns[0].user_id,
+                "session_id": session_id,
+                "segment": segment,
+                "byte_offset": byte_offset,
+                "byte_length": len(data),
+                "turn_count": len(turns),
+                "first_timestamp": turns[0].timestamp,
+                "last_timestamp": turns[-1].timestamp,
+            })
+            byte_offset += len(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    # Delete by id so a turn added to one of these conversations meanwhile stays in the database
+    chat_ids = [row.id for row in rows]
+    with engine.begin() as conn:
+        conn.execute(insert(ChatArchive), entries)
+        unindex_chats(conn, chat_ids)
+        for start in range(0, len(chat_ids), 500):
+            conn.execute(delete(ChatHistory).where(ChatHistory.id.in_(chat_ids[start:start + 500])))
+    return len(chat_ids)
+
+def archive_cold_sessions(older_than_days: int = ARCHIVE_AFTER_DAYS,
+                          batch_sessions: int = ARCHIVE_BATCH_SESSIONS) -> int:
+    """Move the turns of conversations inactive for `older_than_days` days into segment files.
+
+    The conversations stay listed in chat_sessions and their turns are still
+    returned by the history reads in read_models, but they are no longer
+    found by search. Turns without a conversation are left in place. Returns
+    the number of turns archived.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=older_than_days)
+    archived = 0
+    with _write_lock:
+        while True:
+            count = _archive_batch(cutoff, batch_sessions)
+            if not count:
+                break
+            archived += count
+    logger.info(f"Archived {archived} turns of conversations inactive since {cutoff:%Y-%m-%d}")
+    return archived
+
+if __name__ == "__main__":
+    import sys
+    from db import create_tables
+    logging.basicConfig(level=logging.INFO)
+    create_tables()
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+    print(f"Archived {archive_cold_sessions(days)} turns")
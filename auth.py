@@ -1,43 +1,45 @@
-import hashlib
 import secrets
 import uuid
 import re
 import logging
 from datetime import datetime, timedelta
-from sqlalchemy.exc import SQLAlchemyError
-from db import User, get_db
+from itertools import islice
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from db import User, engine, get_db, get_read_db
+from read_models import USER_COLUMNS, UserRecord, fetch_user_by_email, fetch_user_by_username
+from exception import ResourceExhaustedError, UserExistsError
+from config import USER_IMPORT_BATCH_SIZE
+import kdf
 
 logger = logging.getLogger(__name__)
 
 # Authentication functions
-def hash_password(password):
-    """Hash a password for storing."""
+def hash_password(password, key=None, ip=None):
+    """Hash a password for storing.
+
+    Runs on the password hashing pool; `key` (usually the username) and `ip`
+    (the client's address) bound how many hashes one account or client can
+    have in flight. Raises ResourceExhaustedError when the pool is saturated.
+    """
     try:
-        salt = secrets.token_hex(16)  # Increased salt length for better security
-        # Use a more secure hashing method with more iterations
-        pwdhash = hashlib.pbkdf2_hmac(
-            'sha256', 
-            password.encode(), 
-            salt.encode(), 
-            100000  # More iterations for increased security
-        ).hex()
-        return f"{salt}${pwdhash}"
+        return kdf.hash_password(password, key, ip)
+    except ResourceExhaustedError:
+        raise
     except Exception as e:
         logger.error(f"Password hashing error: {str(e)}")
         raise Exception("Error securing password")
 
-def verify_password(stored_password, provided_password):
-    """Verify a stored password against a provided password."""
+def verify_password(stored_password, provided_password, key=None, ip=None):
+    """Verify a stored password against a provided password.
+
+    Raises ResourceExhaustedError when the hashing pool is too busy to
+    answer in time, rather than reporting the password as wrong.
+    """
     try:
-        salt, stored_hash = stored_password.split('$')
-        # Use the same hashing method as in hash_password
-        pwdhash = hashlib.pbkdf2_hmac(
-            'sha256', 
-            provided_password.encode(), 
-            salt.encode(), 
-            100000
-        ).hex()
-        return pwdhash == stored_hash
+        return kdf.verify_password(stored_password, provided_password, key, ip)
+    except ResourceExhaustedError:
+        raise
     except Exception as e:
         logger.error(f"Password verification error: {str(e)}")
         return False
@@ -69,8 +71,8 @@ def validate_email(email):
 def get_user_by_username(username):
     """Get a user by username."""
     try:
-        with get_db() as db:
-            return db.query(User).filter(User.username == username).first()
+        with get_read_db() as db:
+            return fetch_user_by_username(db, username)
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_user_by_username: {str(e)}")
         raise Exception("Database error occurred")
@@ -81,8 +83,8 @@ def get_user_by_username(username):
 def get_user_by_email(email):
     """Get a user by email."""
     try:
-        with get_db() as db:
-            return db.query(User).filter(User.email == email).first()
+        with get_read_db() as db:
+            return fetch_user_by_email(db, email)
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_user_by_email: {str(e)}")
         raise Exception("Database error occurred")
@@ -90,8 +92,14 @@ def get_user_by_email(email):
         logger.error(f"Error in get_user_by_email: {str(e)}")
         raise Exception("Error retrieving user information")
 
-def create_user(username, email, password):
-    """Create a new user."""
+def create_user(username, email, password, ip=None):
+    """Create a new user.
+
+    The password is hashed on the hashing pool before the transaction opens,
+    and the user is created with a single INSERT: the unique indexes on
+    username and email decide conflicts, so two concurrent signups for one
+    name cannot both succeed. Raises UserExistsError if either is taken.
+    """
     try:
         # Validate inputs
         if not username or not email or not password:
@@ -102,66 +110,121 @@ def create_user(username, email, password):
             logger.warning(f"Invalid email format: {email}")
             return None
         
-        with get_db() as db:
-            # Check if username already exists
-            existing_username = db.query(User).filter(User.username == username).first()
-            if existing_username:
-                logger.info(f"Registration attempt with existing username: {username}")
-                return None
-            
-            # Check if email already exists
-            existing_email = db.query(User).filter(User.email == email).first()
-            if existing_email:
-                logger.info(f"Registration attempt with existing email: {email}")
-                return None
-            
-            # Hash password and create user
-            hashed_password = hash_password(password)
-            user = User(username=username, email=email, hashed_password=hashed_password)
-            
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-            
-            logger.info(f"New user created: {username}")
-            return user
+        hashed_password = hash_password(password, key=username, ip=ip)
+        
+        with engine.begin() as conn:
+            row = conn.execute(
+                insert(User).values(username=username, email=email, hashed_password=hashed_password)
+                .returning(*USER_COLUMNS)
+            ).one()
+        
+        logger.info(f"New user created: {username}")
+        return UserRecord._make(row)
     
+    except IntegrityError:
+        logger.info(f"Registration attempt with existing username or email: {username}")
+        raise UserExistsError("Username or email already exists. Please choose another one.")
+    except ResourceExhaustedError:
+        raise
     except SQLAlchemyError as e:
         logger.error(f"Database error in create_user: {str(e)}")
-        if 'db' in locals():
-            db.rollback()
         return None
     except Exception as e:
         logger.error(f"Error in create_user: {str(e)}")
-        if 'db' in locals():
-            db.rollback()
         return None
 
-def authenticate_user(username, password):
-    """Authenticate a user."""
+def _insert_ignoring_existing(conn, rows):
+    """Insert user rows, skipping any whose username or email is taken; returns how many were created."""
+    dialect = conn.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(User).on_conflict_do_nothing().returning(User.id)
+        return len(conn.execute(statement, rows).all())
+    
+    # No portable ON CONFLICT: one savepoint per row
+    created = 0
+    for row in rows:
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(User), row)
+            created += 1
+        except IntegrityError:
+            pass
+    return created
+
+def bulk_create_users(users, batch_size=USER_IMPORT_BATCH_SIZE):
+    """Create many users from (username, email, password) tuples, e.g. when provisioning accounts.
+
+    Passwords are hashed a batch at a time across all hashing workers and
+    each batch is inserted in one statement. Users whose username or email
+    is already taken, and rows with missing fields or an invalid email, are
+    skipped. Returns the number of users created.
+    """
+    created = skipped = 0
+    users = iter(users)
+    while True:
+        batch = list(islice(users, batch_size))
+        if not batch:
+            break
+        valid = [(username, email, password) for username, email, password in batch
+                 if username and email and password and validate_email(email)]
+        skipped += len(batch) - len(valid)
+        if not valid:
+            continue
+        
+        hashed_passwords = kdf.hash_passwords([password for _, _, password in valid])
+        rows = [
+            {"username": username, "email": email, "hashed_password": hashed_password}
+            for (username, email, _), hashed_password in zip(valid, hashed_passwords)
+        ]
+        try:
+            with engine.begin() as conn:
+                batch_created = _insert_ignoring_existing(conn, rows)
+        except SQLAlchemyError as e:
+            logger.error(f"Database error in bulk_create_users: {str(e)}")
+            raise Exception("Database error occurred")
+        created += batch_created
+        skipped += len(rows) - batch_created
+    
+    logger.info(f"Bulk import created {created} users, skipped {skipped}")
+    return created
+
+def authenticate_user(username, password, ip=None):
+    """Authenticate a user; `ip` is the client's address, for hashing admission."""
     try:
         if not username or not password:
             return None
         
-        with get_db() as db:
-            user = db.query(User).filter(User.username == username).first()
+        with get_read_db() as db:
+            user = fetch_user_by_username(db, username)
             
-            if not user:
-                logger.info(f"Authentication attempt for non-existent user: {username}")
-                return None
-            
-            if not verify_password(user.hashed_password, password):
-                logger.info(f"Failed authentication for user: {username}")
-                return None
-            
-            # Update last login time and login count
-            user.last_login = datetime.utcnow()
-            user.login_count += 1
+        if not user:
+            logger.info(f"Authentication attempt for non-existent user: {username}")
+            return None
+        
+        if not verify_password(user.hashed_password, password, key=username, ip=ip):
+            logger.info(f"Failed authentication for user: {username}")
+            return None
+        
+        # Update last login time and login count
+        last_login = datetime.utcnow()
+        values = {"last_login": last_login, "login_count": func.coalesce(User.login_count, 0) + 1}
+        if kdf.needs_rehash(user.hashed_password):
+            # The password is at hand only now, so older hashes are upgraded at login
+            values["hashed_password"] = hash_password(password, key=username, ip=ip)
+        with get_db() as db:
+            db.execute(update(User).where(User.id == user.id).values(**values))
             db.commit()
             
-            logger.info(f"Successful authentication for user: {username}")
-            return user
+        logger.info(f"Successful authentication for user: {username}")
+        return user._replace(last_login=last_login, login_count=(user.login_count or 0) + 1,
+                             hashed_password=values.get("hashed_password", user.hashed_password))
     
+    except ResourceExhaustedError:
+        raise
     except SQLAlchemyError as e:
         logger.error(f"Database error in authenticate_user: {str(e)}")
         if 'db' in locals():
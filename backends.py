@@ -0,0 +1,326 @@
+import os
+import abc
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Union
+from dotenv import load_dotenv
+from exception import LLMError, ModelResponseError
+from http_client import HTTPTransport
+from config import (
+    HF_MODEL_NAME,
+    HF_API_BASE_URL,
+    LLM_BACKEND,
+    LLM_FALLBACK_BACKEND,
+    LOCAL_MODEL_PATH,
+    LOCAL_MODEL_NAME,
+    LOCAL_N_THREADS,
+    LOCAL_CONTEXT_SIZE,
+)
+
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+class LLMBackend(abc.ABC):
+    """Interface shared by every text-generation backend used by the Chatbot.
+
+    Subclasses implement generate() and usually stream(); the remaining methods
+    fall back to those so every backend supports the same streaming, batching
+    and caching hooks.
+    """
+
+    name = "base"
+    # Whether generate_batch runs the prompts as one batch on the model, so that
+    # grouping requests in a MicroBatcher pays off; the fallback only runs
+    # generate() for each prompt concurrently
+    supports_batching = False
+
+    def __init__(self, model_name: str, generation_params: Dict[str, Any]):
+        self.model_name = model_name
+        self.generation_params = generation_params
+
+    @abc.abstractmethod
+    def generate(self, prompt: str) -> str:
+        """Generate a complete reply."""
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield the reply in chunks as it is generated."""
+        yield self.generate(prompt)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """Asynchronously yield the reply in chunks."""
+        yield await asyncio.to_thread(self.generate, prompt)
+
+    def generate_batch(self, prompts: List[str]) -> List[Union[str, Exception]]:
+        """Generate replies for several prompts, returning exceptions in place of failed replies."""
+        with ThreadPoolExecutor(max_workers=max(1, len(prompts)), thread_name_prefix=f"{self.name}-batch") as pool:
+            futures = [pool.submit(self.generate, prompt) for prompt in prompts]
+        results: List[Union[str, Exception]] = []
+        for future in futures:
+            error = future.exception()
+            results.append(future.result() if error is None else error)
+        return results
+
+class HuggingFaceBackend(LLMBackend):
+    """Hosted Hugging Face inference endpoint through LangChain."""
+
+    name = "huggingface"
+
+    def __init__(self, model_name: str, generation_params: Dict[str, Any]):
+        super().__init__(model_name, generation_params)
+        from langchain_huggingface import ChatHuggingFace, HuggingFaceEndpoint
+
+        if os.getenv('HF_TOKEN'):
+            os.environ["HUGGINGFACEHUB_API_TOKEN"] = os.getenv('HF_TOKEN')
+
+        self.llm = HuggingFaceEndpoint(
+            repo_id=model_name,
+            task="text-generation",
+            **generation_params
+        )
+        self.chat_model = ChatHuggingFace(llm=self.llm)
+
+    def generate(self, prompt: str) -> str:
+        return self.chat_model.invoke(prompt).content
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        for chunk in self.chat_model.stream(prompt):
+            if chunk.content:
+                yield chunk.content
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        async for chunk in self.chat_model.astream(prompt):
+            if chunk.content:
+                yield chunk.content
+
+    def generate_batch(self, prompts: List[str]) -> List[Union[str, Exception]]:
+        results = self.chat_model.batch(prompts, return_exceptions=True)
+        return [result if isinstance(result, Exception) else result.content for result in results]
+
+class HuggingFaceHTTPBackend(LLMBackend):
+    """Hosted Hugging Face model called through the managed HTTP transport.
+
+    Talks to the OpenAI-compatible chat completions API served by the Hugging
+    Face router and by dedicated TGI endpoints, reusing pooled keep-alive
+    connections with retries, timeouts and a circuit breaker. It is never
+    micro-batched: the API takes one conversation per request, and the
+    endpoints batch concurrent requests on the server.
+    """
+
+    name = "huggingface_http"
+
+    def __init__(self, model_name: str, generation_params: Dict[str, Any], base_url: str = HF_API_BASE_URL):
+        super().__init__(model_name, generation_params)
+        headers = {"Authorization": f"Bearer {os.getenv('HF_TOKEN')}"} if os.getenv('HF_TOKEN') else {}
+        self.transport = HTTPTransport(headers=headers)
+        self.url = f"{base_url.rstrip('/')}/chat/completions"
+
+    def _payload(self, prompt: str, stream: bool) -> Dict[str, Any]:
+        params = self.generation_params
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": params.get("max_new_tokens"),
+            "stream": stream,
+        }
+        if params.get("do_sample", True):
+            payload["temperature"] = params.get("temperature")
+        return payload
+
+    def generate(self, prompt: str) -> str:
+        data = self.transport.post_json(self.url, self._payload(prompt, stream=False))
+        try:
+            return data["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            raise ModelResponseError()
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        for event in self.transport.stream_events(self.url, self._payload(prompt, stream=True)):
+            choices = event.get("choices") or [{}]
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                yield content
+
+class LlamaCppBackend(LLMBackend):
+    """Quantized GGUF model served in-process on CPU by llama.cpp."""
+
+    name = "llama_cpp"
+
+    def __init__(self, model_name: str, generation_params: Dict[str, Any]):
+        super().__init__(model_name, generation_params)
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            raise LLMError("The llama_cpp backend requires the llama-cpp-python package")
+
+        self.llm = Llama(model_path=model_name, n_ctx=LOCAL_CONTEXT_SIZE, n_threads=LOCAL_N_THREADS, verbose=False)
+        # A llama.cpp context can only run one generation at a time
+        self._lock = threading.Lock()
+
+    def _completion(self, prompt: str, stream: bool):
+        params = self.generation_params
+        return self.llm.create_chat_completion(
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=params.get("max_new_tokens"),
+            temperature=params.get("temperature", 0.7) if params.get("do_sample", True) else 0.0,
+            repeat_penalty=params.get("repetition_penalty", 1.0),
+            typical_p=params.get("typical_p", 1.0),
+            stream=stream,
+        )
+
+    def generate(self, prompt: str) -> str:
+        with self._lock:
+            return self._completion(prompt, stream=False)["choices"][0]["message"]["content"]
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        with self._lock:
+            for chunk in self._completion(prompt, stream=True):
+                content = chunk["choices"][0]["delta"].get("content")
+                if content:
+                    yield content
+
+class TransformersBackend(LLMBackend):
+    """Small Hugging Face transformers model run in-process on CPU."""
+
+    name = "transformers"
+    supports_batching = True
+
+    def __init__(self, model_name: str, generation_params: Dict[str, Any]):
+        super().__init__(model_name, generation_params)
+        try:
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+        except ImportError:
+            raise LLMError("The transformers backend requires the transformers and torch packages")
+
+        torch.set_num_threads(LOCAL_N_THREADS)
+        # Left padding so batched prompts all end where generation starts
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side="left")
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(model_name)
+        self.model.eval()
+        self._lock = threading.Lock()
+
+    def _encode(self, prompts: List[str]):
+        texts = [
+            self.tokenizer.apply_chat_template([{"role": "user", "content": prompt}], tokenize=False,
+                                               add_generation_prompt=True)
+            if self.tokenizer.chat_template else prompt
+            for prompt in prompts
+        ]
+        return self.tokenizer(texts, return_tensors="pt", padding=True)
+
+    def _generate_kwargs(self) -> Dict[str, Any]:
+        params = self.generation_params
+        kwargs = {
+            "max_new_tokens": params.get("max_new_tokens"),
+            "do_sample": params.get("do_sample", False),
+            "repetition_penalty": params.get("repetition_penalty", 1.0),
+            "pad_token_id": self.tokenizer.pad_token_id,
+        }
+        if kwargs["do_sample"]:
+            kwargs["temperature"] = params.get("temperature", 1.0)
+            kwargs["typical_p"] = params.get("typical_p", 1.0)
+        return kwargs
+
+    def generate(self, prompt: str) -> str:
+        return self.generate_batch([prompt])[0]
+
+    def generate_batch(self, prompts: List[str]) -> List[Union[str, Exception]]:
+        inputs = self._encode(prompts)
+        with self._lock:
+            outputs = self.model.generate(**inputs, **self._generate_kwargs())
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        return self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        from transformers import TextIteratorStreamer
+
+        inputs = self._encode([prompt])
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors: List[Exception] = []
+
+        def run():
+            try:
+                with self._lock:
+                    self.model.generate(**inputs, **self._generate_kwargs(), streamer=streamer)
+            except Exception as e:
+                logger.error(f"Local generation failed: {str(e)}")
+                errors.append(e)
+                # Unblock the consumer rather than leaving it waiting forever
+                streamer.end()
+
+        threading.Thread(target=run, daemon=True).start()
+        for text in streamer:
+            if text:
+                yield text
+        if errors:
+            # Otherwise a failed generation would look like a short, complete reply
+            raise ModelResponseError(f"Local generation failed: {str(errors[0])}") from errors[0]
+
+class FailoverBackend(LLMBackend):
+    """Uses the primary backend and falls back to a second one when it fails.
+
+    A stream only fails over if the primary errors before producing any output,
+    so a reply is never stitched together from two different models.
+    """
+
+    name = "failover"
+
+    def __init__(self, primary: LLMBackend, fallback: LLMBackend):
+        super().__init__(f"{primary.model_name}|{fallback.model_name}", primary.generation_params)
+        self.primary = primary
+        self.fallback = fallback
+        self.supports_batching = primary.supports_batching
+
+    def generate(self, prompt: str) -> str:
+        try:
+            return self.primary.generate(prompt)
+        except Exception as e:
+            logger.warning(f"{self.primary.name} backend failed, falling back to {self.fallback.name}: {str(e)}")
+            return self.fallback.generate(prompt)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        started = False
+        try:
+            for chunk in self.primary.stream(prompt):
+                started = True
+                yield chunk
+        except Exception as e:
+            if started:
+                raise
+            logger.warning(f"{self.primary.name} backend failed, falling back to {self.fallback.name}: {str(e)}")
+            yield from self.fallback.stream(prompt)
+
+    def generate_batch(self, prompts: List[str]) -> List[Union[str, Exception]]:
+        try:
+            results = self.primary.generate_batch(prompts)
+        except Exception as e:
+            logger.warning(f"{self.primary.name} backend failed, falling back to {self.fallback.name}: {str(e)}")
+            return self.fallback.generate_batch(prompts)
+        return [self.fallback.generate(prompt) if isinstance(result, Exception) else result
+                for prompt, result in zip(prompts, results)]
+
+BACKENDS = {
+    HuggingFaceBackend.name: (HuggingFaceBackend, HF_MODEL_NAME),
+    HuggingFaceHTTPBackend.name: (HuggingFaceHTTPBackend, HF_MODEL_NAME),
+    LlamaCppBackend.name: (LlamaCppBackend, LOCAL_MODEL_PATH),
+    TransformersBackend.name: (TransformersBackend, LOCAL_MODEL_NAME),
+}
+
+def create_backend(generation_params: Dict[str, Any], name: str = LLM_BACKEND, model_name: Optional[str] = None,
+                   fallback: Optional[str] = LLM_FALLBACK_BACKEND) -> LLMBackend:
+    """Create the configured backend, wrapped with a fallback backend if one is set."""
+    if name not in BACKENDS:
+        raise LLMError(f"Unknown LLM backend: {name}")
+    backend_class, default_model = BACKENDS[name]
+    backend = backend_class(model_name or default_model, generation_params)
+    logger.info(f"Using {name} backend with model {backend.model_name}")
+
+    if fallback and fallback != name:
+        return FailoverBackend(backend, create_backend(generation_params, fallback, fallback=None))
+    return backend
@@ -0,0 +1,111 @@
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+from exception import ModelResponseError, ModelTimeoutError
+from config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, BATCH_TIMEOUT
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Takes a list of prompts, returns one result (or exception) per prompt, in order
+BatchFn = Callable[[List[str]], Sequence[Union[str, Exception]]]
+
+class MicroBatcher:
+    """Groups generation requests that arrive close together into one backend call.
+
+    A background thread waits for the first request, then keeps collecting
+    until either `max_batch_size` requests are waiting or `max_wait_ms` has
+    passed since the first one arrived. A larger window trades per-request
+    latency for fewer, fuller backend calls.
+
+    Only worth it for a model that runs a batch in about the time of one
+    prompt, i.e. the local transformers backend; the Chatbot uses it for
+    non-streaming requests to such backends only.
+    """
+
+    def __init__(self, batch_fn: BatchFn, max_batch_size: int = BATCH_MAX_SIZE,
+                 max_wait_ms: float = BATCH_MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: str) -> Future:
+        """Queue a prompt for the next batch."""
+        future: Future = Future()
+        self._queue.put((prompt, future))
+        return future
+
+    def generate(self, prompt: str, timeout: Optional[float] = BATCH_TIMEOUT) -> str:
+        """Queue a prompt and wait for its result; raises ModelTimeoutError after `timeout` seconds."""
+        future = self.submit(prompt)
+        try:
+            return future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            # Dropped from its batch if that has not started yet
+            future.cancel()
+            raise ModelTimeoutError(f"No batched result within {timeout}s")
+
+    def stats(self) -> Dict[str, float]:
+        """Report how many batches were sent and their average size."""
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "avg_batch_size": self._requests / self._batches if self._batches else 0.0,
+            }
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        """Block for the first request, then gather more until the batch is full or the window closes."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = [(prompt, future) for prompt, future in self._collect()
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start_time = time.time()
+            try:
+                results = self.batch_fn([prompt for prompt, _ in batch])
+            except Exception as e:
+                logger.error(f"Batched generation failed: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            if len(results) != len(batch):
+                error = ModelResponseError(f"Expected {len(batch)} batched results, got {len(results)}")
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+            with self._lock:
+                self._batches += 1
+                self._requests += len(batch)
+            logger.debug(f"Generated batch of {len(batch)} in {time.time() - start_time:.2f}s")
@@ -1,41 +1,183 @@
 import time
+import datetime
 import logging
+import threading
+import contextvars
 from functools import lru_cache
-from typing import Optional
-from langchain.chains import ConversationChain
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from langchain.memory import ConversationBufferMemory
-from langchain.llms import HuggingFaceHub
 from langchain.prompts import PromptTemplate
+from langchain_core.messages import BaseMessage, get_buffer_string
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import SQLAlchemyError
-import os
-from db import ChatHistory, get_db
-from config import HF_MODEL_NAME, MAX_NEW_TOKENS, TEMPERATURE
-from dotenv import load_dotenv
-load_dotenv()
-from langchain_huggingface import ChatHuggingFace, HuggingFaceEndpoint
-
-os.environ["HUGGINGFACEHUB_API_TOKEN"] = os.getenv('HF_TOKEN')
-
+from db import ChatHistory, ChatSession, get_db, get_read_db
+from read_models import fetch_recent_chats, fetch_session_turns
+from memory_store import ConversationMemoryStore
+from history_cache import invalidate_user_history
+from search import index_chats
+from history_window import HistoryWindow
+from response_cache import ResponseCache
+from semantic_cache import SemanticCache
+from batching import MicroBatcher
+from write_behind import get_write_behind
+from backends import LLMBackend, create_backend
+from exception import ModelResponseError
+from config import (
+    MAX_NEW_TOKENS, TEMPERATURE, HISTORY_LOAD_MAX_TURNS, HISTORY_PREVIEW_LENGTH, BATCHING_ENABLED, BATCH_TIMEOUT,
+    WRITE_BEHIND_ENABLED
+)
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+def _invalidate_history(rows: List[Dict]) -> None:
+    """Refresh the sidebar of every user whose queued turns were just written."""
+    for user_id in {row["user_id"] for row in rows}:
+        invalidate_user_history(user_id)
+
+# Per-turn update of a conversation's denormalized metadata, run once per saved turn
+_touch_session = (
+    update(ChatSession)
+    .where(ChatSession.id == bindparam("b_session_id"))
+    .values(
+        turn_count=func.coalesce(ChatSession.turn_count, 0) + 1,
+        last_activity=bindparam("b_timestamp"),
+        preview=func.coalesce(ChatSession.preview, bindparam("b_preview")),
+    )
+)
+
+def _record_turns(conn: Connection, rows: List[Dict]) -> None:
+    """Index newly inserted turns and update their conversations, in the inserting transaction."""
+    index_chats(conn, rows)
+    touched = [
+        {
+            "b_session_id": row["session_id"],
+            "b_timestamp": row["timestamp"],
+            "b_preview": (row["user_message"] or "")[:HISTORY_PREVIEW_LENGTH + 1],
+        }
+        for row in rows if row.get("session_id") is not None
+    ]
+    if touched:
+        conn.execute(_touch_session, touched)
+
+class _Flight:
+    """An in-flight upstream call whose output is shared by every caller with the same key."""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.waiters = 0
+        self.cancelled = False
+        self.condition = threading.Condition()
+
+class SingleFlight:
+    """Collapses concurrent identical requests onto a single upstream call.
+
+    The first caller for a key starts the call in a producer thread; every
+    caller, the first included, reads its chunks from the start as they
+    arrive and receives the same result or error. The call belongs to no one
+    caller: it carries on while anyone is still reading and is cancelled
+    only when the last of them stops.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], str]) -> str:
+        """Return fn()'s result, sharing it with concurrent callers for the same key."""
+        return "".join(self.stream(key, lambda: iter([fn()])))
+
+    def stream(self, key: str, gen_fn: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """Yield gen_fn()'s chunks, sharing them with concurrent callers for the same key."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            flight.waiters += 1
+
+        if leader:
+            # Run with the caller's context variables (e.g. logging correlation IDs)
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._produce, key, flight, gen_fn),
+                             name="single-flight", daemon=True).start()
+        else:
+            logger.debug(f"Joined in-flight request {key[:12]}")
+        try:
+            yield from self._follow(flight)
+        finally:
+            self._leave(key, flight)
+
+    def _produce(self, key: str, flight: _Flight, gen_fn: Callable[[], Iterator[str]]) -> None:
+        stream = None
+        try:
+            stream = gen_fn()
+            for chunk in stream:
+                with flight.condition:
+                    if flight.cancelled:
+                        break
+                    flight.chunks.append(chunk)
+                    flight.condition.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                # Stops the upstream call if everyone left before it finished
+                stream.close()
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+    def _leave(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters or flight.done:
+                return
+            # Nobody is left to read the result; later callers start a new call
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.condition:
+            flight.cancelled = True
+        logger.debug(f"Cancelled in-flight request {key[:12]}; every caller left")
+
+    def _follow(self, flight: _Flight) -> Iterator[str]:
+        index = 0
+        while True:
+            with flight.condition:
+                while index >= len(flight.chunks) and not flight.done:
+                    flight.condition.wait()
+                new_chunks = flight.chunks[index:]
+                finished = flight.done
+            for chunk in new_chunks:
+                yield chunk
+            index += len(new_chunks)
+            if finished:
+                break
+        if flight.error is not None:
+            raise flight.error
+
 class Chatbot:
-    def __init__(self, model_name=HF_MODEL_NAME):
-        """Initialize the chatbot with a specified model."""
+    def __init__(self, model_name: Optional[str] = None, backend: Optional[LLMBackend] = None):
+        """Initialize the chatbot with the configured backend, or the one given."""
         try:
-            # Initialize the LLM
-            self.llm = HuggingFaceEndpoint(
-                repo_id=model_name,
-                task="text-generation",
-                max_new_tokens=700,
-                do_sample=False,
-                repetition_penalty=1.03,
-                temperature = TEMPERATURE,
-                typical_p = 0.95
-            )
-        
-            self.chat_model = ChatHuggingFace(llm=self.llm)  
+            # Generation parameters are also part of the response cache key
+            self.generation_params = {
+                "max_new_tokens": 700,
+                "do_sample": False,
+                "repetition_penalty": 1.03,
+                "temperature": TEMPERATURE,
+                "typical_p": 0.95,
+            }
+
+            # Initialize the LLM backend (hosted endpoint or local model, see LLM_BACKEND)
+            self.backend = backend or create_backend(self.generation_params, model_name=model_name)
+            self.model_name = self.backend.model_name
     
             # Set up the conversation template
             template = """The following is a friendly conversation between a human and an AI assistant.
@@ -50,29 +192,124 @@ AI: """
                 template=template
             )
             
-            self.memory = ConversationBufferMemory(return_messages=True)
-            self.conversation = ConversationChain(
-                llm=self.chat_model,
-                prompt=self.prompt,
-                memory=self.memory,
-                verbose=False
-            )
-            logger.info(f"Chatbot initialized with model: {model_name}")
+            # Conversation memories are kept per (user, session) rather than shared
+            self.memories = ConversationMemoryStore()
+            # Only the most recent turns that fit the token budget are sent to the model
+            self.history_window = HistoryWindow(summarizer=self._summarize_history)
+            self.response_cache = ResponseCache()
+            self.semantic_cache = SemanticCache()
+            self.inflight = SingleFlight()
+            # Optionally group concurrent non-streaming requests into batched backend calls. Only the local
+            # transformers backend batches natively; the others would run a batch's prompts one call each
+            # (hosted endpoints batch concurrent requests on the server), so they are called directly
+            self.batcher = (MicroBatcher(self.backend.generate_batch)
+                            if BATCHING_ENABLED and self.backend.supports_batching else None)
+            logger.info(f"Chatbot initialized with model: {self.model_name}")
         except Exception as e:
             logger.error(f"Failed to initialize chatbot: {str(e)}")
             raise
 
-    def get_response(self, user_input: str, user_id: Optional[int] = None) -> str:
+    def get_memory(self, user_id: Optional[int], session_id: Optional[str] = None,
+                   chat_session_id: Optional[int] = None) -> ConversationBufferMemory:
+        """Get the conversation memory for a user session, loading it from the database on a miss."""
+        def loader(memory: ConversationBufferMemory) -> None:
+            # A fresh memory holds new message objects, so any summary of the old ones is stale
+            self.history_window.forget((user_id, session_id))
+            if user_id:
+                self._fill_memory(memory, user_id, chat_session_id)
+
+        return self.memories.get(user_id, session_id, loader=loader)
+
+    def _prepare(self, user_input: str, user_id: Optional[int], session_id: Optional[str],
+                 chat_session_id: Optional[int]) -> Tuple[ConversationBufferMemory, str, str, bool]:
+        """Look up the session memory and render the prompt and its cache key.
+
+        Also reports whether the question is standalone, i.e. asked without any
+        prior conversation that its answer could depend on.
+        """
+        memory = self.get_memory(user_id, session_id, chat_session_id)
+        history = self.history_window.render((user_id, session_id), memory.chat_memory.messages)
+        prompt = self.prompt.format(history=history, input=user_input)
+        cache_key = self.response_cache.make_key(self.model_name, self.generation_params, user_input, history)
+        return memory, prompt, cache_key, not history
+
+    def _get_cached(self, user_input: str, cache_key: str, standalone: bool) -> Optional[str]:
+        """Check the exact-match cache, then, for standalone questions, the semantic cache.
+
+        A follow-up's answer depends on the conversation before it, which the
+        semantic cache does not see, so follow-ups never use it.
+        """
+        response = self.response_cache.get(cache_key)
+        if response is None and standalone:
+            response = self.semantic_cache.lookup(user_input, self._semantic_namespace())
+        return response
+
+    def _set_cached(self, user_input: str, cache_key: str, response: str, standalone: bool) -> None:
+        """Store a fresh response; only standalone answers are reused for paraphrases."""
+        self.response_cache.set(cache_key, self.model_name, response)
+        if standalone:
+            self.semantic_cache.add(user_input, response, self._semantic_namespace())
+
+    def _semantic_namespace(self) -> str:
+        # Answers are only reused for the model and parameters that produced them
+        return self.semantic_cache.make_namespace(self.model_name, self.generation_params)
+
+    def _generate(self, prompt: str, user_input: str, cache_key: str, standalone: bool, use_cache: bool) -> str:
+        """Call the model once and cache the result."""
+        if self.batcher is not None:
+            response = self.batcher.generate(prompt, timeout=BATCH_TIMEOUT)
+        else:
+            response = self.backend.generate(prompt)
+        if use_cache:
+            self._set_cached(user_input, cache_key, response, standalone)
+        return response
+
+    def _generate_stream(self, prompt: str, user_input: str, cache_key: str, standalone: bool,
+                         use_cache: bool) -> Iterator[str]:
+        """Stream the model's reply and cache it once complete."""
+        chunks = []
+        for chunk in self.backend.stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+        if use_cache:
+            self._set_cached(user_input, cache_key, "".join(chunks), standalone)
+
+    def _summarize_history(self, summary: str, messages: List[BaseMessage]) -> str:
+        """Fold older conversation turns into a rolling summary."""
+        prompt = (
+            "Progressively summarize the conversation below, adding onto the previous summary. "
+            "Keep the new summary brief.\n\n"
+            f"Previous summary:\n{summary or '(none)'}\n\n"
+            f"New lines of conversation:\n{get_buffer_string(messages)}\n\n"
+            "New summary:"
+        )
+        return self.backend.generate(prompt).strip()
+
+    def _finish_response(self, memory: ConversationBufferMemory, user_input: str, response: str,
+                         user_id: Optional[int], start_time: float, chat_session_id: Optional[int]) -> None:
+        """Record a completed exchange in memory and in the database."""
+        memory.save_context({"input": user_input}, {"output": response})
+
+        # Save the conversation to the database if user_id is provided
+        if user_id:
+            self.save_conversation(user_id, user_input, response, int((time.time() - start_time) * 1000),
+                                   chat_session_id)
+
+    def get_response(self, user_input: str, user_id: Optional[int] = None, session_id: Optional[str] = None,
+                     use_cache: bool = True, chat_session_id: Optional[int] = None) -> str:
         """Get a response from the chatbot."""
         start_time = time.time()
         
         try:
-            # Get response from the model
-            response = self.conversation.predict(input=user_input)
-            
-            # Save the conversation to the database if user_id is provided
-            if user_id:
-                self.save_conversation(user_id, user_input, response)
+            memory, prompt, cache_key, standalone = self._prepare(user_input, user_id, session_id, chat_session_id)
+
+            response = self._get_cached(user_input, cache_key, standalone) if use_cache else None
+            if response is None:
+                # Get response from the model; identical concurrent requests share one call
+                response = self.inflight.do(
+                    cache_key, lambda: self._generate(prompt, user_input, cache_key, standalone, use_cache)
+                )
+            self._finish_response(memory, user_input, response, user_id, start_time, chat_session_id)
                 
             logger.info(f"Response generated in {time.time() - start_time:.2f}s")
             return response
@@ -82,21 +319,99 @@ AI: """
             logger.error(f"Error generating response: {str(e)}")
             return error_msg
 
-    def save_conversation(self, user_id: int, user_message: str, bot_response: str) -> bool:
-        """Save the conversation to the database."""
+    def stream_response(self, user_input: str, user_id: Optional[int] = None, session_id: Optional[str] = None,
+                        use_cache: bool = True, chat_session_id: Optional[int] = None) -> Iterator[str]:
+        """Stream a response from the chatbot token by token.
+
+        The full reply is only added to memory and saved once generation has
+        completed; a stream abandoned part-way through is not persisted.
+        """
+        start_time = time.time()
+        first_token_time = None
+        chunks = []
+
+        try:
+            memory, prompt, cache_key, standalone = self._prepare(user_input, user_id, session_id, chat_session_id)
+
+            cached = self._get_cached(user_input, cache_key, standalone) if use_cache else None
+            if cached is not None:
+                yield cached
+                self._finish_response(memory, user_input, cached, user_id, start_time, chat_session_id)
+                logger.info(f"Response served from cache in {time.time() - start_time:.3f}s")
+                return
+
+            # Identical concurrent requests share one upstream stream
+            stream = self.inflight.stream(
+                cache_key, lambda: self._generate_stream(prompt, user_input, cache_key, standalone, use_cache)
+            )
+            for chunk in stream:
+                if first_token_time is None:
+                    first_token_time = time.time()
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            if not chunks:
+                yield "Sorry, I'm having trouble generating a response. Please try again."
+            else:
+                # The partial reply is shown but not saved, so say it was cut short
+                yield "\n\n_The response was interrupted. Please try again._"
+            return
+
+        self._finish_response(memory, user_input, "".join(chunks), user_id, start_time, chat_session_id)
+        if first_token_time is not None:
+            logger.info(f"Response streamed in {time.time() - start_time:.2f}s "
+                        f"(first token after {first_token_time - start_time:.2f}s)")
+
+    def create_chat_session(self, user_id: int) -> Optional[int]:
+        """Start a new conversation for a user and return its id."""
         try:
             with get_db() as db:
-                # Calculate response time in milliseconds
-                response_time = int(time.time() * 1000)
-                
-                chat_history = ChatHistory(
-                    user_id=user_id,
-                    user_message=user_message,
-                    bot_response=bot_response,
-                    response_time=response_time
-                )
+                now = datetime.datetime.utcnow()
+                chat_session = ChatSession(user_id=user_id, created_at=now, last_activity=now, turn_count=0)
+                db.add(chat_session)
+                db.flush()
+                chat_session_id = chat_session.id
+                db.commit()
+                logger.info(f"Chat session {chat_session_id} created for user {user_id}")
+                return chat_session_id
+        except SQLAlchemyError as e:
+            logger.error(f"Database error creating chat session: {str(e)}")
+            return None
+
+    def save_conversation(self, user_id: int, user_message: str, bot_response: str,
+                          response_time: Optional[int] = None, chat_session_id: Optional[int] = None) -> bool:
+        """Save the conversation to the database.
+
+        `response_time` is how long the reply took, in milliseconds. The turn
+        is added to `chat_session_id`'s conversation, whose turn count, last
+        activity and preview are updated in the same transaction. With
+        write-behind enabled the row is queued and inserted in the background,
+        so this returns before the commit.
+        """
+        try:
+            row = {
+                "user_id": user_id,
+                "session_id": chat_session_id,
+                "user_message": user_message,
+                "bot_response": bot_response,
+                "response_time": response_time,
+                # Stamp now so turns keep their order however they are batched
+                "timestamp": datetime.datetime.utcnow(),
+            }
+            if WRITE_BEHIND_ENABLED:
+                get_write_behind().put(ChatHistory.__table__, row,
+                                       on_written=_invalidate_history, in_transaction=_record_turns)
+                logger.info(f"Conversation queued for user {user_id}")
+                return True
+
+            with get_db() as db:
+                chat_history = ChatHistory(**row)
                 db.add(chat_history)
+                db.flush()
+                _record_turns(db.connection(), [{**row, "id": chat_history.id}])
                 db.commit()
+                invalidate_user_history(user_id)
                 logger.info(f"Conversation saved for user {user_id}")
                 return True
                 
@@ -107,27 +422,42 @@ AI: """
             logger.error(f"Unexpected error saving conversation: {str(e)}")
             return False
     
-    def load_conversation_history(self, user_id: int) -> bool:
-        """Load conversation history for a specific user."""
+    def _fill_memory(self, memory: ConversationBufferMemory, user_id: int, chat_session_id: Optional[int]) -> int:
+        """Load the most recent stored turns of a conversation, or of all the user's turns, into memory."""
+        with get_read_db() as db:
+            if chat_session_id is not None:
+                history = fetch_session_turns(db, user_id, chat_session_id, None, HISTORY_LOAD_MAX_TURNS)
+            else:
+                history = fetch_recent_chats(db, user_id, HISTORY_LOAD_MAX_TURNS)
+
+        for chat in history:
+            memory.save_context({"input": str(chat.user_message)}, {"output": str(chat.bot_response)})
+        return len(history)
+
+    def load_conversation_history(self, user_id: int, session_id: Optional[str] = None,
+                                  chat_session_id: Optional[int] = None) -> bool:
+        """Load conversation history for a specific user session.
+
+        With `chat_session_id` only that conversation's turns are loaded.
+        """
         try:
-            with get_db() as db:
-                history = db.query(ChatHistory).filter(
-                    ChatHistory.user_id == user_id
-                ).order_by(ChatHistory.timestamp).all()
-            
-            # Reset the current memory
-            self.memory.clear()
+            # Reset the memory for this session only
+            memory = self.memories.reset(user_id, session_id)
+            self.history_window.forget((user_id, session_id))
+            count = self._fill_memory(memory, user_id, chat_session_id)
             
-            # Add history to memory
-            for chat in history:
-                self.memory.save_context({"input": chat.user_message}, {"output": chat.bot_response})
-            
-            logger.info(f"Loaded {len(history)} conversation records for user {user_id}")
+            logger.info(f"Loaded {count} conversation records for user {user_id}, session {session_id}")
             return True
         except Exception as e:
             logger.error(f"Error loading conversation history: {str(e)}")
             return False
 
+    def reset_memory(self, user_id: Optional[int], session_id: Optional[str] = None) -> None:
+        """Forget the in-process memory for a user session."""
+        self.memories.discard(user_id, session_id)
+        self.history_window.forget((user_id, session_id))
+        logger.info(f"Memory reset for user {user_id}, session {session_id}")
+
 # Create a cached chatbot instance for better performance
 @lru_cache(maxsize=1)
 def get_chatbot():
@@ -0,0 +1,255 @@
+import zlib
+import threading
+import time
+import logging
+from collections import UserString
+from typing import Dict, Optional, Union
+from sqlalchemy import Text, bindparam, insert, select, text, update
+from sqlalchemy.types import TypeDecorator
+from config import (
+    COMPRESSION_ENABLED,
+    COMPRESSION_MIN_BYTES,
+    COMPRESSION_LEVEL,
+    COMPRESSION_DICT_SIZE,
+    COMPRESSION_TRAINING_SAMPLES,
+    COMPRESSION_DICT_RECHECK_SECONDS,
+)
+
+try:
+    import zstandard
+except ImportError:
+    # Values are then compressed with zlib; zstd values already stored cannot be read
+    zstandard = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# A compressed body is stored as bytes: a one-byte codec tag, then the payload.
+# Everything else stays TEXT, so rows written before compression need no
+# conversion and reads tell the two apart by type alone.
+ZSTD_TAG = b"Z"
+ZLIB_TAG = b"z"
+
+class LazyText(UserString):
+    """A stored message body that is only decompressed when first used as text."""
+
+    def __init__(self, value: Union[str, bytes]):
+        # UserString builds slices and other derived strings through the constructor
+        self._payload, self._text = (None, value) if isinstance(value, str) else (value, None)
+
+    @property
+    def data(self) -> str:
+        if self._text is None:
+            self._text = decompress(self._payload)
+            self._payload = None
+        return self._text
+
+class _Dictionaries:
+    """The trained zstd dictionaries by id; the newest is used to compress.
+
+    A dictionary trained by another process (e.g. the command-line trainer)
+    is picked up for compression within `recheck_seconds`, and at once when
+    a value compressed with it is read.
+    """
+
+    def __init__(self, recheck_seconds: float = COMPRESSION_DICT_RECHECK_SECONDS):
+        self.recheck_seconds = recheck_seconds
+        self._by_id: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+        self._active: Optional["zstandard.ZstdCompressionDict"] = None
+        self._loaded = False
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        # A plain read-pool connection: this can run while the caller holds a session
+        from db import CompressionDictionary, read_engine
+        self._checked_at = time.monotonic()
+        try:
+            with read_engine.connect() as conn:
+                rows = conn.execute(select(CompressionDictionary.dict_id, CompressionDictionary.data)
+                                    .order_by(CompressionDictionary.created_at)).all()
+        except Exception as e:
+            logger.error(f"Failed to load compression dictionaries: {str(e)}")
+            rows = []
+        self._by_id = {dict_id: zstandard.ZstdCompressionDict(data) for dict_id, data in rows}
+        self._active = self._by_id[rows[-1][0]] if rows else None
+        self._loaded = True
+
+    def _newest_id(self) -> Optional[int]:
+        """The id of the newest stored dictionary; the same as the active one's if the check fails."""
+        from db import CompressionDictionary, read_engine
+        self._checked_at = time.monotonic()
+        try:
+            with read_engine.connect() as conn:
+                return conn.execute(select(CompressionDictionary.dict_id)
+                                    .order_by(CompressionDictionary.created_at.desc()).limit(1)).scalar()
+        except Exception as e:
+            logger.error(f"Failed to check for new compression dictionaries: {str(e)}")
+            return self._active.dict_id() if self._active is not None else None
+
+    def active(self) -> Optional["zstandard.ZstdCompressionDict"]:
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            elif time.monotonic() - self._checked_at >= self.recheck_seconds:
+                newest = self._newest_id()
+                if newest != (self._active.dict_id() if self._active is not None else None):
+                    self._load()
+            return self._active
+
+    def get(self, dict_id: int) -> "zstandard.ZstdCompressionDict":
+        with self._lock:
+            if dict_id not in self._by_id:
+                # Trained by another process since we loaded
+                self._load()
+            return self._by_id[dict_id]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._loaded = False
+
+_dictionaries = _Dictionaries()
+
+# zstd (de)compressor objects must not be shared between threads
+_local = threading.local()
+
+def _compressor(dictionary) -> "zstandard.ZstdCompressor":
+    cache = _local.__dict__.setdefault("compressors", {})
+    key = dictionary.dict_id() if dictionary is not None else 0
+    if key not in cache:
+        cache[key] = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dictionary)
+    return cache[key]
+
+def _decompressor(dictionary) -> "zstandard.ZstdDecompressor":
+    cache = _local.__dict__.setdefault("decompressors", {})
+    key = dictionary.dict_id() if dictionary is not None else 0
+    if key not in cache:
+        cache[key] = zstandard.ZstdDecompressor(dict_data=dictionary)
+    return cache[key]
+
+def compress(value: str) -> Union[str, bytes]:
+    """Compress a body of at least COMPRESSION_MIN_BYTES; others, and any that would not shrink, stay text."""
+    raw = value.encode("utf-8")
+    if len(raw) < COMPRESSION_MIN_BYTES:
+        return value
+    if zstandard is not None:
+        payload = ZSTD_TAG + _compressor(_dictionaries.active()).compress(raw)
+    else:
+        payload = ZLIB_TAG + zlib.compress(raw, COMPRESSION_LEVEL)
+    return payload if len(payload) < len(raw) else value
+
+def decompress(payload: bytes) -> str:
+    """Decode a value written by compress()."""
+    tag, body = payload[:1], payload[1:]
+    if tag == ZLIB_TAG:
+        return zlib.decompress(body).decode("utf-8")
+    if tag == ZSTD_TAG:
+        if zstandard is None:
+            raise RuntimeError("Reading compressed messages requires the zstandard package")
+        dict_id = zstandard.get_frame_parameters(body).dict_id
+        dictionary = _dictionaries.get(dict_id) if dict_id else None
+        return _decompressor(dictionary).decompress(body).decode("utf-8")
+    raise ValueError(f"Unknown compression tag {tag!r}")
+
+def stored_text(value: Union[str, bytes, None]) -> Optional[str]:
+    """The text of a value as stored in a CompressedText column."""
+    return decompress(value) if isinstance(value, bytes) else value
+
+class CompressedText(TypeDecorator):
+    """Text column that stores large values compressed and reads them back as LazyText.
+
+    Only SQLite values are compressed: server databases already compress
+    large values themselves (TOAST on Postgres).
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            # bytes are a value already in stored form, e.g. copied between rows
+            return value
+        if not COMPRESSION_ENABLED or dialect.name != "sqlite":
+            return str(value)
+        return compress(str(value))
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, bytes):
+            return LazyText(value)
+        return value
+
+def train_dictionary(sample_limit: int = COMPRESSION_TRAINING_SAMPLES,
+                     dict_size: int = COMPRESSION_DICT_SIZE) -> Optional[int]:
+    """Train a zstd dictionary on recent message bodies and compress new values with it.
+
+    Returns the new dictionary's id, or None if it could not be trained.
+    Earlier dictionaries are kept, since values compressed with them still
+    reference them.
+    """
+    from db import ChatHistory, CompressionDictionary, engine, read_engine
+    if zstandard is None:
+        logger.warning("Dictionary training requires the zstandard package")
+        return None
+    with read_engine.connect() as conn:
+        rows = conn.execute(select(ChatHistory.user_message, ChatHistory.bot_response)
+                            .order_by(ChatHistory.id.desc()).limit(sample_limit)).all()
+    samples = [str(body).encode("utf-8") for row in rows for body in row if body]
+    try:
+        dictionary = zstandard.train_dictionary(dict_size, samples)
+    except zstandard.ZstdError as e:
+        logger.warning(f"Could not train a compression dictionary from {len(samples)} samples: {str(e)}")
+        return None
+    with engine.begin() as conn:
+        conn.execute(insert(CompressionDictionary).values(dict_id=dictionary.dict_id(), data=dictionary.as_bytes()))
+    _dictionaries.reset()
+    logger.info(f"Trained compression dictionary {dictionary.dict_id()} from {len(samples)} samples")
+    return dictionary.dict_id()
+
+def compress_existing(batch_size: int = 500) -> int:
+    """Compress large bodies stored as plain text before compression was enabled (SQLite only).
+
+    Returns the number of rows rewritten. Run VACUUM afterwards to return the
+    freed pages to the file system.
+    """
+    from db import ChatHistory, engine
+    if engine.dialect.name != "sqlite":
+        logger.info(f"Compression is left to {engine.dialect.name}")
+        return 0
+    table = ChatHistory.__table__
+    rewrite = update(table).where(table.c.id == bindparam("b_id")).values(
+        user_message=bindparam("b_user_message"), bot_response=bindparam("b_bot_response")
+    )
+    candidates = text(
+        "SELECT id, user_message, bot_response FROM chat_history WHERE id > :last_id AND ("
+        "(typeof(user_message) = 'text' AND length(CAST(user_message AS BLOB)) >= :min_bytes) OR "
+        "(typeof(bot_response) = 'text' AND length(CAST(bot_response AS BLOB)) >= :min_bytes)"
+        ") ORDER BY id LIMIT :batch_size"
+    )
+    rewritten, last_id = 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(candidates, {"last_id": last_id, "min_bytes": COMPRESSION_MIN_BYTES,
+                                             "batch_size": batch_size}).all()
+            if not rows:
+                break
+            conn.execute(rewrite, [
+                {"b_id": row.id, "b_user_message": row.user_message, "b_bot_response": row.bot_response}
+                for row in rows
+            ])
+        rewritten += len(rows)
+        last_id = rows[-1].id
+    logger.info(f"Compressed {rewritten} stored turns")
+    return rewritten
+
+if __name__ == "__main__":
+    import sys
+    from db import create_tables
+    logging.basicConfig(level=logging.INFO)
+    create_tables()
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "train":
+        print(f"Trained dictionary {train_dictionary()}")
+    elif command == "compress":
+        print(f"Compressed {compress_existing()} turns; run VACUUM to shrink the database file")
+    else:
+        print("Usage: python compressed_text.py train|compress")
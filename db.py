@@ -1,13 +1,34 @@
 import os
+import asyncio
 import logging
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+import weakref
+from sqlalchemy import create_engine, event, make_url, Column, Integer, String, Text, DateTime, ForeignKey, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, scoped_session
+from sqlalchemy.engine import URL, Engine
 from sqlalchemy.pool import QueuePool
 import datetime
-from contextlib import contextmanager
-from typing import Generator, Optional
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncGenerator, Dict, Generator, Optional, Tuple
 import time
+from compressed_text import CompressedText, stored_text
+from config import (
+    DATABASE_URL,
+    DATABASE_READ_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_CONNECT_TIMEOUT,
+    DB_STATEMENT_TIMEOUT_MS,
+    DB_APPLICATION_NAME,
+    DB_PROFILE,
+    DB_READ_POOL_SIZE,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_MMAP_SIZE,
+    SQLITE_CACHE_SIZE_KB,
+    WRITE_BEHIND_ENABLED,
+)
 
 # Create database directory if it doesn't exist
 os.makedirs('db', exist_ok=True)
@@ -16,25 +37,123 @@ os.makedirs('db', exist_ok=True)
 logger = logging.getLogger(__name__)
 
 # Database Configuration with connection pooling
-DATABASE_URL = "sqlite:///db/chatbot.db"
-try:
+database_url = make_url(DATABASE_URL)
+IS_SQLITE = database_url.get_backend_name() == "sqlite"
+
+def _connect_args(url: URL) -> Dict[str, Any]:
+    """Driver-specific connection arguments."""
+    backend, driver = url.get_backend_name(), url.get_driver_name()
+    if backend == "sqlite":
+        return {"check_same_thread": False}  # Required for SQLite
+    if backend == "postgresql" and driver == "asyncpg":
+        return {
+            "timeout": DB_CONNECT_TIMEOUT,
+            "command_timeout": DB_STATEMENT_TIMEOUT_MS / 1000,
+            "server_settings": {"application_name": DB_APPLICATION_NAME},
+        }
+    if backend == "postgresql":
+        return {
+            "connect_timeout": DB_CONNECT_TIMEOUT,
+            "application_name": DB_APPLICATION_NAME,
+            "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+        }
+    return {}
+
+def _server_pool_options() -> Dict[str, Any]:
+    """Pool settings for a server database shared by several app replicas."""
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        # Connections can be dropped by the server or a proxy between requests
+        "pool_pre_ping": True,
+    }
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Apply the production SQLite settings to each new connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        # WAL lets readers run alongside the writer instead of blocking behind it
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # Safe with WAL: a power loss can only lose the last commits, never corrupt the file
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        # Negative cache_size is in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    finally:
+        cursor.close()
+
+def _register_sqlite_functions(dbapi_connection, connection_record) -> None:
+    """Let SQL read message bodies as text, e.g. for the search index's snippets."""
+    dbapi_connection.create_function("chat_text", 1, stored_text, deterministic=True)
+
+def _set_query_only(dbapi_connection, connection_record) -> None:
+    """Make connections in the read pool refuse writes."""
+    dbapi_connection.execute("PRAGMA query_only=ON")
+
+def _create_sqlite_engines(url: URL, profile: str) -> Tuple[Engine, Engine]:
+    """The (write, read) engines for a SQLite database under the given DB_PROFILE."""
+    if profile == "sqlite_production":
+        # SQLite allows one writer at a time, so writes share a single connection and
+        # queue in the pool instead of spinning on the database lock, while reads use
+        # their own pool and proceed concurrently under WAL.
+        engine = create_engine(
+            url,
+            poolclass=QueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=30,
+            connect_args=_connect_args(url)
+        )
+        read_engine = create_engine(
+            url,
+            poolclass=QueuePool,
+            pool_size=DB_READ_POOL_SIZE,
+            max_overflow=0,
+            pool_timeout=30,
+            connect_args=_connect_args(url)
+        )
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+        event.listen(read_engine, "connect", _set_sqlite_pragmas)
+        event.listen(read_engine, "connect", _set_query_only)
+        event.listen(engine, "connect", _register_sqlite_functions)
+        event.listen(read_engine, "connect", _register_sqlite_functions)
+        return engine, read_engine
     engine = create_engine(
-        DATABASE_URL,
+        url,
         poolclass=QueuePool,
         pool_size=10,
         max_overflow=20,
         pool_timeout=30,
         pool_recycle=1800,  # Recycle connections after 30 minutes
-        connect_args={"check_same_thread": False}  # Required for SQLite
+        connect_args=_connect_args(url)
     )
-    logger.info("Database engine created successfully")
+    event.listen(engine, "connect", _register_sqlite_functions)
+    return engine, engine
+
+try:
+    if not IS_SQLITE:
+        engine = create_engine(database_url, connect_args=_connect_args(database_url), **_server_pool_options())
+        if DATABASE_READ_URL:
+            read_url = make_url(DATABASE_READ_URL)
+            read_engine = create_engine(read_url, connect_args=_connect_args(read_url), **_server_pool_options())
+        else:
+            read_engine = engine
+    else:
+        engine, read_engine = _create_sqlite_engines(database_url, DB_PROFILE)
+    profile = f", {DB_PROFILE} profile" if IS_SQLITE else ""
+    logger.info(f"Database engine created successfully ({database_url.get_backend_name()}{profile})")
 except Exception as e:
     logger.error(f"Failed to create database engine: {str(e)}")
     raise
 
-# Create thread-safe session factory
+# Create thread-safe session factories; reads that never write use the read pool
 SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 SessionLocal = scoped_session(SessionFactory)
+ReadSessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+ReadSessionLocal = scoped_session(ReadSessionFactory)
 Base = declarative_base()
 
 # Database Models
@@ -51,16 +170,56 @@ class User(Base):
     # Define relationship with ChatHistory
     chat_history = relationship("ChatHistory", back_populates="user", cascade="all, delete-orphan")
 
+class ChatSession(Base):
+    __tablename__ = "chat_sessions"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Maintained by each write to chat_history so the conversation list never reads messages
+    last_activity = Column(DateTime, default=datetime.datetime.utcnow)
+    turn_count = Column(Integer, default=0)
+    preview = Column(String, nullable=True)  # Start of the first user message
+    # Serves the sidebar's conversation list, most recently active first
+    __table_args__ = (
+        Index("ix_chat_sessions_user_activity", "user_id", "last_activity", "id"),
+    )
+
 class ChatHistory(Base):
     __tablename__ = "chat_history"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
-    user_message = Column(Text)
-    bot_response = Column(Text)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=True)
+    # Large bodies are stored compressed on SQLite and decompressed on first use
+    user_message = Column(CompressedText)
+    bot_response = Column(CompressedText)
     response_time = Column(Integer, nullable=True)  # Response time in milliseconds
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     # Define relationship with User
     user = relationship("User", back_populates="chat_history")
+    # Serve "a user's (or a conversation's) turns, newest first" lookups and (timestamp, id) keyset pagination
+    __table_args__ = (
+        Index("ix_chat_history_user_timestamp", "user_id", "timestamp", "id"),
+        Index("ix_chat_history_session_timestamp", "session_id", "timestamp", "id"),
+    )
+
+class ChatArchive(Base):
+    __tablename__ = "chat_archive"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=True)
+    # Where the conversation's archived turns are: one gzip member within a segment file
+    segment = Column(String)
+    byte_offset = Column(Integer)
+    byte_length = Column(Integer)
+    turn_count = Column(Integer)
+    first_timestamp = Column(DateTime)
+    last_timestamp = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Per-user offset index: a user's archived turns newest first, or one conversation's
+    __table_args__ = (
+        Index("ix_chat_archive_user_last_timestamp", "user_id", "last_timestamp"),
+        Index("ix_chat_archive_session_id", "session_id"),
+    )
 
 class UserSession(Base):
     __tablename__ = "user_sessions"
@@ -69,6 +228,7 @@ class UserSession(Base):
     session_token = Column(String, unique=True, index=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     expires_at = Column(DateTime)
+    last_seen_at = Column(DateTime, nullable=True)
     is_active = Column(Integer, default=1)  # 1 = active, 0 = inactive
 
 class ErrorLog(Base):
@@ -81,31 +241,119 @@ class ErrorLog(Base):
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     context = Column(Text, nullable=True)  # Additional context information
 
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache"
+    cache_key = Column(String, primary_key=True)  # SHA-256 of model, parameters, prompt and history
+    model_name = Column(String)
+    response = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class CompressionDictionary(Base):
+    __tablename__ = "compression_dictionaries"
+    dict_id = Column(Integer, primary_key=True, autoincrement=False)  # zstd's own id for the dictionary
+    data = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class RateLimitCounter(Base):
+    __tablename__ = "rate_limit_counters"
+    key = Column(String, primary_key=True)  # "<route>:<scope>:<identity>", e.g. "login:ip:203.0.113.7"
+    window_start = Column(Integer, primary_key=True)  # Unix time the fixed window began
+    count = Column(Integer, default=0)
+    # Expired windows are purged by age
+    __table_args__ = (
+        Index("ix_rate_limit_counters_window_start", "window_start"),
+    )
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    description = Column(String)
+    applied_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+def _session_scope(session_registry, kind: str) -> Generator:
+    db = session_registry()
+    start_time = time.time()
+    try:
+        logger.debug(f"Database {kind} session started")
+        yield db
+    except Exception as e:
+        logger.error(f"Database error: {str(e)}")
+        db.rollback()
+        raise
+    finally:
+        end_time = time.time()
+        logger.debug(f"Database {kind} session closed (duration: {(end_time - start_time)*1000:.2f}ms)")
+        db.close()
+
 # Context manager for database sessions
 @contextmanager
 def get_db() -> Generator:
     """
     Context manager for database sessions with error handling and performance tracking
     """
-    db = SessionLocal()
+    yield from _session_scope(SessionLocal, "write")
+
+@contextmanager
+def get_read_db() -> Generator:
+    """
+    Context manager for read-only database sessions; uses the read pool so it
+    never waits on the writer connection
+    """
+    yield from _session_scope(ReadSessionLocal, "read")
+
+# Async drivers used by get_async_db() for each backend
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+# Async connections belong to the event loop that opened them, so each loop gets its own engine
+_async_engines: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+
+def get_async_engine():
+    """Get the async engine for the running event loop."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    loop = asyncio.get_running_loop()
+    async_engine = _async_engines.get(loop)
+    if async_engine is None:
+        backend = database_url.get_backend_name()
+        if backend not in ASYNC_DRIVERS:
+            raise ValueError(f"No async driver configured for {backend}")
+        async_url = database_url.set(drivername=ASYNC_DRIVERS[backend])
+        options = {} if IS_SQLITE else _server_pool_options()
+        async_engine = create_async_engine(async_url, connect_args=_connect_args(async_url), **options)
+        if IS_SQLITE and DB_PROFILE == "sqlite_production":
+            event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        _async_engines[loop] = async_engine
+    return async_engine
+
+@asynccontextmanager
+async def get_async_db() -> AsyncGenerator:
+    """
+    Async context manager for database sessions, for code running on an event loop
+    """
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    db = AsyncSession(get_async_engine(), expire_on_commit=False)
     start_time = time.time()
     try:
-        logger.debug("Database session started")
+        logger.debug("Database async session started")
         yield db
     except Exception as e:
         logger.error(f"Database error: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise
     finally:
         end_time = time.time()
-        logger.debug(f"Database session closed (duration: {(end_time - start_time)*1000:.2f}ms)")
-        db.close()
+        logger.debug(f"Database async session closed (duration: {(end_time - start_time)*1000:.2f}ms)")
+        await db.close()
 
 def create_tables():
     """Create database tables with error handling"""
     try:
         Base.metadata.create_all(bind=engine)
         logger.info("Database tables created successfully")
+        # Bring tables that already existed up to date (create_all never alters them)
+        from migrations import run_migrations
+        run_migrations(engine)
     except Exception as e:
         logger.error(f"Failed to create database tables: {str(e)}")
         raise
@@ -113,6 +361,18 @@ def create_tables():
 def log_error(user_id: Optional[int], error_type: str, error_message: str, stack_trace: Optional[str] = None, context: Optional[str] = None):
     """Log an error to the database"""
     try:
+        if WRITE_BEHIND_ENABLED:
+            from write_behind import get_write_behind
+            get_write_behind().put(ErrorLog.__table__, {
+                "user_id": user_id,
+                "error_type": error_type,
+                "error_message": error_message,
+                "stack_trace": stack_trace,
+                "timestamp": datetime.datetime.utcnow(),
+                "context": context
+            })
+            logger.info(f"Error queued for database log: {error_type}")
+            return
         with get_db() as db:
             error_log = ErrorLog(
                 user_id=user_id,
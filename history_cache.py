@@ -0,0 +1,109 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.exc import SQLAlchemyError
+from db import get_read_db
+from read_models import SessionPreview, fetch_session_previews
+from config import (
+    SIDEBAR_PAGE_SIZE,
+    HISTORY_CACHE_TTL_SECONDS,
+    HISTORY_CACHE_MAX_USERS,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# (last_activity, id) of the last conversation on the previous page
+Cursor = Optional[Tuple[datetime, int]]
+# A page of previews and whether more follow it
+Page = Tuple[List[SessionPreview], bool]
+
+class HistoryPreviewCache:
+    """Per-user cache of sidebar preview pages, invalidated explicitly on write.
+
+    A TTL bounds staleness from writes made by other processes.
+    """
+
+    def __init__(self, ttl_seconds: float = HISTORY_CACHE_TTL_SECONDS, max_users: int = HISTORY_CACHE_MAX_USERS):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        # user_id -> (created, {cursor: (page, whether more follow it)})
+        self._pages: "OrderedDict[int, Tuple[float, Dict[Cursor, Page]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, cursor: Cursor) -> Optional[Page]:
+        with self._lock:
+            entry = self._pages.get(user_id)
+            if entry is None:
+                return None
+            created_at, pages = entry
+            if time.monotonic() - created_at >= self.ttl_seconds:
+                del self._pages[user_id]
+                return None
+            self._pages.move_to_end(user_id)
+            return pages.get(cursor)
+
+    def set(self, user_id: int, cursor: Cursor, page: Page) -> None:
+        with self._lock:
+            entry = self._pages.get(user_id)
+            if entry is None:
+                entry = self._pages[user_id] = (time.monotonic(), {})
+            entry[1][cursor] = page
+            self._pages.move_to_end(user_id)
+            while len(self._pages) > self.max_users:
+                self._pages.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._pages.pop(user_id, None)
+
+_preview_cache = HistoryPreviewCache()
+
+def invalidate_user_history(user_id: int) -> None:
+    """Drop a user's cached sidebar previews after their history changes."""
+    _preview_cache.invalidate(user_id)
+
+def _get_page(user_id: int, cursor: Cursor, limit: int) -> Page:
+    """One page of previews, read with one row more than it holds to tell whether another follows."""
+    cached = _preview_cache.get(user_id, cursor)
+    if cached is not None:
+        return cached
+
+    try:
+        start_time = time.time()
+        with get_read_db() as db:
+            rows = fetch_session_previews(db, user_id, cursor, limit + 1)
+
+        logger.debug(f"Retrieved {len(rows)} conversation previews in {time.time() - start_time:.3f}s")
+        page = (rows[:limit], len(rows) > limit)
+        _preview_cache.set(user_id, cursor, page)
+        return page
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in get_user_session_previews: {str(e)}")
+        return [], False
+
+def get_user_session_previews(user_id: int, cursor: Cursor = None,
+                              limit: int = SIDEBAR_PAGE_SIZE) -> List[SessionPreview]:
+    """Get one page of a user's conversations, most recently active first.
+
+    Only the chat_sessions row of each conversation is read, never its
+    messages. Pages are addressed by a (last_activity, id) keyset cursor, so
+    fetching page N costs the same as fetching page 1.
+    """
+    return _get_page(user_id, cursor, limit)[0]
+
+def get_user_session_preview_pages(user_id: int, pages: int,
+                                   page_size: int = SIDEBAR_PAGE_SIZE) -> Tuple[List[SessionPreview], bool]:
+    """Get the first `pages` pages of previews and whether more remain."""
+    previews: List[SessionPreview] = []
+    cursor: Cursor = None
+    for _ in range(pages):
+        page, has_more = _get_page(user_id, cursor, page_size)
+        previews.extend(page)
+        if not has_more:
+            return previews, False
+        cursor = (page[-1].last_activity, page[-1].id)
+    return previews, True
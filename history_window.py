@@ -0,0 +1,97 @@
+import threading
+import logging
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional, Tuple
+from langchain_core.messages import BaseMessage, get_buffer_string
+from config import (
+    HISTORY_MAX_TOKENS,
+    HISTORY_CHARS_PER_TOKEN,
+    HISTORY_SUMMARY_ENABLED,
+    HISTORY_SUMMARY_MAX_TOKENS,
+    HISTORY_SUMMARY_BATCH_TURNS,
+    MEMORY_STORE_MAX_ENTRIES,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# (previous summary, turns to fold in) -> new summary
+Summarizer = Callable[[str, List[BaseMessage]], str]
+
+def estimate_tokens(text: str) -> int:
+    """Cheaply estimate the number of tokens in a piece of text."""
+    return len(text) // HISTORY_CHARS_PER_TOKEN + 1
+
+class HistoryWindow:
+    """Packs the most recent conversation turns into a fixed token budget.
+
+    Turns that no longer fit can optionally be folded into a rolling summary.
+    The summary is extended incrementally as more turns fall out of the window
+    and cached per conversation, so older turns are only summarized once.
+    """
+
+    def __init__(self, max_tokens: int = HISTORY_MAX_TOKENS, summarizer: Optional[Summarizer] = None,
+                 summary_enabled: bool = HISTORY_SUMMARY_ENABLED):
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer if summary_enabled else None
+        # key -> (last message folded into the summary, summary text). Tracked by message rather
+        # than by position, as the memory drops its oldest turns once it holds enough of them.
+        self._summaries: "OrderedDict[Hashable, Tuple[BaseMessage, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, key: Hashable, messages: List[BaseMessage]) -> str:
+        """Render the history for a prompt, newest turns first in priority."""
+        budget = self.max_tokens
+        summary = ""
+        if self.summarizer is not None:
+            budget -= HISTORY_SUMMARY_MAX_TOKENS
+
+        # Walk back from the newest message, keeping whole human/AI turns
+        start = len(messages)
+        used = 0
+        while start >= 2:
+            cost = estimate_tokens(get_buffer_string(messages[start - 2:start]))
+            if used + cost > budget:
+                break
+            used += cost
+            start -= 2
+
+        window = get_buffer_string(messages[start:])
+        if start > 0 and self.summarizer is not None:
+            summary = self._get_summary(key, messages[:start])
+
+        if summary:
+            return f"Summary of earlier conversation: {summary}\n{window}"
+        return window
+
+    def forget(self, key: Hashable) -> None:
+        """Drop the cached summary for a conversation."""
+        with self._lock:
+            self._summaries.pop(key, None)
+
+    def _get_summary(self, key: Hashable, overflow: List[BaseMessage]) -> str:
+        """Return the rolling summary of the overflowed messages, extending it if needed."""
+        with self._lock:
+            last_summarized, summary = self._summaries.get(key, (None, ""))
+        # Everything after the last summarized message; all of it if that has been trimmed away
+        summarized = next((index + 1 for index in range(len(overflow) - 1, -1, -1)
+                           if overflow[index] is last_summarized), 0)
+
+        # Only call the model once enough new turns have fallen out of the window
+        pending = overflow[summarized:]
+        if len(pending) < HISTORY_SUMMARY_BATCH_TURNS * 2:
+            return summary
+
+        try:
+            summary = self.summarizer(summary, pending)[:HISTORY_SUMMARY_MAX_TOKENS * HISTORY_CHARS_PER_TOKEN]
+        except Exception as e:
+            logger.error(f"Error summarizing conversation history: {str(e)}")
+            return summary
+
+        with self._lock:
+            self._summaries[key] = (overflow[-1], summary)
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > MEMORY_STORE_MAX_ENTRIES:
+                self._summaries.popitem(last=False)
+        logger.debug(f"Summarized {len(pending)} messages for {key}")
+        return summary
@@ -0,0 +1,229 @@
+import json
+import threading
+import time
+import logging
+from typing import Any, Dict, Iterator, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from tenacity import Retrying, RetryCallState, retry_if_exception, stop_after_attempt, wait_random_exponential
+from exception import ModelConnectionError, ModelResponseError, ModelTimeoutError, RateLimitExceededError
+from config import (
+    HTTP_POOL_SIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_GENERATE_TIMEOUT,
+    HTTP_TOTAL_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_BASE,
+    HTTP_BACKOFF_MAX,
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_RESET_SECONDS,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Upstream statuses that mean the service is unwell rather than the request wrong
+UPSTREAM_FAILURE_STATUSES = {429, 500, 502, 503, 504}
+# Of those, the ones that say the request was not processed, so a POST can be sent again
+RETRYABLE_STATUSES = {429, 503}
+
+class _UpstreamStatus(Exception):
+    """Raised internally for an upstream failure status so tenacity can decide whether to retry it."""
+
+    def __init__(self, status_code: int, retry_after: Optional[float], body: str):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(f"HTTP {status_code}: {body[:200]}")
+
+class CircuitBreaker:
+    """Fails fast after repeated upstream failures instead of waiting on a sick endpoint.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls are
+    rejected immediately. Once `reset_seconds` have passed, one trial call is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = CIRCUIT_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half_open"
+            return "open"
+
+    def before_call(self) -> None:
+        """Raise ModelConnectionError if the circuit is open."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial_in_flight:
+                raise ModelConnectionError("Language model service is unavailable. Please try again shortly.")
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Circuit opened after {self._failures} consecutive upstream failures")
+                self._opened_at = time.monotonic()
+
+def _is_retryable(error: BaseException) -> bool:
+    """Whether a failed attempt certainly never reached the model.
+
+    Generation requests are POSTs that are not safe to repeat, so a read
+    timeout or a connection dropped mid-request is not retried: the model may
+    already be working on it.
+    """
+    if isinstance(error, _UpstreamStatus):
+        return error.status_code in RETRYABLE_STATUSES
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        # requests wraps urllib3's error, whose reason says whether the connection was ever made
+        return isinstance(getattr(error.args[0], "reason", None), (NewConnectionError, ConnectTimeoutError))
+    return False
+
+def _wait(retry_state: RetryCallState) -> float:
+    """Jittered exponential backoff that honours an upstream Retry-After header."""
+    backoff = wait_random_exponential(multiplier=HTTP_BACKOFF_BASE, max=HTTP_BACKOFF_MAX)(retry_state)
+    error = retry_state.outcome.exception() if retry_state.outcome else None
+    if isinstance(error, _UpstreamStatus) and error.retry_after is not None:
+        return min(max(backoff, error.retry_after), HTTP_BACKOFF_MAX)
+    return backoff
+
+class HTTPTransport:
+    """Pooled keep-alive HTTP client with timeouts, retries and a circuit breaker.
+
+    Upstream failures are reported as the chatbot's own exceptions:
+    RateLimitExceededError for exhausted 429 retries, ModelTimeoutError for
+    timeouts, ModelConnectionError for connection errors, 5xx responses and an
+    open circuit, and ModelResponseError for other rejected requests.
+
+    A call never runs past `total_timeout`: each attempt's connect and read
+    timeouts are cut to what is left of it. A streamed response may wait
+    `read_timeout` for each chunk, a complete one `generate_timeout` in all.
+    """
+
+    def __init__(self, headers: Optional[Dict[str, str]] = None, pool_size: int = HTTP_POOL_SIZE,
+                 connect_timeout: float = HTTP_CONNECT_TIMEOUT, read_timeout: float = HTTP_READ_TIMEOUT,
+                 generate_timeout: float = HTTP_GENERATE_TIMEOUT, total_timeout: float = HTTP_TOTAL_TIMEOUT,
+                 max_retries: int = HTTP_MAX_RETRIES, breaker: Optional[CircuitBreaker] = None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.generate_timeout = generate_timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def post_json(self, url: str, payload: Dict[str, Any]) -> Any:
+        """POST a JSON payload and return the decoded JSON response."""
+        response = self._send(url, payload, stream=False)
+        try:
+            return response.json()
+        except ValueError:
+            raise ModelResponseError()
+
+    def stream_events(self, url: str, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """POST a JSON payload and yield the decoded server-sent events.
+
+        Retries only happen before the response starts; once events have been
+        yielded a failure is raised to the caller.
+        """
+        response = self._send(url, payload, stream=True)
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    yield json.loads(data)
+                except ValueError:
+                    logger.warning(f"Skipping malformed stream event: {data[:100]}")
+        except requests.Timeout:
+            raise ModelTimeoutError()
+        except requests.RequestException as e:
+            raise ModelConnectionError(f"Connection to language model service lost: {str(e)}")
+        finally:
+            response.close()
+
+    def _send(self, url: str, payload: Dict[str, Any], stream: bool) -> requests.Response:
+        self.breaker.before_call()
+        deadline = time.monotonic() + self.total_timeout
+        retrying = Retrying(
+            retry=retry_if_exception(_is_retryable),
+            # Never back off past the deadline; the attempt after it then times out at once
+            wait=lambda retry_state: min(_wait(retry_state), max(deadline - time.monotonic(), 0)),
+            stop=stop_after_attempt(self.max_retries + 1),
+            reraise=True,
+        )
+        try:
+            response = retrying(self._attempt, url, payload, stream, deadline)
+        except ModelResponseError:
+            # The service answered, so it is healthy even though it rejected the request
+            self.breaker.record_success()
+            raise
+        except _UpstreamStatus as e:
+            self.breaker.record_failure()
+            if e.status_code == 429:
+                raise RateLimitExceededError("The language model service is rate limiting requests. Please try again later.")
+            raise ModelConnectionError(f"Language model service returned HTTP {e.status_code}")
+        except requests.Timeout:
+            self.breaker.record_failure()
+            raise ModelTimeoutError()
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise ModelConnectionError(f"Unable to reach language model service: {str(e)}")
+
+        self.breaker.record_success()
+        return response
+
+    def _attempt(self, url: str, payload: Dict[str, Any], stream: bool, deadline: float) -> requests.Response:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.Timeout(f"No time left of the {self.total_timeout}s deadline")
+        read_timeout = self.read_timeout if stream else self.generate_timeout
+        timeout = (min(self.connect_timeout, remaining), min(read_timeout, remaining))
+        response = self.session.post(url, json=payload, timeout=timeout, stream=stream)
+        if response.status_code in UPSTREAM_FAILURE_STATUSES:
+            retry_after = response.headers.get("Retry-After")
+            body = response.text
+            response.close()
+            logger.warning(f"Upstream returned HTTP {response.status_code}")
+            raise _UpstreamStatus(
+                response.status_code,
+                float(retry_after) if retry_after and retry_after.isdigit() else None,
+                body
+            )
+        if response.status_code >= 400:
+            body = response.text
+            response.close()
+            raise ModelResponseError(f"Language model service rejected the request (HTTP {response.status_code}): {body[:200]}")
+        return response
@@ -0,0 +1,247 @@
+import atexit
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+import logging
+import multiprocessing
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Hashable, List, NamedTuple, Optional, Tuple
+from exception import ResourceExhaustedError
+from config import (
+    KDF_ITERATIONS,
+    KDF_WORKERS,
+    KDF_MAX_PENDING,
+    KDF_MAX_PENDING_PER_KEY,
+    KDF_MAX_PENDING_PER_IP,
+    KDF_TIMEOUT,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Stored hashes are "pbkdf2_sha256$<iterations>$<salt>$<hash>". Hashes written
+# before the parameters were recorded are "<salt>$<hash>" with 100,000 iterations.
+ALGORITHM = "pbkdf2_sha256"
+LEGACY_ITERATIONS = 100000
+
+class PasswordHash(NamedTuple):
+    algorithm: str
+    iterations: int
+    salt: str
+    digest: str
+
+def parse_hash(stored: str) -> PasswordHash:
+    """Split a stored hash into its parameters; raises ValueError if it is malformed."""
+    parts = stored.split("$")
+    if len(parts) == 2:
+        return PasswordHash(ALGORITHM, LEGACY_ITERATIONS, parts[0], parts[1])
+    if len(parts) == 4 and parts[0] == ALGORITHM:
+        return PasswordHash(parts[0], int(parts[1]), parts[2], parts[3])
+    raise ValueError("Unrecognized password hash format")
+
+def format_hash(password_hash: PasswordHash) -> str:
+    return "$".join([password_hash.algorithm, str(password_hash.iterations), password_hash.salt, password_hash.digest])
+
+def needs_rehash(stored: str) -> bool:
+    """Whether a stored hash predates the current format or iteration count."""
+    try:
+        return stored.count("$") != 3 or parse_hash(stored).iterations != KDF_ITERATIONS
+    except ValueError:
+        return False
+
+def _pbkdf2(password: str, salt: str, iterations: int) -> str:
+    # Runs in a worker process
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), iterations).hex()
+
+def _pbkdf2_many(passwords: List[str], salts: List[str], iterations: int) -> List[str]:
+    # Runs in a worker process
+    return [_pbkdf2(password, salt, iterations) for password, salt in zip(passwords, salts)]
+
+class KDFPool:
+    """Runs password hashing in worker processes, with bounded admission.
+
+    Hashing is CPU-bound for tens of milliseconds; in worker processes it
+    cannot stall the threads rendering other sessions, and at most
+    `workers` cores are spent on it. Requests beyond `max_pending` in total,
+    `max_pending_per_key` for one key (a username) or `max_pending_per_ip`
+    from one client IP are rejected with ResourceExhaustedError instead of
+    queueing. Hashing never falls back to the caller's thread: if the
+    workers die, requests are turned away while a new pool starts.
+    """
+
+    def __init__(self, workers: int = KDF_WORKERS, max_pending: int = KDF_MAX_PENDING,
+                 max_pending_per_key: int = KDF_MAX_PENDING_PER_KEY, timeout: float = KDF_TIMEOUT,
+                 max_pending_per_ip: int = KDF_MAX_PENDING_PER_IP):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_key = max_pending_per_key
+        self.max_pending_per_ip = max_pending_per_ip
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._pending_by_key: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # forkserver: workers start from a clean process rather than a fork of this threaded one
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+            return self._executor
+
+    def _admission_keys(self, key: Optional[Hashable], ip: Optional[str]) -> List[Tuple[Hashable, int]]:
+        """The (counter key, limit) pairs a request is admitted under."""
+        keys = []
+        if key is not None:
+            keys.append((("key", key), self.max_pending_per_key))
+        if ip is not None:
+            keys.append((("ip", ip), self.max_pending_per_ip))
+        return keys
+
+    def _admit(self, keys: List[Tuple[Hashable, int]]) -> None:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ResourceExhaustedError("The server is busy signing other users in. Please try again in a moment.")
+            for counter_key, limit in keys:
+                if self._pending_by_key[counter_key] < limit:
+                    continue
+                if counter_key[0] == "ip":
+                    raise ResourceExhaustedError("Too many sign-ins from your network are in progress. Please wait.")
+                raise ResourceExhaustedError("A sign-in for this account is already in progress. Please wait.")
+            self._pending += 1
+            for counter_key, _ in keys:
+                self._pending_by_key[counter_key] += 1
+
+    def _release(self, keys: List[Tuple[Hashable, int]]) -> None:
+        with self._lock:
+            self._pending -= 1
+            for counter_key, _ in keys:
+                self._pending_by_key[counter_key] -= 1
+                if not self._pending_by_key[counter_key]:
+                    del self._pending_by_key[counter_key]
+
+    def _hold_until_done(self, futures: List[Future], keys: List[Tuple[Hashable, int]]) -> None:
+        """Keep an admitted request's slot until its work has finished or been cancelled.
+
+        Releasing when the caller stops waiting would let timed-out work pile
+        up in the executor while admission believes the pool is idle.
+        """
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_: Future) -> None:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._release(keys)
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    def _reset_executor(self, broken: ProcessPoolExecutor) -> ResourceExhaustedError:
+        """Replace a pool whose worker died; returns the error to turn the request away with."""
+        logger.error("Password hashing pool broke; starting a new one")
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        if broken is not None:
+            broken.shutdown(wait=False, cancel_futures=True)
+        # Start the new workers now rather than on the next sign-in
+        self._get_executor()
+        return ResourceExhaustedError("Signing in is temporarily unavailable. Please try again in a moment.")
+
+    def _run(self, fn: Callable, jobs: List[tuple], keys: List[Tuple[Hashable, int]], timeout: float) -> List[Any]:
+        """Run fn(*job) for each job in the workers; the admission slot for `keys` must already be held."""
+        executor = None
+        try:
+            executor = self._get_executor()
+            futures = [executor.submit(fn, *job) for job in jobs]
+        except BrokenProcessPool:
+            self._release(keys)
+            raise self._reset_executor(executor)
+        except BaseException:
+            self._release(keys)
+            raise
+        self._hold_until_done(futures, keys)
+
+        deadline = time.monotonic() + timeout
+        try:
+            return [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+        except FuturesTimeoutError:
+            for future in futures:
+                future.cancel()
+            logger.warning(f"Password hashing timed out after {timeout}s")
+            raise ResourceExhaustedError("Signing in is taking longer than usual. Please try again in a moment.")
+        except BrokenProcessPool:
+            raise self._reset_executor(executor)
+
+    def derive(self, password: str, salt: str, iterations: int, key: Optional[Hashable] = None,
+               ip: Optional[str] = None) -> str:
+        """Compute a PBKDF2-SHA256 digest in a worker process.
+
+        Raises ResourceExhaustedError if the pool is saturated, the result
+        does not arrive within `timeout` or the workers died, so callers can
+        tell "busy, retry" apart from a wrong password.
+        """
+        keys = self._admission_keys(key, ip)
+        self._admit(keys)
+        return self._run(_pbkdf2, [(password, salt, iterations)], keys, self.timeout)[0]
+
+    def derive_many(self, passwords: List[str], salts: List[str], iterations: int) -> List[str]:
+        """Compute digests for a batch of passwords across all workers, admitted as one request.
+
+        Passwords are sent to the workers in chunks, so a large batch does not
+        pay one round trip per password. Keep batches modest: interactive
+        logins queue behind the whole batch.
+        """
+        if not passwords:
+            return []
+        self._admit([])
+        per_worker = -(-len(passwords) // self.workers)
+        chunksize = max(1, per_worker // 4)
+        jobs = [(passwords[i:i + chunksize], salts[i:i + chunksize], iterations)
+                for i in range(0, len(passwords), chunksize)]
+        chunks = self._run(_pbkdf2_many, jobs, [], self.timeout * per_worker)
+        return [digest for chunk in chunks for digest in chunk]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+_kdf_pool: Optional[KDFPool] = None
+_kdf_pool_lock = threading.Lock()
+
+def get_kdf_pool() -> KDFPool:
+    """Get the process-wide password hashing pool."""
+    global _kdf_pool
+    with _kdf_pool_lock:
+        if _kdf_pool is None:
+            _kdf_pool = KDFPool()
+            atexit.register(_kdf_pool.shutdown)
+        return _kdf_pool
+
+def hash_password(password: str, key: Optional[Hashable] = None, ip: Optional[str] = None) -> str:
+    """Hash a password with the current parameters."""
+    salt = secrets.token_hex(16)
+    digest = get_kdf_pool().derive(password, salt, KDF_ITERATIONS, key, ip)
+    return format_hash(PasswordHash(ALGORITHM, KDF_ITERATIONS, salt, digest))
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    """Hash a batch of passwords with the current parameters, in the same order."""
+    salts = [secrets.token_hex(16) for _ in passwords]
+    digests = get_kdf_pool().derive_many(passwords, salts, KDF_ITERATIONS)
+    return [format_hash(PasswordHash(ALGORITHM, KDF_ITERATIONS, salt, digest)) for salt, digest in zip(salts, digests)]
+
+def verify_password(stored: str, password: str, key: Optional[Hashable] = None, ip: Optional[str] = None) -> bool:
+    """Check a password against a stored hash of any supported format."""
+    password_hash = parse_hash(stored)
+    digest = get_kdf_pool().derive(password, password_hash.salt, password_hash.iterations, key, ip)
+    return hmac.compare_digest(digest, password_hash.digest)
@@ -1,91 +1,181 @@
+import atexit
+import copy
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
 import sys
-from datetime import datetime
-
-# Create logs directory if it doesn't exist
-os.makedirs('logs', exist_ok=True)
-
-# Configure logging
-def setup_logger(name, log_file, level=logging.INFO):
-    """Set up logger with file and console handlers"""
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
-    
-    # Configure file handler with rotation
-    file_handler = RotatingFileHandler(
-        log_file,
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5  # Keep 5 backup logs
-    )
-    file_format = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    file_handler.setFormatter(file_format)
-    
-    # Configure console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_format = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s'
-    )
-    console_handler.setFormatter(console_format)
-    
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+from config import LOG_QUEUE_MAX_RECORDS, LOG_DEBUG_SAMPLE_EVERY, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUP_COUNT
+
+# Every record goes through one QueueHandler on the root logger; a single
+# QueueListener thread formats it and does the file and console writes, so
+# logging never waits on disk in a request thread. The file gets one JSON
+# object per line, carrying the request and user ids bound to the context the
+# record was logged from.
+
+# Correlation ids for the current script run; worker threads started through
+# the scheduler run in a copy of the submitting context and inherit them
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+user_id_var: ContextVar[Optional[int]] = ContextVar("user_id", default=None)
+
+def bind_log_context(**fields) -> None:
+    """Set the request_id and/or user_id attached to records logged from this context."""
+    if "request_id" in fields:
+        request_id_var.set(fields["request_id"])
+    if "user_id" in fields:
+        user_id_var.set(fields["user_id"])
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the correlation ids; runs in the logging thread, where they are bound."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.user_id = user_id_var.get()
+        return True
+
+class DebugSampler(logging.Filter):
+    """Keeps every record above DEBUG, and one in `every` DEBUG records from each call site.
+
+    The first record from a call site is always kept, so rare debug lines
+    are not lost to sampling.
+    """
+
+    def __init__(self, every: int = LOG_DEBUG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = max(1, every)
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        site = (record.pathname, record.lineno)
+        with self._lock:
+            count = self._seen.get(site, 0)
+            self._seen[site] = count + 1
+        return count % self.every == 0
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "user_id": getattr(record, "user_id", None),
+            "thread": record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener without ever waiting; drops them while the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler.prepare, keep the record's fields for the formatters
+        # and only resolve what cannot cross threads: args and the exception
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        with self._dropped_lock:
+            try:
+                if self.dropped:
+                    # Report the gap before the next record that gets through
+                    self.queue.put_nowait(logging.makeLogRecord({
+                        "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                        "msg": f"Dropped {self.dropped} log records while the log writer was behind",
+                    }))
+                    self.dropped = 0
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
+
+def _stop_listener() -> None:
+    """Write out the records still queued; run at exit."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
 
 # Setup logging for the application
 def setup_logging(level_str="INFO", log_format=None, log_file=None):
-    """Set up application logging with configurable level and format"""
+    """Set up application logging with configurable level and format.
+
+    Safe to call on every script run; only the first call installs handlers.
+    """
+    global _listener
     level = getattr(logging, level_str.upper(), logging.INFO)
-    
-    if log_file is None:
-        log_file = "logs/app.log"
-        
-    if log_format is None:
-        log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        
-    # Create logs directory if it doesn't exist
-    os.makedirs(os.path.dirname(log_file), exist_ok=True)
-    
-    # Configure root logger
-    logging.basicConfig(
-        level=level,
-        format=log_format,
-        handlers=[
-            RotatingFileHandler(
-                log_file,
-                maxBytes=10*1024*1024,  # 10MB
-                backupCount=5  # Keep 5 backup logs
-            ),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    with _setup_lock:
+        if _listener is not None:
+            return root
+
+        if log_file is None:
+            log_file = "logs/app.log"
+
+        if log_format is None:
+            log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+        # Create logs directory if it doesn't exist
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+        file_handler = RotatingFileHandler(log_file, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUP_COUNT)
+        file_handler.setFormatter(JsonFormatter())
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter(log_format))
+
+        queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_MAX_RECORDS))
+        queue_handler.addFilter(DebugSampler())
+        queue_handler.addFilter(ContextFilter())
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+
+        _listener = QueueListener(queue_handler.queue, file_handler, console_handler)
+        _listener.start()
+        atexit.register(_stop_listener)
+
     # Suppress excessive logging from libraries
     logging.getLogger("urllib3").setLevel(logging.WARNING)
     logging.getLogger("sqlalchemy").setLevel(logging.WARNING)
-    
-    return logging.getLogger()
 
-# Application loggers
-app_logger = setup_logger('app', 'logs/app.log')
-auth_logger = setup_logger('auth', 'logs/auth.log')
-db_logger = setup_logger('db', 'logs/db.log')
-chat_logger = setup_logger('chat', 'logs/chat.log')
+    return root
 
 # Log application startup
 def log_startup():
     """Log application startup with timestamp"""
     startup_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    app_logger.info(f"Application started at {startup_time}")
+    logging.getLogger('app').info(f"Application started at {startup_time}")
 
 # Get logger function that's referenced in utils.py
 def get_logger(name=None):
     """Get a logger by name, or return the app logger by default"""
-    if name:
-        return logging.getLogger(name)
-    return app_logger
+    return logging.getLogger(name or 'app')
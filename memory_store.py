@@ -0,0 +1,96 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from langchain.memory import ConversationBufferMemory
+from config import MEMORY_STORE_MAX_ENTRIES, MEMORY_STORE_TTL_SECONDS, HISTORY_LOAD_MAX_TURNS
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+MemoryKey = Tuple[Optional[int], Optional[str]]
+
+class TrimmedBufferMemory(ConversationBufferMemory):
+    """A conversation buffer that keeps only the most recent `max_turns` exchanges.
+
+    Older turns are dropped as new ones are saved, so a long-lived session
+    holds no more than a freshly loaded one.
+    """
+
+    max_turns: int = HISTORY_LOAD_MAX_TURNS
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        messages = self.chat_memory.messages
+        excess = len(messages) - 2 * self.max_turns
+        if excess > 0:
+            del messages[:excess]
+
+class ConversationMemoryStore:
+    """Bounded, thread-safe store of conversation memories keyed by (user_id, session_id).
+
+    Entries idle for longer than the TTL are dropped, and once the store is full
+    the least recently used entry is evicted to make room for a new one. Each
+    memory keeps at most `max_turns` turns.
+    """
+
+    def __init__(self, max_entries: int = MEMORY_STORE_MAX_ENTRIES, ttl_seconds: float = MEMORY_STORE_TTL_SECONDS,
+                 max_turns: int = HISTORY_LOAD_MAX_TURNS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_turns = max_turns
+        self._entries: "OrderedDict[MemoryKey, Tuple[ConversationBufferMemory, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Optional[int], session_id: Optional[str] = None,
+            loader: Optional[Callable[[ConversationBufferMemory], None]] = None) -> ConversationBufferMemory:
+        """Get the memory for a user session, creating (and optionally loading) it on a miss."""
+        key = (user_id, session_id)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], now)
+                self._entries.move_to_end(key)
+                return entry[0]
+
+        # Build the memory outside the lock so a slow loader doesn't block other sessions
+        memory = TrimmedBufferMemory(return_messages=True, max_turns=self.max_turns)
+        if loader is not None:
+            loader(memory)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # Another thread created this session's memory first
+                return entry[0]
+            self._entries[key] = (memory, now)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                logger.debug(f"Evicted conversation memory for {evicted_key}")
+        return memory
+
+    def reset(self, user_id: Optional[int], session_id: Optional[str] = None) -> ConversationBufferMemory:
+        """Replace the memory for a user session with an empty one."""
+        self.discard(user_id, session_id)
+        return self.get(user_id, session_id)
+
+    def discard(self, user_id: Optional[int], session_id: Optional[str] = None) -> None:
+        """Drop the memory for a user session, e.g. on logout."""
+        with self._lock:
+            self._entries.pop((user_id, session_id), None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _evict_expired(self, now: float) -> None:
+        """Drop entries idle for longer than the TTL; the caller must hold the lock."""
+        while self._entries:
+            key, (_, last_used) = next(iter(self._entries.items()))
+            if now - last_used < self.ttl_seconds:
+                break
+            del self._entries[key]
+            logger.debug(f"Expired conversation memory for {key}")
@@ -0,0 +1,136 @@
+import datetime
+import logging
+from typing import Callable, Dict, List, Tuple
+from sqlalchemy import func, inspect, insert, select, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from config import HISTORY_PREVIEW_LENGTH
+from db import ChatHistory, ChatSession, SchemaMigration
+from read_models import recent_chats_query, session_previews_query, session_turns_query
+from search import create_search_index, drop_search_text
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+def _index(table, name: str):
+    return next(index for index in table.indexes if index.name == name)
+
+def _add_chat_history_user_timestamp_index(conn: Connection) -> None:
+    _index(ChatHistory.__table__, "ix_chat_history_user_timestamp").create(conn, checkfirst=True)
+
+def _add_chat_sessions(conn: Connection) -> None:
+    """Add chat_history.session_id and file the turns saved before it into one conversation per user."""
+    if "session_id" not in {column["name"] for column in inspect(conn).get_columns("chat_history")}:
+        conn.exec_driver_sql(
+            "ALTER TABLE chat_history ADD COLUMN session_id INTEGER REFERENCES chat_sessions (id) ON DELETE CASCADE"
+        )
+    _index(ChatHistory.__table__, "ix_chat_history_session_timestamp").create(conn, checkfirst=True)
+
+    conn.execute(insert(ChatSession).from_select(
+        ["user_id", "created_at", "last_activity", "turn_count"],
+        select(ChatHistory.user_id, func.min(ChatHistory.timestamp), func.max(ChatHistory.timestamp), func.count())
+        .where(ChatHistory.session_id.is_(None)).group_by(ChatHistory.user_id)
+    ))
+    conn.execute(
+        update(ChatHistory).where(ChatHistory.session_id.is_(None)).values(session_id=(
+            select(func.max(ChatSession.id)).where(ChatSession.user_id == ChatHistory.user_id).scalar_subquery()
+        ))
+    )
+    first_message = (
+        select(func.substr(ChatHistory.user_message, 1, HISTORY_PREVIEW_LENGTH + 1))
+        .where(ChatHistory.session_id == ChatSession.id)
+        .order_by(ChatHistory.timestamp, ChatHistory.id).limit(1).scalar_subquery()
+    )
+    conn.execute(update(ChatSession).where(ChatSession.preview.is_(None)).values(preview=first_message))
+
+def _add_user_session_last_seen(conn: Connection) -> None:
+    if "last_seen_at" not in {column["name"] for column in inspect(conn).get_columns("user_sessions")}:
+        conn.exec_driver_sql("ALTER TABLE user_sessions ADD COLUMN last_seen_at TIMESTAMP")
+
+# Ordered schema changes: (version, description, upgrade function). Append only;
+# never renumber or edit a migration that has shipped.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Composite index on chat_history (user_id, timestamp, id)", _add_chat_history_user_timestamp_index),
+    (2, "Full-text search index over chat messages", create_search_index),
+    (3, "Chat sessions with denormalized turn count, last activity and preview", _add_chat_sessions),
+    (4, "Last-seen time on login sessions", _add_user_session_last_seen),
+    (5, "Search index keeps only terms, not a copy of each message", drop_search_text),
+]
+
+def applied_versions(engine: Engine) -> List[int]:
+    """Get the migration versions already applied to the database."""
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(select(SchemaMigration.version).order_by(SchemaMigration.version))]
+
+def run_migrations(engine: Engine) -> int:
+    """Apply pending migrations in order, each in its own transaction.
+
+    Returns the number of migrations applied. Safe to call on every start-up
+    and from several processes at once: a migration another process has just
+    recorded is skipped.
+    """
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+    done = set(applied_versions(engine))
+    applied = 0
+    for version, description, upgrade in MIGRATIONS:
+        if version in done:
+            continue
+        try:
+            with engine.begin() as conn:
+                upgrade(conn)
+                conn.execute(insert(SchemaMigration).values(version=version, description=description))
+            applied += 1
+            logger.info(f"Applied migration {version}: {description}")
+        except IntegrityError:
+            logger.info(f"Migration {version} was applied by another process")
+        except SQLAlchemyError as e:
+            logger.error(f"Migration {version} failed: {str(e)}")
+            raise
+    return applied
+
+def explain_query_plan(conn: Connection, statement) -> List[str]:
+    """Get SQLite's EXPLAIN QUERY PLAN details for a statement."""
+    compiled = statement.compile(dialect=conn.dialect)
+    params = compiled.construct_params()
+    values = tuple(
+        str(params[name]) if isinstance(params[name], datetime.datetime) else params[name]
+        for name in compiled.positiontup
+    )
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", values).fetchall()
+    return [row[-1] for row in rows]
+
+def hot_queries(user_id: int = 1) -> Dict[str, object]:
+    """The reads made on every page load, as used by the app."""
+    cursor = (datetime.datetime.utcnow(), 1)
+    return {
+        "recent_turns": recent_chats_query(user_id, 50),
+        "sidebar_sessions": session_previews_query(user_id, None, 30),
+        "sidebar_sessions_next_page": session_previews_query(user_id, cursor, 30),
+        "session_turns": session_turns_query(user_id, 1, None, 50),
+        "session_turns_earlier_page": session_turns_query(user_id, 1, cursor, 50),
+    }
+
+def check_query_plans(engine: Engine) -> Dict[str, List[str]]:
+    """Explain the hot queries and report any that scan or sort instead of using an index.
+
+    Returns the offending queries mapped to their plans; empty means every hot
+    query is served by an index. Only SQLite plans are checked.
+    """
+    problems: Dict[str, List[str]] = {}
+    if engine.dialect.name != "sqlite":
+        logger.info(f"Query plan check skipped for {engine.dialect.name}")
+        return problems
+    with engine.connect() as conn:
+        for name, statement in hot_queries().items():
+            plan = explain_query_plan(conn, statement)
+            if any(step.startswith("SCAN") or "TEMP B-TREE" in step for step in plan):
+                logger.warning(f"Query {name} does not use an index: {plan}")
+                problems[name] = plan
+    return problems
+
+if __name__ == "__main__":
+    from db import engine, create_tables
+    logging.basicConfig(level=logging.INFO)
+    create_tables()
+    problems = check_query_plans(engine)
+    print("All hot queries use indexes" if not problems else f"Unindexed queries: {problems}")
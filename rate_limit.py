@@ -0,0 +1,238 @@
+import time
+import atexit
+import threading
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Union
+from sqlalchemy import delete, select
+from sqlalchemy.exc import SQLAlchemyError
+from db import RateLimitCounter, engine, read_engine
+from exception import RateLimitExceededError
+from config import (
+    RATE_LIMIT_ENABLED,
+    RATE_LIMITS,
+    RATE_LIMIT_SOFT_SCOPES,
+    RATE_LIMIT_MAX_DELAY_SECONDS,
+    RATE_LIMIT_FLUSH_INTERVAL_SECONDS,
+    RATE_LIMIT_PURGE_INTERVAL_SECONDS,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Each (route, scope, identity) is counted in fixed windows stored in
+# rate_limit_counters, so every process and replica sharing the database
+# shares the counts. A request is judged on a sliding window estimated from
+# the current window's count plus the previous window's, weighted by how much
+# of it still overlaps the sliding window. A rejected key is also remembered
+# in-process until it may retry, so a client hammering one process is turned
+# away without touching the database again.
+#
+# Checks only read the shared counts, through the read pool. Each process adds
+# its own requests to them in memory and writes them out in one transaction
+# every RATE_LIMIT_FLUSH_INTERVAL_SECONDS, so checks do not queue for the
+# single SQLite writer alongside write-behind. Other processes see a request
+# that much later.
+
+WindowKey = Tuple[str, int]  # (key, window_start)
+
+def _upsert_statement(dialect_name: str):
+    """Add a batch of requests to their windows' counters, creating them if needed."""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    statement = insert(RateLimitCounter)
+    return statement.on_conflict_do_update(
+        index_elements=[RateLimitCounter.key, RateLimitCounter.window_start],
+        set_={"count": RateLimitCounter.count + statement.excluded.count}
+    )
+
+def _retry_after(previous: int, current: int, elapsed: float, window: int, limit: int) -> float:
+    """Seconds until the sliding estimate falls back to `limit`, if nothing else arrives."""
+    if current < limit:
+        # The previous window's share decays away within this window
+        return (window - elapsed) - window * (limit - current) / previous
+    # Only once this window has become the previous one and partly slid out
+    return (window - elapsed) + window * (1 - limit / current)
+
+class RateLimiter:
+    """Sliding-window request limits per route and scope, shared through the database.
+
+    `rules` maps a route to {scope: (limit, window seconds)}; a request is
+    checked against every scope it is given an identity for. Checks never
+    wait: over a limit they raise RateLimitExceededError, except for the
+    route's `soft_scopes`, which instead return how long the caller should
+    make the client wait before its next attempt. If the database cannot be
+    reached the request is let through.
+    """
+
+    def __init__(self, rules: Dict[str, Dict[str, Tuple[int, int]]] = RATE_LIMITS,
+                 enabled: bool = RATE_LIMIT_ENABLED,
+                 purge_interval_seconds: float = RATE_LIMIT_PURGE_INTERVAL_SECONDS,
+                 soft_scopes: Dict[str, Tuple[str, ...]] = RATE_LIMIT_SOFT_SCOPES,
+                 max_delay_seconds: float = RATE_LIMIT_MAX_DELAY_SECONDS,
+                 flush_interval_seconds: float = RATE_LIMIT_FLUSH_INTERVAL_SECONDS):
+        self.rules = rules
+        self.enabled = enabled
+        self.purge_interval_seconds = purge_interval_seconds
+        self.soft_scopes = soft_scopes
+        self.max_delay_seconds = max_delay_seconds
+        self.flush_interval_seconds = flush_interval_seconds
+        self._upsert = _upsert_statement(engine.dialect.name)
+        if self._upsert is None:
+            logger.warning(f"Rate limiting is not supported on {engine.dialect.name}")
+        self._blocked: Dict[str, float] = {}  # key -> time.time() it may retry
+        self._pending: Counter = Counter()  # WindowKey -> requests not yet written
+        self._flushing: Counter = Counter()  # WindowKey -> requests being written now
+        self._last_purge = time.time()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self, route: str, **identities: Optional[Union[str, int]]) -> float:
+        """Count a request to `route`, e.g. check("login", ip=..., user=...).
+
+        Scopes whose identity is None or that the route has no rule for are
+        skipped. Raises RateLimitExceededError if a limit is exceeded; returns
+        the seconds a soft limit asks the client to wait between attempts, else 0.
+        """
+        rules = self.rules.get(route)
+        if not self.enabled or not rules or self._upsert is None:
+            return 0.0
+        soft = self.soft_scopes.get(route, ())
+        keys = [(f"{route}:{scope}:{str(identity)[:100]}", *rules[scope], scope in soft)
+                for scope, identity in identities.items() if identity is not None and scope in rules]
+        if not keys:
+            return 0.0
+
+        now = time.time()
+        with self._lock:
+            retry_at = max((self._blocked.get(key, 0) for key, _, _, _ in keys), default=0)
+        if retry_at > now:
+            raise self._exceeded(retry_at - now)
+
+        try:
+            counts = self._count(keys, now)
+        except SQLAlchemyError as e:
+            logger.error(f"Database error checking rate limit for {route}: {str(e)}")
+            return 0.0
+
+        retry_after, delay = 0.0, 0.0
+        for (key, limit, window, is_soft), (previous, current) in zip(keys, counts):
+            elapsed = now % window
+            estimate = previous * (window - elapsed) / window + current
+            if estimate <= limit:
+                continue
+            if is_soft:
+                delay = max(delay, min(estimate - limit, self.max_delay_seconds))
+                continue
+            wait = max(_retry_after(previous, current, elapsed, window, limit), 1.0)
+            with self._lock:
+                self._blocked[key] = now + wait
+            retry_after = max(retry_after, wait)
+        if retry_after or delay:
+            over = ", ".join(f"{s}={i}" for s, i in identities.items() if i is not None)
+            logger.warning(f"Rate limit {'exceeded' if retry_after else 'pacing requests'} for {route}: {over}")
+        if retry_after:
+            raise self._exceeded(retry_after)
+
+        if now - self._last_purge >= self.purge_interval_seconds:
+            self.purge(now)
+        return delay
+
+    def _count(self, keys: List[Tuple[str, int, int, bool]], now: float) -> List[Tuple[int, int]]:
+        """Add this request to each key's current window; returns (previous, current) counts."""
+        windows = [(key, int(now // window * window), window) for key, _, window, _ in keys]
+        with read_engine.connect() as conn:
+            stored = dict(((key, window_start), count) for key, window_start, count in conn.execute(
+                select(RateLimitCounter.key, RateLimitCounter.window_start, RateLimitCounter.count).where(
+                    RateLimitCounter.key.in_([key for key, _, _ in windows]),
+                    RateLimitCounter.window_start >= min(start - window for _, start, window in windows))
+            ))
+        counts = []
+        with self._lock:
+            for key, window_start, window in windows:
+                self._pending[(key, window_start)] += 1
+                current, previous = (key, window_start), (key, window_start - window)
+                counts.append((stored.get(previous, 0) + self._pending[previous] + self._flushing[previous],
+                               stored.get(current, 0) + self._pending[current] + self._flushing[current]))
+        self._start_flusher()
+        return counts
+
+    def flush(self) -> int:
+        """Write the requests counted since the last flush; returns how many counters were updated."""
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, Counter()
+            if not self._flushing:
+                return 0
+            writing = self._flushing
+            try:
+                with engine.begin() as conn:
+                    conn.execute(self._upsert, [{"key": key, "window_start": window_start, "count": count}
+                                                for (key, window_start), count in writing.items()])
+            except SQLAlchemyError as e:
+                logger.error(f"Failed to write {len(writing)} rate limit counters: {str(e)}")
+                # Keep the counts for the next flush rather than resetting everyone's limits
+                with self._lock:
+                    self._pending.update(writing)
+                    self._flushing = Counter()
+                return 0
+            with self._lock:
+                self._flushing = Counter()
+            return len(writing)
+
+    def _start_flusher(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="rate-limit-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval_seconds):
+            self.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
+
+    @staticmethod
+    def _exceeded(retry_after: float) -> RateLimitExceededError:
+        return RateLimitExceededError(f"Too many requests. Please try again in {int(retry_after + 0.999)} seconds.")
+
+    def purge(self, now: Optional[float] = None) -> None:
+        """Delete counters too old to affect any limit, and lapsed local blocks."""
+        now = now if now is not None else time.time()
+        self._last_purge = now
+        longest_window = max((window for rules in self.rules.values() for _, window in rules.values()), default=0)
+        with self._lock:
+            self._blocked = {key: retry_at for key, retry_at in self._blocked.items() if retry_at > now}
+        try:
+            with engine.begin() as conn:
+                conn.execute(delete(RateLimitCounter).where(RateLimitCounter.window_start < now - 2 * longest_window))
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to purge rate limit counters: {str(e)}")
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+    """Get the process-wide rate limiter."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
+
+def check_rate_limit(route: str, **identities: Optional[Union[str, int]]) -> float:
+    """Count a request against the limits for `route`; raises RateLimitExceededError over them.
+
+    Returns the seconds the client should wait between attempts, non-zero only over a soft limit.
+    """
+    return get_rate_limiter().check(route, **identities)
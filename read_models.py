@@ -0,0 +1,148 @@
+import datetime
+from typing import List, NamedTuple, Optional, Tuple
+from sqlalchemy import select, tuple_
+from sqlalchemy.sql import Select
+from db import ChatHistory, ChatSession, User, UserSession
+
+# Read models: immutable records built straight from column-projected queries.
+# They carry no session or identity-map state, so they are safe to use after
+# the session that read them has closed and cost a fraction of an ORM instance.
+
+class UserRecord(NamedTuple):
+    id: int
+    username: str
+    email: str
+    hashed_password: str
+    created_at: Optional[datetime.datetime]
+    last_login: Optional[datetime.datetime]
+    login_count: int
+    is_active: int
+
+class ChatRecord(NamedTuple):
+    id: int
+    user_id: int
+    user_message: str
+    bot_response: str
+    response_time: Optional[int]
+    timestamp: datetime.datetime
+    session_id: Optional[int]
+
+class SessionPreview(NamedTuple):
+    id: int
+    last_activity: datetime.datetime
+    turn_count: int
+    preview: Optional[str]  # First HISTORY_PREVIEW_LENGTH + 1 characters of the first user message
+
+class AuthSession(NamedTuple):
+    session_token: str
+    user_id: int
+    username: str
+    expires_at: datetime.datetime
+    is_active: int
+
+class SearchResult(NamedTuple):
+    chat_id: int
+    timestamp: datetime.datetime
+    snippet: str  # Matching text with the hits wrapped in ** for markdown
+    rank: float
+
+USER_COLUMNS = (User.id, User.username, User.email, User.hashed_password, User.created_at,
+                User.last_login, User.login_count, User.is_active)
+CHAT_COLUMNS = (ChatHistory.id, ChatHistory.user_id, ChatHistory.user_message, ChatHistory.bot_response,
+                ChatHistory.response_time, ChatHistory.timestamp, ChatHistory.session_id)
+SESSION_COLUMNS = (ChatSession.id, ChatSession.last_activity, ChatSession.turn_count, ChatSession.preview)
+
+def user_query() -> Select:
+    return select(*USER_COLUMNS)
+
+def recent_chats_query(user_id: int, limit: int) -> Select:
+    """A user's most recent turns, newest first."""
+    return (select(*CHAT_COLUMNS).where(ChatHistory.user_id == user_id)
+            .order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).limit(limit))
+
+def session_previews_query(user_id: int, cursor: Optional[Tuple[datetime.datetime, int]], limit: int) -> Select:
+    """One keyset page of a user's conversations, most recently active first.
+
+    Reads only chat_sessions; conversations with no saved turn yet are left out.
+    """
+    query = select(*SESSION_COLUMNS).where(ChatSession.user_id == user_id, ChatSession.turn_count > 0)
+    if cursor is not None:
+        query = query.where(tuple_(ChatSession.last_activity, ChatSession.id) < tuple_(*cursor))
+    return query.order_by(ChatSession.last_activity.desc(), ChatSession.id.desc()).limit(limit)
+
+def session_turns_query(user_id: int, session_id: int, cursor: Optional[Tuple[datetime.datetime, int]],
+                        limit: int) -> Select:
+    """One keyset page of a conversation's turns, newest first."""
+    query = select(*CHAT_COLUMNS).where(ChatHistory.session_id == session_id, ChatHistory.user_id == user_id)
+    if cursor is not None:
+        query = query.where(tuple_(ChatHistory.timestamp, ChatHistory.id) < tuple_(*cursor))
+    return query.order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).limit(limit)
+
+def fetch_auth_session(db, session_token: str) -> Optional[AuthSession]:
+    row = db.execute(
+        select(UserSession.session_token, UserSession.user_id, User.username, UserSession.expires_at,
+               UserSession.is_active)
+        .join(User, User.id == UserSession.user_id)
+        .where(UserSession.session_token == session_token)
+    ).first()
+    return AuthSession._make(row) if row is not None else None
+
+def fetch_user_by_username(db, username: str) -> Optional[UserRecord]:
+    row = db.execute(user_query().where(User.username == username)).first()
+    return UserRecord._make(row) if row is not None else None
+
+def fetch_user_by_email(db, email: str) -> Optional[UserRecord]:
+    row = db.execute(user_query().where(User.email == email)).first()
+    return UserRecord._make(row) if row is not None else None
+
+def _with_archived(db, rows, user_id: int, session_id: Optional[int],
+                   cursor: Optional[Tuple[datetime.datetime, int]], limit: int) -> List[ChatRecord]:
+    """Newest-first turns from the database merged by time with archived ones, up to `limit`.
+
+    Archived conversations are not always older than the turns left in the
+    table, e.g. turns saved outside any conversation are never archived. When
+    the table filled the page, only archived turns newer than its oldest row
+    can displace one, so the archive index is asked for just those.
+    """
+    from archive import fetch_archived_turns
+    turns = [ChatRecord._make(row) for row in rows]
+    after = (turns[-1].timestamp, turns[-1].id) if len(turns) >= limit else None
+    archived = fetch_archived_turns(db, user_id, session_id, cursor, limit, after=after)
+    if not archived:
+        return turns
+    merged = sorted(turns + archived, key=lambda turn: (turn.timestamp, turn.id), reverse=True)
+    return merged[:limit]
+
+def fetch_recent_chats(db, user_id: int, limit: int) -> List[ChatRecord]:
+    """A user's most recent turns, archived ones included, in chronological order."""
+    rows = db.execute(recent_chats_query(user_id, limit)).all()
+    return list(reversed(_with_archived(db, rows, user_id, None, None, limit)))
+
+def fetch_session_turns(db, user_id: int, session_id: int, cursor: Optional[Tuple[datetime.datetime, int]],
+                        limit: int) -> List[ChatRecord]:
+    """One page of a conversation's turns, archived ones included, in chronological order."""
+    rows = db.execute(session_turns_query(user_id, session_id, cursor, limit)).all()
+    return list(reversed(_with_archived(db, rows, user_id, session_id, cursor, limit)))
+
+def fetch_chat_context(db, user_id: int, chat_id: int, turns: int) -> List[ChatRecord]:
+    """A turn together with up to `turns` turns of the same conversation either side of it, in chronological order."""
+    anchor = db.execute(select(ChatHistory.timestamp, ChatHistory.session_id).where(
+        ChatHistory.id == chat_id, ChatHistory.user_id == user_id)).first()
+    if anchor is None:
+        return []
+    timestamp, session_id = anchor
+    key = tuple_(ChatHistory.timestamp, ChatHistory.id)
+    conversation = ChatHistory.session_id == session_id if session_id is not None else ChatHistory.user_id == user_id
+    before = db.execute(
+        select(*CHAT_COLUMNS).where(ChatHistory.user_id == user_id, conversation, key <= tuple_(timestamp, chat_id))
+        .order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).limit(turns + 1)
+    ).all()
+    after = db.execute(
+        select(*CHAT_COLUMNS).where(ChatHistory.user_id == user_id, conversation, key > tuple_(timestamp, chat_id))
+        .order_by(ChatHistory.timestamp, ChatHistory.id).limit(turns)
+    ).all()
+    return [ChatRecord._make(row) for row in list(reversed(before)) + after]
+
+def fetch_session_previews(db, user_id: int, cursor: Optional[Tuple[datetime.datetime, int]],
+                           limit: int) -> List[SessionPreview]:
+    return [SessionPreview._make(row) for row in db.execute(session_previews_query(user_id, cursor, limit))]
@@ -0,0 +1,188 @@
+import re
+import json
+import hashlib
+import threading
+import time
+import logging
+import datetime
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, delete
+from sqlalchemy.exc import SQLAlchemyError
+from db import ResponseCacheEntry, engine, get_db, get_read_db
+from write_behind import get_write_behind, upsert_statement
+from config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_DISK_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    WRITE_BEHIND_ENABLED,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Prune the on-disk table once every this many writes
+PRUNE_INTERVAL = 100
+
+def normalize_prompt(text: str) -> str:
+    """Normalize a prompt so trivially different phrasings share a cache entry."""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+class ResponseCache:
+    """Two-level cache of LLM responses: an in-memory LRU in front of a database table.
+
+    Entries are keyed on the model name, generation parameters, normalized prompt
+    and a fingerprint of the conversation history, and expire after a TTL.
+    New entries are served from memory at once and written to the table
+    through the write-behind queue, off the response path.
+    """
+
+    def __init__(self, enabled: bool = RESPONSE_CACHE_ENABLED, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 disk_max_entries: int = RESPONSE_CACHE_DISK_MAX_ENTRIES,
+                 ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name: str, params: Dict[str, Any], prompt: str, history: str) -> str:
+        """Build a cache key from everything that determines the model's answer."""
+        history_fingerprint = hashlib.sha256(history.encode()).hexdigest()
+        payload = json.dumps(
+            [model_name, params, normalize_prompt(prompt), history_fingerprint],
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a cached response, or None on a miss."""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, created_at = entry
+                if now - created_at < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return response
+                del self._entries[key]
+
+        response, created_at = self._get_from_disk(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, response, created_at)
+        return response
+
+    def set(self, key: str, model_name: str, response: str) -> None:
+        """Store a response in memory and queue it for the on-disk table."""
+        if not self.enabled:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+        row = {
+            "cache_key": key,
+            "model_name": model_name,
+            "response": response,
+            "created_at": datetime.datetime.utcfromtimestamp(now),
+        }
+        if WRITE_BEHIND_ENABLED:
+            get_write_behind().put(ResponseCacheEntry.__table__, row, on_written=self._written, upsert=True)
+            return
+        try:
+            with engine.begin() as conn:
+                conn.execute(upsert_statement(conn.dialect.name, ResponseCacheEntry.__table__), [row])
+        except SQLAlchemyError as e:
+            logger.error(f"Database error writing response cache: {str(e)}")
+            return
+        self._written([row])
+
+    def _written(self, rows: List[Dict[str, Any]]) -> None:
+        """Prune the table once every PRUNE_INTERVAL stored responses; runs after they are committed."""
+        with self._lock:
+            before = self._writes
+            self._writes += len(rows)
+            prune = self._writes // PRUNE_INTERVAL > before // PRUNE_INTERVAL
+        if prune:
+            self.prune()
+
+    def prune(self) -> None:
+        """Delete expired entries and trim the on-disk table to its size cap."""
+        try:
+            with get_db() as db:
+                cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.ttl_seconds)
+                db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.created_at < cutoff))
+
+                # Find the newest entry that no longer fits under the cap
+                oldest_kept = db.execute(
+                    select(ResponseCacheEntry.created_at)
+                    .order_by(ResponseCacheEntry.created_at.desc())
+                    .offset(self.disk_max_entries).limit(1)
+                ).scalar()
+                if oldest_kept is not None:
+                    db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.created_at <= oldest_kept))
+                db.commit()
+        except SQLAlchemyError as e:
+            logger.error(f"Database error pruning response cache: {str(e)}")
+
+    def clear(self) -> None:
+        """Remove every cached response."""
+        with self._lock:
+            self._entries.clear()
+        try:
+            with get_db() as db:
+                db.execute(delete(ResponseCacheEntry))
+                db.commit()
+        except SQLAlchemyError as e:
+            logger.error(f"Database error clearing response cache: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the in-memory size."""
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+    def _remember(self, key: str, response: str, created_at: float) -> None:
+        """Insert into the in-memory LRU; the caller must hold the lock."""
+        self._entries[key] = (response, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_from_disk(self, key: str) -> Tuple[Optional[str], float]:
+        """Look a key up in the on-disk table, ignoring expired rows."""
+        try:
+            with get_read_db() as db:
+                row = db.execute(
+                    select(ResponseCacheEntry.response, ResponseCacheEntry.created_at)
+                    .where(ResponseCacheEntry.cache_key == key)
+                ).first()
+        except SQLAlchemyError as e:
+            logger.error(f"Database error reading response cache: {str(e)}")
+            return None, 0.0
+
+        if row is None:
+            return None, 0.0
+        created_at = row.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+        if time.time() - created_at >= self.ttl_seconds:
+            return None, 0.0
+        return row.response, created_at
@@ -0,0 +1,221 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, Optional
+from exception import ModelTimeoutError, ResourceExhaustedError
+from config import (
+    SCHEDULER_MAX_CONCURRENCY_PER_MODEL,
+    SCHEDULER_MAX_QUEUED_PER_USER,
+    SCHEDULER_REQUEST_TIMEOUT,
+    SCHEDULER_STATS_INTERVAL_SECONDS,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Marks the end of a streamed response
+_DONE = object()
+
+class _Job:
+    __slots__ = ("user_key", "model", "fn", "args", "context", "future", "enqueued_at")
+
+    def __init__(self, user_key: Hashable, model: str, fn: Callable, args: tuple):
+        self.user_key = user_key
+        self.model = model
+        self.fn = fn
+        self.args = args
+        # Run the job with the submitter's context variables (e.g. logging correlation IDs)
+        self.context = contextvars.copy_context()
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+class _ModelLane:
+    """Per-model admission state: a FIFO queue per user, served round-robin.
+
+    Each lane runs its blocking calls in its own worker pool, so a model at its
+    limit cannot hold threads another model needs.
+    """
+
+    def __init__(self, model: str, limit: int):
+        self.limit = limit
+        self.running = 0
+        self.queues: "OrderedDict[Hashable, Deque[_Job]]" = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"generation-{model}")
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def pop_next(self) -> Optional[_Job]:
+        """Take the oldest job of the user at the head of the rotation."""
+        while self.queues:
+            user_key, jobs = next(iter(self.queues.items()))
+            job = jobs.popleft()
+            if jobs:
+                self.queues.move_to_end(user_key)
+            else:
+                del self.queues[user_key]
+            # Skip jobs cancelled while they were waiting
+            if job.future.set_running_or_notify_cancel():
+                return job
+        return None
+
+class GenerationScheduler:
+    """Runs chat generation on one shared asyncio event loop per process.
+
+    Each upstream model gets a concurrency limit. Waiting requests are kept in a
+    FIFO queue per user and served round-robin, so one user's burst cannot
+    starve everyone else. Blocking callables run in a worker pool per model
+    sized to its limit; coroutine functions run directly on the loop. Queue
+    depth and wait times are logged every `stats_interval_seconds` while
+    requests are flowing.
+    """
+
+    def __init__(self, max_concurrency_per_model: int = SCHEDULER_MAX_CONCURRENCY_PER_MODEL,
+                 max_queued_per_user: int = SCHEDULER_MAX_QUEUED_PER_USER,
+                 stats_interval_seconds: float = SCHEDULER_STATS_INTERVAL_SECONDS):
+        self.max_concurrency_per_model = max_concurrency_per_model
+        self.max_queued_per_user = max_queued_per_user
+        self.stats_interval_seconds = stats_interval_seconds
+        self._lanes: Dict[str, _ModelLane] = {}
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="generation-scheduler", daemon=True)
+        self._thread.start()
+        self._started = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._logged_started = 0
+        self._loop.call_soon_threadsafe(self._loop.call_later, stats_interval_seconds, self._log_stats)
+
+    def submit(self, user_key: Hashable, model: str, fn: Callable, *args: Any) -> Future:
+        """Queue a call for a user and return a future for its result.
+
+        Cancelling the future before the call starts removes it from the queue.
+        Raises ResourceExhaustedError if the user already has too many requests waiting.
+        """
+        job = _Job(user_key, model, fn, args)
+        with self._lock:
+            lane = self._lanes.get(model)
+            if lane is None:
+                lane = self._lanes[model] = _ModelLane(model, self.max_concurrency_per_model)
+            jobs = lane.queues.setdefault(user_key, deque())
+            if len(jobs) >= self.max_queued_per_user:
+                if not jobs:
+                    del lane.queues[user_key]
+                raise ResourceExhaustedError("Too many pending requests. Please wait for the current reply.")
+            jobs.append(job)
+            depth = lane.queued()
+        logger.debug(f"Queued request for {user_key} on {model} (queue depth {depth})")
+        self._loop.call_soon_threadsafe(self._dispatch, model)
+        return job.future
+
+    def stream(self, user_key: Hashable, model: str, gen_fn: Callable[..., Iterator[str]], *args: Any,
+               timeout: float = SCHEDULER_REQUEST_TIMEOUT) -> Iterator[str]:
+        """Run a streaming generator through the scheduler and relay its chunks.
+
+        `timeout` bounds the wait for each chunk, including the time spent queued.
+        Closing the returned iterator, e.g. because the user navigated away,
+        cancels the request or stops the generator at its next chunk.
+        """
+        chunks: "queue.Queue[Any]" = queue.Queue()
+        stop = threading.Event()
+
+        def produce():
+            gen = gen_fn(*args)
+            try:
+                for chunk in gen:
+                    if stop.is_set():
+                        break
+                    chunks.put(chunk)
+            finally:
+                gen.close()
+                chunks.put(_DONE)
+
+        future = self.submit(user_key, model, produce)
+        future.add_done_callback(lambda f: chunks.put(_DONE) if f.cancelled() else None)
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=timeout)
+                except queue.Empty:
+                    raise ModelTimeoutError()
+                if chunk is _DONE:
+                    break
+                yield chunk
+            if not future.cancelled():
+                future.result()
+        finally:
+            stop.set()
+            future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Report queue depth and running requests per model, and queue wait times."""
+        with self._lock:
+            lanes = {
+                model: {"queued": lane.queued(), "running": lane.running, "users_waiting": len(lane.queues)}
+                for model, lane in self._lanes.items()
+            }
+            started = self._started
+            return {
+                "models": lanes,
+                "started": started,
+                "avg_wait_seconds": self._total_wait / started if started else 0.0,
+                "max_wait_seconds": self._max_wait,
+            }
+
+    def _log_stats(self) -> None:
+        """Log scheduler stats if anything started or is waiting since the last time; runs on the loop thread."""
+        stats = self.stats()
+        waiting = sum(lane["queued"] for lane in stats["models"].values())
+        if stats["started"] > self._logged_started or waiting:
+            self._logged_started = stats["started"]
+            depths = ", ".join(f"{model}: {lane['queued']} queued, {lane['running']} running"
+                               for model, lane in stats["models"].items())
+            logger.info(f"Scheduler stats: {depths}; {stats['started']} started, "
+                        f"average wait {stats['avg_wait_seconds']:.2f}s, max wait {stats['max_wait_seconds']:.2f}s")
+        self._loop.call_later(self.stats_interval_seconds, self._log_stats)
+
+    def _dispatch(self, model: str) -> None:
+        """Start queued jobs while the model has free slots; runs on the loop thread."""
+        while True:
+            with self._lock:
+                lane = self._lanes[model]
+                if lane.running >= lane.limit:
+                    return
+                job = lane.pop_next()
+                if job is None:
+                    return
+                lane.running += 1
+                wait = time.monotonic() - job.enqueued_at
+                self._started += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            if wait > 1.0:
+                logger.info(f"Request for {job.user_key} on {model} waited {wait:.2f}s in queue")
+            self._loop.create_task(self._run(job))
+
+    async def _run(self, job: _Job) -> None:
+        try:
+            if asyncio.iscoroutinefunction(job.fn):
+                result = await job.fn(*job.args)
+            else:
+                executor = self._lanes[job.model].executor
+                result = await self._loop.run_in_executor(executor, job.context.run, job.fn, *job.args)
+            job.future.set_result(result)
+        except Exception as e:
+            job.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._lanes[job.model].running -= 1
+            self._dispatch(job.model)
+
+@lru_cache(maxsize=1)
+def get_scheduler() -> GenerationScheduler:
+    """Get the process-wide generation scheduler."""
+    return GenerationScheduler()
@@ -0,0 +1,179 @@
+import re
+import time
+import logging
+from typing import Any, Dict, Iterable, List
+from sqlalchemy import DateTime, inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import SQLAlchemyError
+from db import get_read_db
+from read_models import SearchResult
+from config import SEARCH_RESULTS_LIMIT, SEARCH_SNIPPET_TOKENS
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# The search index holds only the terms of each turn, never a second copy of
+# its text. Rows are added by the chat write path in the same transaction as
+# the turn, and removed before the turn is deleted.
+# SQLite: an external-content FTS5 table whose rowid is the chat_history id.
+# Its content is a view over chat_history that reads the bodies through the
+# chat_text() function db registers, so snippets come from the stored turn
+# even when the body is compressed. The owner column holds "u<user_id>" so the
+# user filter is part of the full-text match.
+# Postgres: a table of tsvectors computed from the text on insert, with a GIN
+# index; snippets are drawn from chat_history.
+
+SQLITE_DDL = [
+    "CREATE VIEW IF NOT EXISTS chat_search_source AS SELECT id, 'u' || user_id AS owner, "
+    "chat_text(user_message) AS user_message, chat_text(bot_response) AS bot_response FROM chat_history",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_search USING fts5("
+    "owner, user_message, bot_response, content = 'chat_search_source', content_rowid = 'id', "
+    "tokenize = 'porter unicode61')",
+]
+
+POSTGRES_DDL = [
+    "CREATE TABLE IF NOT EXISTS chat_search ("
+    "chat_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_search_document ON chat_search USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_search_user_id ON chat_search (user_id)",
+]
+
+def _postgres_document(user_message: str, bot_response: str) -> str:
+    """SQL for the weighted tsvector of a turn, from two text expressions."""
+    return (f"setweight(to_tsvector('english', coalesce({user_message}, '')), 'A') || "
+            f"setweight(to_tsvector('english', coalesce({bot_response}, '')), 'B')")
+
+def create_search_index(conn: Connection) -> None:
+    """Create the search table and index the turns already stored."""
+    if conn.dialect.name == "sqlite":
+        for statement in SQLITE_DDL:
+            conn.exec_driver_sql(statement)
+        conn.exec_driver_sql("INSERT INTO chat_search (chat_search) VALUES ('rebuild')")
+    elif conn.dialect.name == "postgresql":
+        for statement in POSTGRES_DDL:
+            conn.exec_driver_sql(statement)
+        conn.exec_driver_sql(
+            "INSERT INTO chat_search (chat_id, user_id, document) "
+            f"SELECT id, user_id, {_postgres_document('user_message', 'bot_response')} FROM chat_history "
+            "ON CONFLICT DO NOTHING"
+        )
+    else:
+        logger.warning(f"Full-text search is not supported on {conn.dialect.name}")
+
+def drop_search_text(conn: Connection) -> None:
+    """Rebuild a search index created with its own copy of the text as one that holds only terms."""
+    if conn.dialect.name == "sqlite":
+        definition = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'chat_search'").scalar()
+        if definition is None or "content =" in definition:
+            return
+    elif conn.dialect.name == "postgresql":
+        columns = {column["name"] for column in inspect(conn).get_columns("chat_search")}
+        if "user_message" not in columns:
+            return
+    else:
+        return
+    conn.exec_driver_sql("DROP TABLE chat_search")
+    create_search_index(conn)
+
+def index_chats(conn: Connection, rows: List[Dict[str, Any]]) -> None:
+    """Add newly inserted chat_history rows to the search index.
+
+    Runs inside the inserting transaction so the index never disagrees with
+    chat_history. `rows` need id, user_id, user_message and bot_response.
+    """
+    if conn.dialect.name == "sqlite":
+        conn.execute(
+            text("INSERT INTO chat_search (rowid, owner, user_message, bot_response) "
+                 "VALUES (:id, :owner, :user_message, :bot_response)"),
+            [{**_texts(row), "id": row["id"], "owner": f"u{row['user_id']}"} for row in rows]
+        )
+    elif conn.dialect.name == "postgresql":
+        conn.execute(
+            text("INSERT INTO chat_search (chat_id, user_id, document) "
+                 f"VALUES (:id, :user_id, {_postgres_document('CAST(:user_message AS TEXT)', 'CAST(:bot_response AS TEXT)')})"),
+            [{**_texts(row), "id": row["id"], "user_id": row["user_id"]} for row in rows]
+        )
+
+def unindex_chats(conn: Connection, chat_ids: Iterable[int]) -> None:
+    """Remove chat_history rows from the search index; call before deleting the rows."""
+    ids = [{"id": chat_id} for chat_id in chat_ids]
+    if not ids:
+        return
+    if conn.dialect.name == "sqlite":
+        # An external-content index is told the text it indexed, which is read back from the turn.
+        # Deleting a turn that was never indexed would corrupt the index, so only turns listed in
+        # FTS5's per-document table (chat_search_docsize) are deleted.
+        conn.execute(text(
+            "INSERT INTO chat_search (chat_search, rowid, owner, user_message, bot_response) "
+            "SELECT 'delete', id, owner, user_message, bot_response FROM chat_search_source "
+            "WHERE id = :id AND id IN (SELECT id FROM chat_search_docsize)"
+        ), ids)
+    elif conn.dialect.name == "postgresql":
+        conn.execute(text("DELETE FROM chat_search WHERE chat_id = :id"), ids)
+
+def _texts(row: Dict[str, Any]) -> Dict[str, str]:
+    # str() so values that render lazily are indexed as plain text
+    return {"user_message": str(row["user_message"] or ""), "bot_response": str(row["bot_response"] or "")}
+
+def _fts5_query(query: str) -> str:
+    """Turn free text into an FTS5 query in which every word must match.
+
+    Words match whole stemmed tokens; prefix matching is left out because a
+    short prefix expands to a large part of the vocabulary.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return ""
+    quoted = ['"' + word.replace('"', '""') + '"' for word in words]
+    return " ".join(quoted)
+
+def search_chats(user_id: int, query: str, limit: int = SEARCH_RESULTS_LIMIT) -> List[SearchResult]:
+    """Search a user's chat history, best matches first, with highlighted snippets."""
+    if not query or not query.strip():
+        return []
+    try:
+        start_time = time.time()
+        with get_read_db() as db:
+            dialect = db.get_bind().dialect.name
+            if dialect == "sqlite":
+                match = _fts5_query(query)
+                if not match:
+                    return []
+                message_snippet = f"snippet(chat_search, 1, '**', '**', '...', {SEARCH_SNIPPET_TOKENS})"
+                response_snippet = f"snippet(chat_search, 2, '**', '**', '...', {SEARCH_SNIPPET_TOKENS})"
+                rows = db.execute(text(
+                    "SELECT s.rowid AS chat_id, c.timestamp AS timestamp, "
+                    # Prefer the user's message for the snippet when it contains a hit
+                    f"CASE WHEN instr({message_snippet}, '**') > 0 THEN {message_snippet} "
+                    f"ELSE {response_snippet} END AS snippet, "
+                    "-s.rank AS rank "
+                    "FROM chat_search AS s JOIN chat_history AS c ON c.id = s.rowid "
+                    # Ordering by FTS5's rank column sorts inside the index, so rows come out best
+                    # first and only the first :limit get a snippet, which reads and decompresses the turn.
+                    # Column weights: owner, user_message, bot_response; lower bm25 is better
+                    "WHERE chat_search MATCH :match AND s.rank MATCH 'bm25(0.0, 2.0, 1.0)' "
+                    "ORDER BY s.rank LIMIT :limit"
+                ).columns(timestamp=DateTime), {
+                    "match": f'owner:"u{user_id}" AND {{user_message bot_response}}: ({match})',
+                    "limit": limit,
+                }).all()
+            elif dialect == "postgresql":
+                rows = db.execute(text(
+                    "SELECT r.chat_id AS chat_id, c.timestamp AS timestamp, "
+                    "ts_headline('english', coalesce(c.user_message, '') || ' ' || coalesce(c.bot_response, ''), r.q, "
+                    f"'StartSel=**, StopSel=**, MaxWords={SEARCH_SNIPPET_TOKENS}, MinWords=3') AS snippet, "
+                    "r.rank AS rank "
+                    # Headlines re-parse the turn's text, so only the best matches get one
+                    "FROM (SELECT s.chat_id, q, ts_rank(s.document, q) AS rank "
+                    "FROM chat_search AS s, websearch_to_tsquery('english', :query) AS q "
+                    "WHERE s.user_id = :user_id AND s.document @@ q ORDER BY rank DESC LIMIT :limit) AS r "
+                    "JOIN chat_history AS c ON c.id = r.chat_id ORDER BY r.rank DESC"
+                ).columns(timestamp=DateTime), {"query": query, "user_id": user_id, "limit": limit}).all()
+            else:
+                return []
+
+        logger.debug(f"Search returned {len(rows)} results in {(time.time() - start_time) * 1000:.1f}ms")
+        return [SearchResult._make(row) for row in rows]
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in search_chats: {str(e)}")
+        return []
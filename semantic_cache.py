@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import hashlib
+import time
+import zlib
+import atexit
+import threading
+import logging
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+from config import (
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_DIM,
+    SEMANTIC_CACHE_TTL_SECONDS,
+    SEMANTIC_CACHE_PATH,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Persist the index to disk once every this many insertions
+SAVE_INTERVAL = 50
+
+class HashingEmbedder:
+    """Embeds text as a signed, L2-normalized bag of hashed words and word bigrams.
+
+    Needs no model download and runs in microseconds on CPU. Hashing uses CRC32
+    so vectors are stable across processes and can be persisted.
+    """
+
+    def __init__(self, dim: int = SEMANTIC_CACHE_DIM):
+        self.dim = dim
+
+    def __call__(self, text: str) -> np.ndarray:
+        words = re.findall(r"\w+", text.casefold())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in features:
+            h = zlib.crc32(feature.encode())
+            vector[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class SemanticCache:
+    """Answers questions that are close paraphrases of ones already answered.
+
+    Question embeddings live in a preallocated NumPy matrix, so a lookup is a
+    single matrix-vector product. Slots are reused least-recently-used first
+    once the index is full, and the index is persisted to an .npz file.
+
+    Every entry belongs to a namespace, normally the model and generation
+    parameters that produced the answer (see make_namespace), and is only
+    returned for lookups in the same namespace. Only answers to standalone
+    questions, asked without prior conversation, belong in the cache.
+    """
+
+    def __init__(self, enabled: bool = SEMANTIC_CACHE_ENABLED, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS,
+                 path: Optional[str] = SEMANTIC_CACHE_PATH, embedder: Optional[Callable[[str], np.ndarray]] = None):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.embedder = embedder or HashingEmbedder()
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._created_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._answers = [""] * max_entries
+        self._namespaces = np.full(max_entries, "", dtype=object)
+        self._size = 0
+        self._inserts = 0
+        self.hits = 0
+        self.misses = 0
+
+        if self.enabled:
+            self._load()
+            if self.path:
+                atexit.register(self.save)
+
+    @staticmethod
+    def make_namespace(model_name: str, params: Dict[str, Any]) -> str:
+        """Fingerprint of everything besides the question that determines an answer."""
+        payload = json.dumps([model_name, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def lookup(self, question: str, namespace: str = "") -> Optional[str]:
+        """Return the stored answer for the most similar question in `namespace` above the threshold."""
+        if not self.enabled:
+            return None
+
+        query = self.embedder(question)
+        now = time.time()
+        with self._lock:
+            if self._size == 0:
+                self.misses += 1
+                return None
+            scores = self._vectors[:self._size] @ query
+            # Ignore expired entries rather than compacting the index on every lookup
+            scores[now - self._created_at[:self._size] >= self.ttl_seconds] = -1.0
+            scores[self._namespaces[:self._size] != namespace] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self._last_used[best] = now
+            self.hits += 1
+            logger.debug(f"Semantic cache hit (similarity {scores[best]:.3f})")
+            return self._answers[best]
+
+    def add(self, question: str, answer: str, namespace: str = "") -> None:
+        """Insert a question/answer pair, evicting the least recently used entry when full."""
+        if not self.enabled:
+            return
+
+        vector = self.embedder(question)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._answers[slot] = answer
+            self._namespaces[slot] = namespace
+            self._created_at[slot] = now
+            self._last_used[slot] = now
+            self._inserts += 1
+            save = self._inserts % SAVE_INTERVAL == 0
+
+        if save:
+            self.save()
+
+    def save(self) -> None:
+        """Write the index to disk."""
+        if not self.path:
+            return
+        with self._lock:
+            if self._size == 0:
+                return
+            n = self._size
+            data = {
+                "vectors": self._vectors[:n].copy(),
+                "answers": np.array(self._answers[:n], dtype=str),
+                "namespaces": np.array(self._namespaces[:n], dtype=str),
+                "created_at": self._created_at[:n].copy(),
+                "last_used": self._last_used[:n].copy(),
+            }
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp.npz"
+            np.savez_compressed(tmp_path, **data)
+            os.replace(tmp_path, self.path)
+            logger.info(f"Semantic cache saved with {n} entries")
+        except Exception as e:
+            logger.error(f"Failed to save semantic cache: {str(e)}")
+
+    def _load(self) -> None:
+        """Load a previously saved index, keeping the most recently used entries that fit."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                order = np.argsort(data["last_used"])[::-1][:self.max_entries]
+                n = len(order)
+                self._vectors = np.zeros((self.max_entries, data["vectors"].shape[1]), dtype=np.float32)
+                self._vectors[:n] = data["vectors"][order]
+                self._created_at[:n] = data["created_at"][order]
+                self._last_used[:n] = data["last_used"][order]
+                for i, j in enumerate(order):
+                    self._answers[i] = str(data["answers"][j])
+                    self._namespaces[i] = str(data["namespaces"][j])
+                self._size = n
+            logger.info(f"Semantic cache loaded with {self._size} entries")
+        except Exception as e:
+            logger.error(f"Failed to load semantic cache: {str(e)}")
@@ -0,0 +1,240 @@
+import os
+import atexit
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+import datetime
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.exc import SQLAlchemyError
+from db import UserSession, engine, get_read_db
+from read_models import AuthSession, fetch_auth_session
+from auth import create_session_token
+from exception import DatabaseError
+from config import (
+    SESSION_EXPIRY_DAYS,
+    SESSION_SECRET,
+    SESSION_SECRET_PATH,
+    SESSION_CACHE_TTL_SECONDS,
+    SESSION_CACHE_MAX_ENTRIES,
+    SESSION_TOUCH_INTERVAL_SECONDS,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# A token handed to the browser is "<session id>.<signature>", where the session
+# id is the user_sessions.session_token value and the signature an HMAC of it.
+# Forged or mangled tokens are rejected without a database read; valid ones are
+# checked against user_sessions at most once per SESSION_CACHE_TTL_SECONDS, so
+# a logout elsewhere takes effect within that time.
+
+SECRET_BYTES = 32
+
+def _load_secret() -> bytes:
+    """The signing key: SESSION_SECRET, else one generated once and shared through a file.
+
+    A generated key is written to a temporary file and linked into place, so
+    a process that loses the race to create it reads the winner's whole key,
+    never a partly written file.
+    """
+    if SESSION_SECRET:
+        return SESSION_SECRET.encode()
+    try:
+        return _read_secret()
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(SESSION_SECRET_PATH) or ".", exist_ok=True)
+    temp_path = f"{SESSION_SECRET_PATH}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    key = secrets.token_bytes(SECRET_BYTES)
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+            f.flush()
+            os.fsync(f.fileno())
+        os.link(temp_path, SESSION_SECRET_PATH)
+    except FileExistsError:
+        return _read_secret()
+    finally:
+        os.unlink(temp_path)
+    return key
+
+def _read_secret() -> bytes:
+    with open(SESSION_SECRET_PATH, "rb") as f:
+        key = f.read()
+    if len(key) != SECRET_BYTES:
+        raise RuntimeError(f"Session secret {SESSION_SECRET_PATH} is truncated; delete it to generate a new one")
+    return key
+
+_secret: Optional[bytes] = None
+
+def _sign(session_id: str) -> str:
+    global _secret
+    if _secret is None:
+        _secret = _load_secret()
+    mac = hmac.new(_secret, session_id.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(mac).decode().rstrip("=")
+
+def _unsign(token: str) -> Optional[str]:
+    """The session id of a correctly signed token, or None."""
+    session_id, _, signature = token.rpartition(".")
+    if not session_id or not hmac.compare_digest(_sign(session_id), signature):
+        return None
+    return session_id
+
+class _SessionCache:
+    """Recently validated sessions, trusted without a database read until their TTL passes."""
+
+    def __init__(self, ttl_seconds: float = SESSION_CACHE_TTL_SECONDS, max_entries: int = SESSION_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[AuthSession, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[AuthSession]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            auth_session, validated_at = entry
+            if time.monotonic() - validated_at >= self.ttl_seconds:
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return auth_session
+
+    def set(self, auth_session: AuthSession) -> None:
+        with self._lock:
+            self._entries[auth_session.session_token] = (auth_session, time.monotonic())
+            self._entries.move_to_end(auth_session.session_token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def extend(self, session_id: str, expires_at: datetime.datetime) -> None:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries[session_id] = (entry[0]._replace(expires_at=expires_at), entry[1])
+
+    def discard(self, session_id: str) -> None:
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+class _SessionToucher:
+    """Batches last-seen and sliding-expiry updates and writes them in the background."""
+
+    def __init__(self, interval_seconds: float = SESSION_TOUCH_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self._pending: Dict[str, datetime.datetime] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="session-toucher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def touch(self, session_id: str, seen_at: datetime.datetime) -> None:
+        with self._lock:
+            self._pending[session_id] = seen_at
+
+    def flush(self) -> int:
+        """Write the pending updates; returns how many sessions were updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        expiry = datetime.timedelta(days=SESSION_EXPIRY_DAYS)
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    update(UserSession).where(UserSession.session_token == bindparam("b_session_id"))
+                    .values(last_seen_at=bindparam("b_seen_at"), expires_at=bindparam("b_expires_at")),
+                    [{"b_session_id": session_id, "b_seen_at": seen_at, "b_expires_at": seen_at + expiry}
+                     for session_id, seen_at in pending.items()]
+                )
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to update {len(pending)} login sessions: {str(e)}")
+            return 0
+        return len(pending)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            self.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
+
+_cache = _SessionCache()
+_toucher: Optional[_SessionToucher] = None
+_toucher_lock = threading.Lock()
+
+def _get_toucher() -> _SessionToucher:
+    global _toucher
+    with _toucher_lock:
+        if _toucher is None:
+            _toucher = _SessionToucher()
+        return _toucher
+
+def create_session(user_id: int, username: str) -> str:
+    """Start a login session and return its signed token."""
+    session_id = create_session_token()
+    now = datetime.datetime.utcnow()
+    auth_session = AuthSession(session_id, user_id, username, now + datetime.timedelta(days=SESSION_EXPIRY_DAYS), 1)
+    with engine.begin() as conn:
+        conn.execute(insert(UserSession).values(
+            user_id=user_id, session_token=session_id, created_at=now, last_seen_at=now,
+            expires_at=auth_session.expires_at, is_active=1
+        ))
+    _cache.set(auth_session)
+    logger.info(f"Login session created for user {user_id}")
+    return f"{session_id}.{_sign(session_id)}"
+
+def validate_session(token: Optional[str]) -> Optional[AuthSession]:
+    """Get the live session a token belongs to, or None if it is not one.
+
+    Costs no database access while the session is cached. Records the
+    visit, which also slides the expiry, without waiting for the write.
+    Raises DatabaseError if the session could not be checked, which says
+    nothing about whether the token is still good.
+    """
+    session_id = _unsign(token) if token else None
+    if session_id is None:
+        return None
+
+    auth_session = _cache.get(session_id)
+    if auth_session is None:
+        try:
+            with get_read_db() as db:
+                auth_session = fetch_auth_session(db, session_id)
+        except SQLAlchemyError as e:
+            logger.error(f"Database error validating session: {str(e)}")
+            raise DatabaseError("Could not check the login session")
+        if auth_session is None or not auth_session.is_active:
+            return None
+        _cache.set(auth_session)
+
+    now = datetime.datetime.utcnow()
+    if auth_session.expires_at <= now:
+        _cache.discard(session_id)
+        return None
+    _cache.extend(session_id, now + datetime.timedelta(days=SESSION_EXPIRY_DAYS))
+    _get_toucher().touch(session_id, now)
+    return auth_session
+
+def revoke_session(token: Optional[str]) -> None:
+    """End a login session, e.g. on logout."""
+    session_id = _unsign(token) if token else None
+    if session_id is None:
+        return
+    _cache.discard(session_id)
+    try:
+        with engine.begin() as conn:
+            conn.execute(update(UserSession).where(UserSession.session_token == session_id).values(is_active=0))
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to revoke session: {str(e)}")
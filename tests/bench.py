@@ -0,0 +1,32 @@
+import statistics
+import threading
+import time
+from typing import Callable, List, Tuple
+
+def run_clients(clients: int, requests_per_client: int, request: Callable[[int, int], None]) -> Tuple[float, List[float]]:
+    """Run `request(client, n)` from `clients` threads at once; returns the wall time and each request's latency."""
+    latencies: List[float] = []
+    lock = threading.Lock()
+    start_together = threading.Barrier(clients)
+
+    def client(client_id: int) -> None:
+        start_together.wait()
+        for n in range(requests_per_client):
+            started = time.perf_counter()
+            request(client_id, n)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client, args=(client_id,)) for client_id in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies
+
+def percentile(latencies: List[float], pct: int) -> float:
+    """The pct-th percentile, e.g. 99 for p99."""
+    if len(latencies) == 1:
+        return latencies[0]
+    return statistics.quantiles(latencies, n=100)[pct - 1]
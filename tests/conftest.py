@@ -0,0 +1,97 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# The modules under test are flat files in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# They also keep the SQLite database, logs and caches relative to the working
+# directory, read at import, so every run gets a fresh one
+os.chdir(tempfile.mkdtemp(prefix="chatbot-tests-"))
+os.environ.setdefault("HF_TOKEN", "test")
+
+# Run the suite against a server database with TEST_DATABASE_URL, e.g.
+#   TEST_DATABASE_URL=postgresql://postgres@localhost/chatbot_test python -m pytest tests
+# or against a throwaway local Postgres started for the run (needs the pgserver package):
+#   python -m pytest tests --postgres
+# Its tables are dropped first, so never point it at a database you care about.
+# DATABASE_URL itself is ignored here so a developer's real database is never touched.
+os.environ.pop("DATABASE_URL", None)
+os.environ.pop("DATABASE_READ_URL", None)
+if os.getenv("TEST_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+
+def pytest_addoption(parser):
+    parser.addoption("--run-benchmarks", action="store_true", default=False,
+                     help="Also run the tests marked as benchmarks")
+    parser.addoption("--postgres", action="store_true", default=False,
+                     help="Run against a local Postgres stand-in started for the run (requires pgserver)")
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: slower measurement that reports timings; run with --run-benchmarks")
+    if config.getoption("--postgres") and not os.getenv("TEST_DATABASE_URL"):
+        # Runs before any test module imports db, which reads DATABASE_URL on import
+        import pgserver
+        server = pgserver.get_server(tempfile.mkdtemp(prefix="chatbot-pg-"), cleanup_mode="delete")
+        # Stopped and deleted at exit, after the app's own exit handlers have flushed their writes
+        config._postgres_stand_in = server
+        os.environ["DATABASE_URL"] = server.get_uri()
+
+def pytest_sessionfinish(session, exitstatus):
+    # An app run under AppTest sends logging to pytest's captured stdout, which is
+    # closed before exit handlers (e.g. cache saves) log; stop writing there first
+    if "logger" in sys.modules:
+        sys.modules["logger"]._stop_listener()
+
+def pytest_report_header(config):
+    from sqlalchemy import make_url
+    url = make_url(os.getenv("DATABASE_URL", "sqlite:///db/chatbot.db"))
+    return f"database: {url.get_backend_name()}"
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="benchmark; run with --run-benchmarks")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+@pytest.fixture
+def report(capsys):
+    """Print a benchmark result line even though pytest captures output."""
+    def emit(line: str) -> None:
+        with capsys.disabled():
+            print(f"\n    {line}", end="")
+    return emit
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    """A schema created from scratch for the session."""
+    from sqlalchemy import MetaData
+    import db
+    if not db.IS_SQLITE:
+        # Tables left by an earlier run, including those created outside the models (e.g. chat_search)
+        existing = MetaData()
+        existing.reflect(bind=db.engine)
+        existing.drop_all(bind=db.engine)
+    db.create_tables()
+    yield db
+    from write_behind import get_write_behind
+    get_write_behind().flush(timeout=10)
+
+_counter = iter(range(1, 10 ** 9))
+
+@pytest.fixture
+def make_user(database):
+    """Create a user with a unique name and return its id."""
+    from db import User, get_db
+
+    def make(prefix: str = "user") -> int:
+        with get_db() as session:
+            user = User(username=f"{prefix}{next(_counter)}", email=f"{prefix}{next(_counter)}@example.com",
+                        hashed_password="x")
+            session.add(user)
+            session.commit()
+            return user.id
+    return make
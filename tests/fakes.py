@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Union
+from backends import LLMBackend
+
+class FakeBackend(LLMBackend):
+    """Stand-in LLM backend: answers by echoing the prompt's last line, after an optional delay."""
+
+    name = "fake"
+
+    def __init__(self, model_name: str = "fake-model", delay: float = 0.0, answer: Optional[str] = None):
+        super().__init__(model_name, {})
+        self.delay = delay
+        self.answer = answer
+        self.prompts: List[str] = []
+        self._lock = threading.Lock()
+
+    def generate(self, prompt: str) -> str:
+        with self._lock:
+            self.prompts.append(prompt)
+        if self.delay:
+            time.sleep(self.delay)
+        if self.answer is not None:
+            return self.answer
+        return f"answer #{len(self.prompts)} to: {prompt.strip().splitlines()[-2].strip()}"
+
+    @property
+    def calls(self) -> int:
+        return len(self.prompts)
+
+class _StandInHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for a whole client connection pool connecting at once
+    request_queue_size = 128
+
+class StandInLLMServer:
+    """Local stand-in for an OpenAI-compatible chat completions endpoint.
+
+    Each request takes the next step from `script` if any is left, else
+    answers normally after `delay` seconds. A step is an HTTP status to reply
+    with, or a number of seconds to stall before answering.
+    """
+
+    def __init__(self, delay: float = 0.0, script: Optional[List[Union[int, float]]] = None):
+        self.delay = delay
+        self.script = list(script or [])
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = _StandInHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def _next_step(self) -> Union[int, float]:
+        with self._lock:
+            self.requests += 1
+            return self.script.pop(0) if self.script else float(self.delay)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this each reply waits on a delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                step = server._next_step()
+                if isinstance(step, int):
+                    self._reply(step, {"error": "stand-in failure"})
+                    return
+                time.sleep(step)
+                prompt = payload["messages"][-1]["content"]
+                self._reply(200, {"choices": [{"message": {"role": "assistant", "content": f"echo: {prompt}"}}]})
+
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+    def __enter__(self) -> "StandInLLMServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
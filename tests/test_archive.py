@@ -0,0 +1,57 @@
+import asyncio
+import datetime
+from sqlalchemy import insert
+from archive import archive_cold_sessions
+from db import ChatHistory, ChatSession, engine, get_read_db
+from read_models import fetch_recent_chats, fetch_session_turns
+from utils import fetch_chat_history_async
+
+def days_ago(days):
+    return datetime.datetime.utcnow() - datetime.timedelta(days=days)
+
+def add_turn(user_id, message, timestamp, session_id=None):
+    with engine.begin() as conn:
+        return conn.execute(insert(ChatHistory).values(
+            user_id=user_id, session_id=session_id, user_message=message, bot_response="ok", timestamp=timestamp
+        ).returning(ChatHistory.id)).scalar_one()
+
+def add_conversation(user_id, messages, timestamps):
+    with engine.begin() as conn:
+        session_id = conn.execute(insert(ChatSession).values(
+            user_id=user_id, created_at=timestamps[0], last_activity=timestamps[-1], turn_count=len(messages)
+        ).returning(ChatSession.id)).scalar_one()
+    for message, timestamp in zip(messages, timestamps):
+        add_turn(user_id, message, timestamp, session_id)
+    return session_id
+
+def test_recent_chats_merge_newer_archived_turns_with_older_database_turns(make_user):
+    user_id = make_user()
+    # Saved outside any conversation, so never archived, and older than the archived conversation
+    add_turn(user_id, "loose turn", days_ago(200))
+    add_conversation(user_id, ["first", "second"], [days_ago(120), days_ago(119)])
+    assert archive_cold_sessions(older_than_days=90) == 2
+
+    with get_read_db() as db:
+        assert [turn.user_message for turn in fetch_recent_chats(db, user_id, 1)] == ["second"]
+        assert [turn.user_message for turn in fetch_recent_chats(db, user_id, 5)] == ["loose turn", "first", "second"]
+
+def test_resumed_conversation_pages_through_database_then_archive(make_user):
+    user_id = make_user()
+    session_id = add_conversation(user_id, ["old 1", "old 2"], [days_ago(150), days_ago(149)])
+    assert archive_cold_sessions(older_than_days=90) == 2
+    add_turn(user_id, "new 1", days_ago(1), session_id)
+
+    with get_read_db() as db:
+        page = fetch_session_turns(db, user_id, session_id, None, 2)
+        assert [turn.user_message for turn in page] == ["old 2", "new 1"]
+        earlier = fetch_session_turns(db, user_id, session_id, (page[0].timestamp, page[0].id), 2)
+        assert [turn.user_message for turn in earlier] == ["old 1"]
+
+def test_async_history_reads_archived_turns(make_user):
+    user_id = make_user()
+    add_conversation(user_id, ["first", "second"], [days_ago(120), days_ago(119)])
+    assert archive_cold_sessions(older_than_days=90) >= 2  # Earlier tests may leave cold turns behind
+    add_turn(user_id, "recent", days_ago(1))
+
+    history = asyncio.run(fetch_chat_history_async(user_id, 5))
+    assert [turn.user_message for turn in history] == ["first", "second", "recent"]
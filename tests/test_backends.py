@@ -0,0 +1,72 @@
+import threading
+import time
+import pytest
+import chatbot
+from backends import LLMBackend, TransformersBackend
+from exception import ModelResponseError
+from fakes import FakeBackend
+
+class FailingBackend(FakeBackend):
+    def generate(self, prompt: str) -> str:
+        if "fail" in prompt:
+            raise ValueError(prompt)
+        return super().generate(prompt)
+
+class NativeBatchBackend(FakeBackend):
+    supports_batching = True
+
+def test_backend_must_implement_generate():
+    class Incomplete(LLMBackend):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete("model", {})
+
+def test_fallback_batch_runs_prompts_concurrently():
+    backend = FakeBackend(delay=0.2, answer="ok")
+    start = time.monotonic()
+    results = backend.generate_batch([f"prompt {n}" for n in range(8)])
+    assert results == ["ok"] * 8
+    # One call's delay, not eight
+    assert time.monotonic() - start < 0.8
+
+def test_fallback_batch_returns_errors_in_place():
+    results = FailingBackend(answer="ok").generate_batch(["a", "fail", "b"])
+    assert results[0] == "ok" and results[2] == "ok"
+    assert isinstance(results[1], ValueError)
+
+def test_only_natively_batching_backends_go_through_the_batcher(monkeypatch):
+    monkeypatch.setattr(chatbot, "BATCHING_ENABLED", True)
+    assert chatbot.Chatbot(backend=FakeBackend()).batcher is None
+    assert chatbot.Chatbot(backend=NativeBatchBackend()).batcher is not None
+
+class FailingModel:
+    """Streams part of a reply, then fails the way a local model can (e.g. out of memory)."""
+
+    def generate(self, streamer, **kwargs):
+        streamer.on_finalized_text("partial ")
+        raise RuntimeError("out of memory")
+
+def failing_transformers_backend():
+    # Skips loading a real model; stream() only needs these attributes
+    backend = TransformersBackend.__new__(TransformersBackend)
+    LLMBackend.__init__(backend, "local-model", {})
+    backend.tokenizer = None
+    backend.model = FailingModel()
+    backend._lock = threading.Lock()
+    backend._encode = lambda prompts: {}
+    backend._generate_kwargs = lambda: {}
+    return backend
+
+def test_local_stream_failure_is_raised_after_the_partial_output():
+    stream = failing_transformers_backend().stream("prompt")
+    assert next(stream) == "partial "
+    with pytest.raises(ModelResponseError):
+        next(stream)
+
+def test_failed_local_stream_is_neither_cached_nor_remembered():
+    bot = chatbot.Chatbot(backend=failing_transformers_backend())
+    reply = "".join(bot.stream_response("Hello", session_id="a", use_cache=True))
+    assert reply.startswith("partial ") and "interrupted" in reply
+    assert bot.get_memory(None, "a").chat_memory.messages == []
+    _, _, cache_key, _ = bot._prepare("Hello", None, "a", None)
+    assert bot.response_cache.get(cache_key) is None
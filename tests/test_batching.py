@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import List
+import pytest
+from backends import HuggingFaceHTTPBackend
+from batching import MicroBatcher
+from exception import ModelTimeoutError
+from bench import percentile, run_clients
+from fakes import FakeBackend, StandInLLMServer
+
+class ModelServer(FakeBackend):
+    """Stands in for the local transformers backend, the only one that is batched.
+
+    Runs one call at a time, each costing a fixed overhead plus a little per prompt.
+    """
+
+    supports_batching = True
+
+    def __init__(self, call_overhead: float, per_prompt: float):
+        super().__init__()
+        self.call_overhead = call_overhead
+        self.per_prompt = per_prompt
+        self.batch_sizes: List[int] = []
+        self._busy = threading.Lock()
+
+    def generate(self, prompt: str) -> str:
+        return self.generate_batch([prompt])[0]
+
+    def generate_batch(self, prompts: List[str]) -> List[str]:
+        with self._busy:
+            self.batch_sizes.append(len(prompts))
+            time.sleep(self.call_overhead + self.per_prompt * len(prompts))
+        return [f"reply to {prompt}" for prompt in prompts]
+
+def test_requests_arriving_together_share_a_batch():
+    model = ModelServer(call_overhead=0.05, per_prompt=0.0)
+    batcher = MicroBatcher(model.generate_batch, max_batch_size=4, max_wait_ms=100)
+    run_clients(8, 1, lambda client, n: batcher.generate(f"p{client}", timeout=5))
+    assert 1 < max(model.batch_sizes) <= 4
+    assert sum(model.batch_sizes) == 8
+    assert batcher.stats()["requests"] == 8
+
+def test_failed_prompt_fails_only_its_own_request():
+    def batch_fn(prompts):
+        return [ValueError(prompt) if prompt == "bad" else prompt.upper() for prompt in prompts]
+    batcher = MicroBatcher(batch_fn, max_batch_size=2, max_wait_ms=100)
+    good, bad = batcher.submit("good"), batcher.submit("bad")
+    assert good.result(timeout=5) == "GOOD"
+    with pytest.raises(ValueError):
+        bad.result(timeout=5)
+
+def test_waiting_for_a_batch_times_out():
+    model = ModelServer(call_overhead=0.5, per_prompt=0.0)
+    batcher = MicroBatcher(model.generate_batch, max_batch_size=1, max_wait_ms=0)
+    batcher.submit("busy")
+    started = time.monotonic()
+    with pytest.raises(ModelTimeoutError):
+        batcher.generate("queued", timeout=0.1)
+    assert time.monotonic() - started < 0.4
+    time.sleep(0.6)
+    # Cancelled while still queued, so it never reached the model
+    assert model.batch_sizes == [1]
+
+def test_http_backend_batch_fallback_runs_prompts_concurrently_against_stand_in_server():
+    with StandInLLMServer(delay=0.2) as server:
+        backend = HuggingFaceHTTPBackend("stand-in", {"max_new_tokens": 16}, base_url=server.base_url)
+        start = time.monotonic()
+        replies = backend.generate_batch([f"prompt {n}" for n in range(8)])
+        elapsed = time.monotonic() - start
+    assert replies == [f"echo: prompt {n}" for n in range(8)]
+    assert server.requests == 8
+    assert elapsed < 8 * 0.2 / 2
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("batched", [False, True])
+def test_native_batching_throughput(batched, report):
+    """Requests/s and latency for 32 concurrent clients on an in-process model whose per-call overhead dominates.
+
+    Hosted backends are not batched, so this models the local transformers backend only.
+    """
+    model = ModelServer(call_overhead=0.04, per_prompt=0.002)
+    batcher = MicroBatcher(model.generate_batch, max_batch_size=8, max_wait_ms=20) if batched else None
+    generate = batcher.generate if batched else model.generate
+    elapsed, latencies = run_clients(32, 4, lambda client, n: generate(f"c{client} r{n}"))
+    report(f"{'batched' if batched else 'direct':>8}: {len(latencies) / elapsed:.1f} req/s, "
+           f"p50 {percentile(latencies, 50) * 1000:.0f} ms, p99 {percentile(latencies, 99) * 1000:.0f} ms, "
+           f"{len(model.batch_sizes)} model calls")
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("clients", [1, 16])
+def test_http_backend_throughput_against_stand_in_server(clients, report):
+    """Requests/s through the pooled keep-alive transport to a stand-in server answering in 20 ms."""
+    with StandInLLMServer(delay=0.02) as server:
+        backend = HuggingFaceHTTPBackend("stand-in", {"max_new_tokens": 16}, base_url=server.base_url)
+        backend.generate("warm up")
+        elapsed, latencies = run_clients(clients, 20, lambda client, n: backend.generate(f"c{client} r{n}"))
+    report(f"{clients:>3} clients: {len(latencies) / elapsed:.1f} req/s, "
+           f"p50 {percentile(latencies, 50) * 1000:.1f} ms, p99 {percentile(latencies, 99) * 1000:.1f} ms")
@@ -0,0 +1,46 @@
+import random
+import pytest
+from sqlalchemy import delete, insert
+import compressed_text
+from compressed_text import _Dictionaries, compress, decompress
+from db import CompressionDictionary, engine
+
+zstandard = pytest.importorskip("zstandard")
+
+def store_new_dictionary():
+    """Train a dictionary and store it the way another process would, without telling this one."""
+    rng = random.Random(7)
+    words = ["model", "answer", "token", "prompt", "cache", "latency", "request", "session"]
+    samples = [" ".join(rng.choice(words) for _ in range(60)).encode() for _ in range(400)]
+    dictionary = zstandard.train_dictionary(4096, samples)
+    with engine.begin() as conn:
+        conn.execute(insert(CompressionDictionary).values(dict_id=dictionary.dict_id(), data=dictionary.as_bytes()))
+    return dictionary.dict_id()
+
+@pytest.fixture
+def no_dictionaries():
+    with engine.begin() as conn:
+        conn.execute(delete(CompressionDictionary))
+    yield
+    with engine.begin() as conn:
+        conn.execute(delete(CompressionDictionary))
+    compressed_text._dictionaries.reset()
+
+def test_dictionary_trained_elsewhere_is_picked_up_after_the_recheck_interval(no_dictionaries, monkeypatch):
+    dictionaries = _Dictionaries(recheck_seconds=3600)
+    assert dictionaries.active() is None
+    dict_id = store_new_dictionary()
+    # Still within the interval: the cached "no dictionary" answer stands
+    assert dictionaries.active() is None
+    monkeypatch.setattr(dictionaries, "recheck_seconds", 0)
+    assert dictionaries.active().dict_id() == dict_id
+
+def test_values_compressed_with_a_new_dictionary_can_be_read(no_dictionaries, monkeypatch):
+    monkeypatch.setattr(compressed_text, "_dictionaries", _Dictionaries(recheck_seconds=0))
+    compressed_text._dictionaries.active()
+    store_new_dictionary()
+    value = "model answer token prompt cache latency request session " * 40
+    stored = compress(value)
+    assert isinstance(stored, bytes)
+    assert zstandard.get_frame_parameters(stored[1:]).dict_id != 0
+    assert decompress(stored) == value
@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+from sqlalchemy import make_url, select, text
+from sqlalchemy.exc import OperationalError
+import db
+from db import User, get_async_db, get_read_db
+
+needs_server = pytest.mark.skipif(db.IS_SQLITE, reason="server database only; set TEST_DATABASE_URL or pass --postgres")
+needs_sqlite = pytest.mark.skipif(not db.IS_SQLITE, reason="SQLite only")
+
+def test_connect_args_follow_the_driver():
+    assert db._connect_args(make_url("sqlite:///x.db")) == {"check_same_thread": False}
+    psycopg = db._connect_args(make_url("postgresql+psycopg://u@h/d"))
+    assert psycopg["options"] == f"-c statement_timeout={db.DB_STATEMENT_TIMEOUT_MS}"
+    asyncpg = db._connect_args(make_url("postgresql+asyncpg://u@h/d"))
+    assert asyncpg["command_timeout"] == db.DB_STATEMENT_TIMEOUT_MS / 1000
+    assert asyncpg["server_settings"] == {"application_name": db.DB_APPLICATION_NAME}
+
+def test_async_sessions_read_what_sync_sessions_wrote(make_user):
+    user_id = make_user("async")
+
+    async def username():
+        async with get_async_db() as session:
+            return (await session.execute(select(User.username).where(User.id == user_id))).scalar_one()
+
+    assert asyncio.run(username()).startswith("async")
+    # A second event loop gets its own engine rather than reusing the first loop's connections
+    assert asyncio.run(username()).startswith("async")
+
+@needs_server
+def test_server_connections_carry_timeout_and_name():
+    with db.engine.connect() as conn:
+        assert conn.execute(text("SHOW statement_timeout")).scalar() == f"{db.DB_STATEMENT_TIMEOUT_MS // 1000}s"
+        assert conn.execute(text("SHOW application_name")).scalar() == db.DB_APPLICATION_NAME
+    assert db.engine.pool._pre_ping
+
+@needs_sqlite
+def test_sqlite_read_pool_refuses_writes(make_user):
+    user_id = make_user()
+    if db.DB_PROFILE != "sqlite_production":
+        pytest.skip("only the sqlite_production profile has a separate read pool")
+    with get_read_db() as session:
+        with pytest.raises(OperationalError):
+            session.execute(text("UPDATE users SET email = 'x' WHERE id = :id"), {"id": user_id})
@@ -0,0 +1,29 @@
+import datetime
+import pytest
+from sqlalchemy import insert
+from db import ChatSession, engine
+from history_cache import get_user_session_preview_pages, invalidate_user_history
+
+def add_conversations(user_id, count):
+    now = datetime.datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(ChatSession), [
+            {"user_id": user_id, "created_at": now, "last_activity": now - datetime.timedelta(minutes=n),
+             "turn_count": 1, "preview": f"conversation {n}"}
+            for n in range(count)
+        ])
+    invalidate_user_history(user_id)
+
+@pytest.mark.parametrize("conversations, pages, expected_more", [
+    (10, 2, False),  # The last page is exactly full
+    (11, 2, True),
+    (10, 1, True),
+    (3, 1, False),
+])
+def test_more_is_offered_only_when_another_conversation_exists(make_user, conversations, pages, expected_more):
+    user_id = make_user()
+    add_conversations(user_id, conversations)
+    previews, has_more = get_user_session_preview_pages(user_id, pages, page_size=5)
+    assert len(previews) == min(conversations, pages * 5)
+    assert has_more == expected_more
+    assert [preview.preview for preview in previews] == [f"conversation {n}" for n in range(len(previews))]
@@ -0,0 +1,56 @@
+import socket
+import time
+import pytest
+import requests
+from http_client import CircuitBreaker, HTTPTransport, _is_retryable
+from exception import ModelConnectionError, ModelTimeoutError
+from fakes import StandInLLMServer
+
+PAYLOAD = {"model": "stand-in", "messages": [{"role": "user", "content": "hi"}], "stream": False}
+
+def make_transport(**kwargs):
+    kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=100))
+    return HTTPTransport(**kwargs)
+
+def url(server):
+    return f"{server.base_url}/chat/completions"
+
+def test_503_is_retried():
+    with StandInLLMServer(script=[503]) as server:
+        data = make_transport().post_json(url(server), PAYLOAD)
+    assert data["choices"][0]["message"]["content"] == "echo: hi"
+    assert server.requests == 2
+
+def test_other_5xx_is_not_retried():
+    with StandInLLMServer(script=[502]) as server:
+        with pytest.raises(ModelConnectionError):
+            make_transport().post_json(url(server), PAYLOAD)
+    assert server.requests == 1
+
+def test_read_timeout_is_not_retried():
+    # The model may already be generating, so the POST must not be sent twice
+    with StandInLLMServer(delay=1.0) as server:
+        with pytest.raises(ModelTimeoutError):
+            make_transport(generate_timeout=0.2).post_json(url(server), PAYLOAD)
+    assert server.requests == 1
+
+def test_failure_to_connect_is_retryable():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    with pytest.raises(requests.ConnectionError) as refused:
+        requests.post(f"http://127.0.0.1:{port}/", timeout=1)
+    assert _is_retryable(refused.value)
+    assert not _is_retryable(requests.ReadTimeout())
+
+def test_total_timeout_caps_each_attempt():
+    with StandInLLMServer(delay=2.0) as server:
+        start = time.monotonic()
+        with pytest.raises(ModelTimeoutError):
+            make_transport(generate_timeout=10, total_timeout=0.3).post_json(url(server), PAYLOAD)
+    assert time.monotonic() - start < 1.0
+
+def test_complete_replies_get_the_generation_timeout():
+    with StandInLLMServer(delay=0.5) as server:
+        data = make_transport(read_timeout=0.1, generate_timeout=5).post_json(url(server), PAYLOAD)
+    assert data["choices"][0]["message"]["content"] == "echo: hi"
@@ -0,0 +1,137 @@
+import statistics
+import threading
+import time
+import pytest
+import auth
+import kdf
+from exception import ResourceExhaustedError
+
+# Iterations that keep a worker busy well past the short timeouts used below
+SLOW_ITERATIONS = 3_000_000
+
+@pytest.fixture
+def slow_pool():
+    pool = kdf.KDFPool(workers=1, max_pending=2, max_pending_per_key=2, timeout=0.05)
+    yield pool
+    pool.shutdown()
+
+def wait_for_idle(pool, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while pool._pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return pool._pending
+
+def test_hash_round_trip_and_legacy_format():
+    stored = kdf.hash_password("Secr3t!pass")
+    assert stored.startswith(f"pbkdf2_sha256${kdf.KDF_ITERATIONS}$")
+    assert kdf.verify_password(stored, "Secr3t!pass")
+    assert not kdf.verify_password(stored, "wrong")
+    assert not kdf.needs_rehash(stored)
+
+    salt = "abc"
+    legacy = f"{salt}${kdf._pbkdf2('pw', salt, kdf.LEGACY_ITERATIONS)}"
+    assert kdf.verify_password(legacy, "pw")
+    assert kdf.needs_rehash(legacy)
+
+def test_timed_out_work_keeps_its_admission_slot(slow_pool):
+    with pytest.raises(ResourceExhaustedError):
+        slow_pool.derive("pw", "salt", SLOW_ITERATIONS)
+    # The worker is still hashing, so the slot is still taken
+    assert slow_pool._pending == 1
+    with pytest.raises(ResourceExhaustedError):
+        slow_pool.derive("pw", "salt", SLOW_ITERATIONS)
+    assert slow_pool._pending <= slow_pool.max_pending
+    # Saturated: turned away at admission without queueing more work
+    with pytest.raises(ResourceExhaustedError, match="busy"):
+        slow_pool.derive("pw", "salt", SLOW_ITERATIONS)
+    assert wait_for_idle(slow_pool) == 0
+
+def test_batch_hashing_matches_single_hashing():
+    salts = [f"salt{i}" for i in range(7)]
+    passwords = [f"pw{i}" for i in range(7)]
+    digests = kdf.get_kdf_pool().derive_many(passwords, salts, 1000)
+    assert digests == [kdf._pbkdf2(p, s, 1000) for p, s in zip(passwords, salts)]
+    assert kdf.get_kdf_pool()._pending == 0
+
+def test_busy_pool_is_not_reported_as_a_wrong_password(slow_pool, monkeypatch):
+    stored = kdf.format_hash(kdf.PasswordHash(kdf.ALGORITHM, SLOW_ITERATIONS, "salt", "00"))
+    monkeypatch.setattr(kdf, "_kdf_pool", slow_pool)
+    with pytest.raises(ResourceExhaustedError):
+        auth.verify_password(stored, "right password", key="alice")
+    wait_for_idle(slow_pool)
+
+def test_admission_is_limited_per_account_and_per_address():
+    pool = kdf.KDFPool(workers=1, max_pending=8, max_pending_per_key=1, max_pending_per_ip=1, timeout=30)
+    held = pool._admission_keys("alice", "198.51.100.1")
+    pool._admit(held)
+    try:
+        with pytest.raises(ResourceExhaustedError, match="network"):
+            pool.derive("pw", "salt", 1, key="bob", ip="198.51.100.1")
+        with pytest.raises(ResourceExhaustedError, match="account"):
+            pool.derive("pw", "salt", 1, key="alice", ip="203.0.113.1")
+        assert pool.derive("pw", "salt", 1, key="carol", ip="203.0.113.1") == kdf._pbkdf2("pw", "salt", 1)
+    finally:
+        pool._release(held)
+        pool.shutdown()
+    assert pool._pending == 0 and not pool._pending_by_key
+
+def test_broken_pool_turns_requests_away_instead_of_hashing_inline():
+    pool = kdf.KDFPool(workers=1, max_pending=4, max_pending_per_key=4, timeout=60)
+    pool.derive("warm", "up", 1)
+    errors = []
+
+    def sign_in():
+        try:
+            pool.derive("pw", "salt", SLOW_ITERATIONS * 10)
+        except ResourceExhaustedError as e:
+            errors.append(e)
+    thread = threading.Thread(target=sign_in)
+    thread.start()
+    while not pool._pending:
+        time.sleep(0.01)
+    started = time.monotonic()
+    for process in list(pool._executor._processes.values()):
+        process.kill()
+    thread.join(timeout=30)
+    try:
+        # Turned away at once rather than spending the hash on the caller's thread
+        assert time.monotonic() - started < 5
+        assert len(errors) == 1 and "temporarily unavailable" in errors[0].message
+        assert wait_for_idle(pool) == 0
+        # A fresh pool serves the next sign-in
+        assert pool.derive("pw", "salt", 1) == kdf._pbkdf2("pw", "salt", 1)
+    finally:
+        pool.shutdown()
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("clients", [1, 8, 32])
+def test_login_throughput_and_latency(clients, report):
+    """Logins/s per hashing worker and p99 latency with `clients` users signing in at once."""
+    pool = kdf.KDFPool(max_pending=clients * 2, max_pending_per_key=clients * 2, timeout=60)
+    stored = kdf.format_hash(kdf.PasswordHash(kdf.ALGORITHM, kdf.KDF_ITERATIONS, "salt",
+                                              kdf._pbkdf2("pw", "salt", kdf.KDF_ITERATIONS)))
+    pool.derive("warm", "up", 1)
+    latencies = []
+    lock = threading.Lock()
+    logins_per_client = 8
+
+    def client():
+        for _ in range(logins_per_client):
+            start = time.perf_counter()
+            parsed = kdf.parse_hash(stored)
+            assert pool.derive("pw", parsed.salt, parsed.iterations) == parsed.digest
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+
+    p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+    report(f"{clients:>3} clients: {len(latencies) / elapsed / pool.workers:.1f} logins/s per worker, "
+           f"p50 {statistics.median(latencies) * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms ({pool.workers} workers)")
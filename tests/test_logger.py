@@ -0,0 +1,30 @@
+import logging
+import queue
+from bench import run_clients
+from logger import DebugSampler, NonBlockingQueueHandler
+
+def make_record(level: int = logging.DEBUG, msg: str = "message") -> logging.LogRecord:
+    return logging.makeLogRecord({"name": "test", "levelno": level, "levelname": logging.getLevelName(level),
+                                  "msg": msg, "pathname": "app.py", "lineno": 42})
+
+def test_full_queue_counts_every_dropped_record():
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(10)
+    handler = NonBlockingQueueHandler(log_queue)
+    run_clients(8, 100, lambda client, n: handler.emit(make_record(logging.INFO)))
+    assert log_queue.qsize() == 10
+    assert handler.dropped == 790
+
+    while not log_queue.empty():
+        log_queue.get_nowait()
+    handler.emit(make_record(logging.INFO, "after"))
+    report, record = log_queue.get_nowait(), log_queue.get_nowait()
+    assert report.getMessage() == "Dropped 790 log records while the log writer was behind"
+    assert record.getMessage() == "after"
+    assert handler.dropped == 0
+
+def test_debug_records_are_sampled_per_call_site():
+    sampler = DebugSampler(every=10)
+    kept = []
+    run_clients(8, 50, lambda client, n: kept.append(sampler.filter(make_record())))
+    assert kept.count(True) == 40
+    assert sampler.filter(make_record(logging.INFO))
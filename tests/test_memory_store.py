@@ -0,0 +1,30 @@
+import time
+from memory_store import ConversationMemoryStore
+
+def test_least_recently_used_session_is_evicted_when_full():
+    store = ConversationMemoryStore(max_entries=2, ttl_seconds=60)
+    first = store.get(1, "a")
+    store.get(2, "b")
+    assert store.get(1, "a") is first  # Now the most recently used
+    store.get(3, "c")
+    assert len(store) == 2
+    assert store.get(1, "a") is first
+    loaded = []
+    store.get(2, "b", loader=loaded.append)
+    assert len(loaded) == 1  # Evicted, so loaded again
+
+def test_idle_sessions_expire():
+    store = ConversationMemoryStore(max_entries=10, ttl_seconds=0.1)
+    first = store.get(1, "a")
+    time.sleep(0.15)
+    assert store.get(1, "a") is not first
+
+def test_memory_keeps_only_the_most_recent_turns():
+    store = ConversationMemoryStore(max_entries=10, ttl_seconds=60, max_turns=3)
+    memory = store.get(1, "a")
+    for turn in range(10):
+        memory.save_context({"input": f"question {turn}"}, {"output": f"answer {turn}"})
+    messages = memory.chat_memory.messages
+    assert len(messages) == 6
+    assert messages[0].content == "question 7"
+    assert messages[-1].content == "answer 9"
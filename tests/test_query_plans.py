@@ -0,0 +1,69 @@
+import datetime
+import random
+import pytest
+from sqlalchemy import create_engine
+import db
+from migrations import check_query_plans, explain_query_plan, hot_queries
+
+# Enough rows that the planner would rather scan and sort than use a poor index
+SEED_USERS = 2_000
+SEED_SESSIONS_PER_USER = 5
+SEED_TURNS = 200_000
+
+@pytest.fixture(scope="module")
+def seeded_engine(tmp_path_factory):
+    """A separate SQLite database with the app's schema, seeded and analyzed."""
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}")
+    db.Base.metadata.create_all(engine)
+    rng = random.Random(12)
+    start = datetime.datetime(2024, 1, 1)
+    sessions = SEED_USERS * SEED_SESSIONS_PER_USER
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO users (id, username, email, hashed_password, is_active, login_count) VALUES (?, ?, ?, 'x', 1, 0)",
+            [(user_id, f"user{user_id}", f"user{user_id}@example.com") for user_id in range(1, SEED_USERS + 1)]
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO chat_sessions (id, user_id, created_at, last_activity, turn_count) VALUES (?, ?, ?, ?, 1)",
+            [(session_id, (session_id - 1) % SEED_USERS + 1, str(start),
+              str(start + datetime.timedelta(minutes=rng.randrange(500_000)))) for session_id in range(1, sessions + 1)]
+        )
+        turns = []
+        for chat_id in range(1, SEED_TURNS + 1):
+            session_id = rng.randrange(1, sessions + 1)
+            turns.append((chat_id, (session_id - 1) % SEED_USERS + 1, session_id, "question", "answer",
+                          str(start + datetime.timedelta(minutes=chat_id * 2))))
+        conn.exec_driver_sql(
+            "INSERT INTO chat_history (id, user_id, session_id, user_message, bot_response, timestamp) "
+            "VALUES (?, ?, ?, ?, ?, ?)", turns
+        )
+        conn.exec_driver_sql("ANALYZE")
+    yield engine
+    engine.dispose()
+
+@pytest.mark.parametrize("name", sorted(hot_queries()))
+def test_hot_query_uses_an_index(seeded_engine, name):
+    with seeded_engine.connect() as conn:
+        plan = explain_query_plan(conn, hot_queries()[name])
+    assert not [step for step in plan if step.startswith("SCAN") or "TEMP B-TREE" in step], plan
+
+def test_check_query_plans_reports_nothing_for_the_schema(seeded_engine):
+    assert check_query_plans(seeded_engine) == {}
+
+def test_check_query_plans_notices_a_missing_index(seeded_engine, tmp_path):
+    copy_path = tmp_path / "without_index.db"
+    with seeded_engine.connect() as conn:
+        conn.exec_driver_sql(f"VACUUM INTO '{copy_path}'")
+    engine = create_engine(f"sqlite:///{copy_path}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_chat_history_user_timestamp")
+    try:
+        assert "recent_turns" in check_query_plans(engine)
+    finally:
+        engine.dispose()
+
+@pytest.mark.skipif(db.IS_SQLITE, reason="only meaningful against a server database")
+def test_hot_queries_run_on_the_configured_database():
+    with db.read_engine.connect() as conn:
+        for statement in hot_queries().values():
+            conn.execute(statement).all()
@@ -0,0 +1,115 @@
+import itertools
+import os
+import time
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+import rate_limit
+from db import engine
+from exception import RateLimitExceededError
+from rate_limit import RateLimiter
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+_routes = itertools.count()
+
+@pytest.fixture
+def make_limiter(database):
+    """Limiters for a route of their own, flushed only when a test asks."""
+    route = f"login{next(_routes)}"
+    limiters = []
+
+    def make():
+        limiter = RateLimiter(rules={route: {"ip": (100, 60), "ip_user": (3, 300), "user": (3, 300)}},
+                              soft_scopes={route: ("user",)}, max_delay_seconds=5, flush_interval_seconds=3600)
+        limiters.append(limiter)
+        return limiter
+    make.route = route
+    yield make
+    for limiter in limiters:
+        limiter.close()
+
+def attempt(limiter, route, ip, username):
+    return limiter.check(route, ip=ip, user=username, ip_user=f"{ip}|{username}")
+
+def test_guesses_from_many_addresses_slow_the_username_down_without_locking_it(make_limiter):
+    limiter = make_limiter()
+    delays = [attempt(limiter, make_limiter.route, f"198.51.100.{n}", "victim") for n in range(12)]
+    assert delays[:3] == [0, 0, 0]
+    assert 0 < delays[3] < delays[5] and delays[-1] == 5
+    # The owner still gets in, only slower
+    assert attempt(limiter, make_limiter.route, "203.0.113.1", "victim") == 5
+
+def test_one_address_guessing_one_username_is_rejected(make_limiter):
+    limiter = make_limiter()
+    for _ in range(3):
+        attempt(limiter, make_limiter.route, "198.51.100.1", "victim")
+    with pytest.raises(RateLimitExceededError):
+        attempt(limiter, make_limiter.route, "198.51.100.1", "victim")
+    assert attempt(limiter, make_limiter.route, "198.51.100.1", "someone") == 0
+
+def test_checks_only_read_and_counts_are_written_together(make_limiter):
+    writes = []
+
+    def count_writes(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("INSERT"):
+            writes.append(statement)
+    event.listen(engine, "before_cursor_execute", count_writes)
+    try:
+        limiter = make_limiter()
+        for _ in range(3):
+            attempt(limiter, make_limiter.route, "198.51.100.1", "victim")
+        assert writes == []
+        assert limiter.flush() == 3
+        assert len(writes) == 1
+    finally:
+        event.remove(engine, "before_cursor_execute", count_writes)
+
+    # Another process sees the flushed counts
+    with pytest.raises(RateLimitExceededError):
+        attempt(make_limiter(), make_limiter.route, "198.51.100.1", "victim")
+
+def test_failed_flush_keeps_the_counts(make_limiter, monkeypatch):
+    limiter = make_limiter()
+    for _ in range(3):
+        attempt(limiter, make_limiter.route, "198.51.100.1", "victim")
+
+    class LockedEngine:
+        def begin(self):
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+    with monkeypatch.context() as patch:
+        patch.setattr(rate_limit, "engine", LockedEngine())
+        assert limiter.flush() == 0
+    with pytest.raises(RateLimitExceededError):
+        attempt(limiter, make_limiter.route, "198.51.100.1", "victim")
+    assert limiter.flush() == 3
+
+def test_login_form_paces_a_guessed_username_without_sleeping(monkeypatch):
+    from streamlit.testing.v1 import AppTest
+    limiter = RateLimiter(rules={"login": {"user": (1, 300)}}, soft_scopes={"login": ("user",)},
+                          max_delay_seconds=1, flush_interval_seconds=3600)
+    monkeypatch.setattr(rate_limit, "_rate_limiter", limiter)
+    at = AppTest.from_file(APP_PATH, default_timeout=30)
+    # The test harness has no real cookies to read
+    at.session_state["session_cookie_read"] = True
+    at.run()
+    username = f"paced{next(_routes)}"
+
+    def log_in():
+        at.text_input(key="login_username").input(username)
+        at.text_input(key="login_password").input("wrong password")
+        started = time.monotonic()
+        at.button(key="login_button").click().run()
+        assert time.monotonic() - started < 1
+        return [w.value for w in at.warning], [e.value for e in at.error]
+
+    try:
+        assert log_in() == ([], ["Invalid username or password."])
+        # Over the soft limit: refused for now, not slept on
+        paced = ["Too many recent attempts for this account. Please try again in 1 seconds."]
+        assert log_in() == (paced, [])
+        assert log_in() == (paced, [])
+        time.sleep(1.1)
+        assert log_in() == ([], ["Invalid username or password."])
+    finally:
+        limiter.close()
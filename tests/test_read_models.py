@@ -0,0 +1,69 @@
+import datetime
+import time
+import tracemalloc
+import pytest
+from sqlalchemy import insert
+from db import ChatHistory, User, engine, get_read_db
+from read_models import ChatRecord, fetch_recent_chats, fetch_user_by_username, recent_chats_query
+
+ROWS = 2000
+
+def add_turns(user_id, count):
+    start = datetime.datetime.utcnow() - datetime.timedelta(seconds=count)
+    with engine.begin() as conn:
+        conn.execute(insert(ChatHistory), [
+            {"user_id": user_id, "user_message": f"question {n} " * 10, "bot_response": f"answer {n} " * 40,
+             "response_time": 100, "timestamp": start + datetime.timedelta(seconds=n)}
+            for n in range(count)
+        ])
+
+def orm_recent_chats(session, user_id, limit):
+    return (session.query(ChatHistory).filter(ChatHistory.user_id == user_id)
+            .order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).limit(limit).all())
+
+def record_recent_chats(session, user_id, limit):
+    return [ChatRecord._make(row) for row in session.execute(recent_chats_query(user_id, limit))]
+
+def test_records_match_the_orm_and_outlive_their_session(make_user):
+    user_id = make_user("reader")
+    add_turns(user_id, 5)
+    with get_read_db() as session:
+        expected = [(chat.id, chat.user_message, chat.bot_response, chat.timestamp)
+                    for chat in reversed(orm_recent_chats(session, user_id, 3))]
+        username = session.get(User, user_id).username
+    with get_read_db() as session:
+        chats = fetch_recent_chats(session, user_id, 3)
+        user = fetch_user_by_username(session, username)
+    # Read after the session closed: plain values, nothing left to load
+    assert [(chat.id, chat.user_message, chat.bot_response, chat.timestamp) for chat in chats] == expected
+    assert user.id == user_id and user.username == username
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("path", ["orm", "read_model"])
+def test_hydration_cost_and_memory_per_row(make_user, path, report):
+    """Time and memory to turn 2000 chat_history rows into ORM instances or ChatRecords."""
+    user_id = make_user("bench")
+    add_turns(user_id, ROWS)
+    hydrate = orm_recent_chats if path == "orm" else record_recent_chats
+    with get_read_db() as session:
+        hydrate(session, user_id, ROWS)
+    timings = []
+    for _ in range(10):
+        with get_read_db() as session:
+            started = time.perf_counter()
+            hydrate(session, user_id, ROWS)
+            timings.append(time.perf_counter() - started)
+
+    with get_read_db() as session:
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            # The session stays open, as it does while a caller uses the result, so the
+            # ORM identity map and instance state are counted along with the objects
+            rows = hydrate(session, user_id, ROWS)
+            retained, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert len(rows) == ROWS
+    report(f"{path:>10}: {min(timings) / ROWS * 1e6:.1f} us/row, "
+           f"{(retained - before) / ROWS:.0f} bytes/row retained, {(peak - before) / ROWS:.0f} bytes/row peak")
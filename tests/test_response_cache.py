@@ -0,0 +1,57 @@
+import threading
+import time
+from sqlalchemy import event, select
+from db import ResponseCacheEntry, engine, read_engine
+from response_cache import ResponseCache
+from write_behind import get_write_behind
+
+def make_key(prompt):
+    return ResponseCache.make_key("model", {"temperature": 0.2}, prompt, history="")
+
+def stored_response(key):
+    with read_engine.connect() as conn:
+        return conn.execute(select(ResponseCacheEntry.response).where(ResponseCacheEntry.cache_key == key)).scalar()
+
+def test_hit_miss_and_expiry():
+    cache = ResponseCache(ttl_seconds=0.5)
+    key = make_key("What is a B-tree?")
+    assert cache.get(key) is None
+    cache.set(key, "model", "A balanced search tree.")
+    assert cache.get(key) == "A balanced search tree."
+    # Trivially different phrasings share the entry
+    assert cache.get(make_key("  what is a   B-tree? ")) == "A balanced search tree."
+
+    get_write_behind().flush(timeout=10)
+    # Another process, with nothing in memory, reads it from the table
+    other = ResponseCache(ttl_seconds=0.5)
+    assert other.get(key) == "A balanced search tree."
+    assert other.stats()["disk_hits"] == 1
+
+    time.sleep(0.6)
+    assert cache.get(key) is None
+    assert ResponseCache(ttl_seconds=0.5).get(key) is None
+    assert cache.stats()["misses"] == 2
+
+def test_storing_does_not_write_on_the_callers_thread():
+    cache = ResponseCache()
+    key = make_key("Tell me a joke")
+    caller = threading.get_ident()
+    writes_from_caller = []
+
+    def watch(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == caller and not statement.lstrip().upper().startswith("SELECT"):
+            writes_from_caller.append(statement)
+    event.listen(engine, "before_cursor_execute", watch)
+    try:
+        cache.set(key, "model", "first")
+        cache.set(key, "model", "second")
+    finally:
+        event.remove(engine, "before_cursor_execute", watch)
+    assert writes_from_caller == []
+
+    get_write_behind().flush(timeout=10)
+    assert stored_response(key) == "second"
+    # Replaced in place when the same key is stored again later
+    cache.set(key, "model", "third")
+    get_write_behind().flush(timeout=10)
+    assert stored_response(key) == "third"
@@ -0,0 +1,71 @@
+import logging
+import threading
+from typing import List
+import pytest
+from exception import ResourceExhaustedError
+from scheduler import GenerationScheduler
+
+def hold_slot(scheduler: GenerationScheduler, model: str) -> threading.Event:
+    """Occupy a model's only slot until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit("holder", model, block)
+    assert started.wait(5)
+    return release
+
+def test_waiting_users_are_served_round_robin():
+    scheduler = GenerationScheduler(max_concurrency_per_model=1, max_queued_per_user=3)
+    release = hold_slot(scheduler, "m")
+    order: List[str] = []
+    futures = [scheduler.submit("a", "m", order.append, f"a{n}") for n in range(3)]
+    futures += [scheduler.submit("b", "m", order.append, f"b{n}") for n in range(2)]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == ["a0", "b0", "a1", "b1", "a2"]
+
+def test_user_with_too_many_waiting_requests_is_turned_away():
+    scheduler = GenerationScheduler(max_concurrency_per_model=1, max_queued_per_user=2)
+    release = hold_slot(scheduler, "m")
+    futures = [scheduler.submit("a", "m", lambda: "a") for _ in range(2)]
+    with pytest.raises(ResourceExhaustedError):
+        scheduler.submit("a", "m", lambda: "a")
+    futures.append(scheduler.submit("b", "m", lambda: "b"))  # Other users still get in
+    release.set()
+    assert [future.result(timeout=5) for future in futures] == ["a", "a", "b"]
+
+def test_cancelled_queued_request_never_runs():
+    scheduler = GenerationScheduler(max_concurrency_per_model=1)
+    release = hold_slot(scheduler, "m")
+    ran: List[str] = []
+    cancelled = scheduler.submit("a", "m", ran.append, "cancelled")
+    kept = scheduler.submit("a", "m", ran.append, "kept")
+    assert cancelled.cancel()
+    release.set()
+    kept.result(timeout=5)
+    assert ran == ["kept"]
+    assert scheduler.stats()["models"]["m"] == {"queued": 0, "running": 0, "users_waiting": 0}
+
+def test_busy_models_do_not_hold_threads_other_models_need():
+    scheduler = GenerationScheduler(max_concurrency_per_model=1)
+    releases = [hold_slot(scheduler, model) for model in ("a", "b", "c")]
+    try:
+        assert scheduler.submit("user", "d", lambda: "done").result(timeout=5) == "done"
+    finally:
+        for release in releases:
+            release.set()
+
+def test_stats_are_logged_while_requests_flow(caplog):
+    scheduler = GenerationScheduler(stats_interval_seconds=0.05)
+    done = threading.Event()
+    with caplog.at_level(logging.INFO, logger="scheduler"):
+        scheduler.submit("a", "m", lambda: None).result(timeout=5)
+        scheduler._loop.call_later(0.2, done.set)
+        assert done.wait(5)
+    lines = [record.getMessage() for record in caplog.records if "Scheduler stats" in record.getMessage()]
+    assert len(lines) == 1  # Nothing new after the first report
+    assert "m: 0 queued, 0 running; 1 started" in lines[0]
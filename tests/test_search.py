@@ -0,0 +1,109 @@
+import datetime
+import pytest
+from sqlalchemy import delete, insert
+import db
+import compressed_text
+from db import ChatHistory, engine
+from search import index_chats, search_chats, unindex_chats
+
+def save_turn(user_id, user_message, bot_response):
+    with engine.begin() as conn:
+        chat_id = conn.execute(insert(ChatHistory).values(
+            user_id=user_id, user_message=user_message, bot_response=bot_response,
+            timestamp=datetime.datetime.utcnow()
+        ).returning(ChatHistory.id)).scalar_one()
+        index_chats(conn, [{"id": chat_id, "user_id": user_id, "user_message": user_message,
+                            "bot_response": bot_response}])
+    return chat_id
+
+def test_finds_only_the_users_own_turns_with_a_snippet(make_user):
+    alice, bob = make_user(), make_user()
+    chat_id = save_turn(alice, "How do penguins keep warm?", "Dense feathers and huddling.")
+    save_turn(bob, "Tell me about penguins", "They live in the south.")
+    results = search_chats(alice, "penguins")
+    assert [result.chat_id for result in results] == [chat_id]
+    assert "**penguins**" in results[0].snippet
+
+def test_snippets_come_from_compressed_turns(make_user):
+    user_id = make_user()
+    long_answer = "Glaciers move slowly. " * 100 + "The terminus calves icebergs into the fjord."
+    save_turn(user_id, "What happens at a glacier's end?", long_answer)
+    results = search_chats(user_id, "icebergs")
+    assert len(results) == 1
+    assert "**icebergs**" in results[0].snippet
+
+def test_unindexed_turns_are_no_longer_found(make_user):
+    user_id = make_user()
+    chat_id = save_turn(user_id, "Explain quasars", "Very bright galactic nuclei.")
+    with engine.begin() as conn:
+        unindex_chats(conn, [chat_id])
+        conn.execute(delete(ChatHistory).where(ChatHistory.id == chat_id))
+    assert search_chats(user_id, "quasars") == []
+
+def test_unindexing_a_turn_that_was_never_indexed_leaves_the_index_intact(make_user):
+    user_id = make_user()
+    chat_id = save_turn(user_id, "Explain pulsars", "Rotating neutron stars.")
+    with engine.begin() as conn:
+        stray_id = conn.execute(insert(ChatHistory).values(
+            user_id=user_id, user_message="Explain pulsars again", bot_response="Still neutron stars.",
+            timestamp=datetime.datetime.utcnow()
+        ).returning(ChatHistory.id)).scalar_one()
+    with engine.begin() as conn:
+        unindex_chats(conn, [stray_id])
+        conn.execute(delete(ChatHistory).where(ChatHistory.id == stray_id))
+    assert [result.chat_id for result in search_chats(user_id, "pulsars")] == [chat_id]
+
+def test_index_holds_no_copy_of_the_text():
+    with engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            tables = {row[0] for row in conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'chat_search%'")}
+            assert "chat_search_content" not in tables
+        else:
+            columns = {row[0] for row in conn.exec_driver_sql(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = 'chat_search'")}
+            assert columns == {"chat_id", "user_id", "document"}
+
+@pytest.mark.skipif(not db.IS_SQLITE, reason="counts calls of the SQLite chat_text() function")
+def test_only_returned_results_read_their_turn(make_user, monkeypatch):
+    user_id = make_user()
+    for n in range(60):
+        save_turn(user_id, f"Question {n} about volcanoes", f"Answer {n}: magma and ash.")
+    calls = []
+    monkeypatch.setattr(db, "stored_text", lambda value: calls.append(value) or compressed_text.stored_text(value))
+    db.read_engine.dispose()
+    try:
+        results = search_chats(user_id, "volcanoes", limit=5)
+    finally:
+        monkeypatch.undo()
+        db.read_engine.dispose()
+    assert len(results) == 5
+    # Two bodies per returned turn, not per matching turn
+    assert 0 < len(calls) <= 5 * 2
+
+OLD_LAYOUT = {
+    "sqlite": [
+        "DROP TABLE chat_search",
+        "CREATE VIRTUAL TABLE chat_search USING fts5(owner, user_message, bot_response, tokenize = 'porter unicode61')",
+        "INSERT INTO chat_search (rowid, owner, user_message, bot_response) "
+        "SELECT id, 'u' || user_id, user_message, bot_response FROM chat_history",
+    ],
+    "postgresql": [
+        "DROP TABLE chat_search",
+        "CREATE TABLE chat_search (chat_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, user_message TEXT, "
+        "bot_response TEXT, document tsvector GENERATED ALWAYS AS (to_tsvector('english', coalesce(user_message, ''))) STORED)",
+        "INSERT INTO chat_search (chat_id, user_id, user_message, bot_response) "
+        "SELECT id, user_id, user_message, bot_response FROM chat_history",
+    ],
+}
+
+def test_migration_rebuilds_an_index_that_copied_the_text(make_user):
+    from search import drop_search_text
+    user_id = make_user()
+    chat_id = save_turn(user_id, "Why do cats purr?", "Contentment, mostly.")
+    with engine.begin() as conn:
+        for statement in OLD_LAYOUT[conn.dialect.name]:
+            conn.exec_driver_sql(statement)
+        drop_search_text(conn)
+    test_index_holds_no_copy_of_the_text()
+    assert [result.chat_id for result in search_chats(user_id, "purr")] == [chat_id]
@@ -0,0 +1,56 @@
+from semantic_cache import SemanticCache
+from chatbot import Chatbot
+from fakes import FakeBackend
+
+def make_chatbot(backend):
+    chatbot = Chatbot(backend=backend)
+    chatbot.semantic_cache = SemanticCache(enabled=True, threshold=0.8, path=None)
+    return chatbot
+
+def test_paraphrase_of_standalone_question_is_served_from_cache():
+    backend = FakeBackend()
+    chatbot = make_chatbot(backend)
+    first = chatbot.get_response("How do I reset my password?", session_id="a")
+    second = chatbot.get_response("how do I reset my password", session_id="b")
+    assert second == first
+    assert backend.calls == 1
+
+def test_follow_up_question_is_not_answered_from_another_conversation():
+    backend = FakeBackend()
+    chatbot = make_chatbot(backend)
+    # User A asks the follow-up as an opening question, so its answer is cached
+    chatbot.get_response("Can you explain that in more detail?", session_id="a")
+    # User B asks it after a turn of their own; the cached answer lacks that context
+    chatbot.get_response("What is a B-tree?", session_id="b")
+    follow_up = chatbot.get_response("Can you explain that in more detail?", session_id="b")
+    assert backend.calls == 3
+    assert "What is a B-tree?" in backend.prompts[-1]
+    assert follow_up == "answer #3 to: Human: Can you explain that in more detail?"
+
+def test_answers_are_not_shared_across_models_or_parameters():
+    cache = SemanticCache(enabled=True, path=None)
+    cold = SemanticCache.make_namespace("model-a", {"temperature": 0.2})
+    hot = SemanticCache.make_namespace("model-a", {"temperature": 0.9})
+    other_model = SemanticCache.make_namespace("model-b", {"temperature": 0.2})
+    cache.add("What is the capital of France?", "Paris", cold)
+    assert cache.lookup("What is the capital of France?", cold) == "Paris"
+    assert cache.lookup("What is the capital of France?", hot) is None
+    assert cache.lookup("What is the capital of France?", other_model) is None
+
+def test_chatbot_does_not_reuse_answers_after_a_parameter_change():
+    backend = FakeBackend()
+    chatbot = make_chatbot(backend)
+    chatbot.get_response("Tell me a joke", session_id="a")
+    chatbot.generation_params = {**chatbot.generation_params, "temperature": 1.5}
+    chatbot.get_response("tell me a joke", session_id="b")
+    assert backend.calls == 2
+
+def test_namespaces_survive_save_and_load(tmp_path):
+    path = str(tmp_path / "semantic.npz")
+    namespace = SemanticCache.make_namespace("model-a", {})
+    cache = SemanticCache(enabled=True, path=path)
+    cache.add("What time is it in Tokyo?", "Late", namespace)
+    cache.save()
+    reloaded = SemanticCache(enabled=True, path=path)
+    assert reloaded.lookup("What time is it in Tokyo?", namespace) == "Late"
+    assert reloaded.lookup("What time is it in Tokyo?", "") is None
@@ -0,0 +1,76 @@
+import os
+import threading
+import pytest
+from sqlalchemy.exc import OperationalError
+import session_tokens
+from exception import DatabaseError
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+def test_concurrent_first_use_agrees_on_one_whole_secret(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_tokens, "SESSION_SECRET", None)
+    monkeypatch.setattr(session_tokens, "SESSION_SECRET_PATH", str(tmp_path / "secret"))
+    keys = []
+    start = threading.Barrier(16)
+
+    def load():
+        start.wait()
+        keys.append(session_tokens._load_secret())
+
+    threads = [threading.Thread(target=load) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(keys)) == 1
+    assert len(keys[0]) == session_tokens.SECRET_BYTES
+    assert os.listdir(tmp_path) == ["secret"]
+
+def test_truncated_secret_is_refused(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_tokens, "SESSION_SECRET", None)
+    monkeypatch.setattr(session_tokens, "SESSION_SECRET_PATH", str(tmp_path / "secret"))
+    (tmp_path / "secret").write_bytes(b"")
+    with pytest.raises(RuntimeError):
+        session_tokens._load_secret()
+
+def fail_reads(monkeypatch):
+    def unavailable():
+        raise OperationalError("SELECT", {}, Exception("database is locked"))
+    monkeypatch.setattr(session_tokens, "get_read_db", unavailable)
+
+def test_unreachable_database_is_not_an_invalid_session(make_user, monkeypatch):
+    user_id = make_user()
+    token = session_tokens.create_session(user_id, "someone")
+    session_id = token.rpartition(".")[0]
+    session_tokens._cache.discard(session_id)
+    fail_reads(monkeypatch)
+
+    with pytest.raises(DatabaseError):
+        session_tokens.validate_session(token)
+    # Forged tokens are still rejected without asking the database
+    assert session_tokens.validate_session(session_id + ".forged") is None
+
+def test_app_keeps_token_out_of_the_url_and_survives_a_database_outage(make_user, monkeypatch):
+    from streamlit.testing.v1 import AppTest
+    user_id = make_user()
+    token = session_tokens.create_session(user_id, "someone")
+
+    at = AppTest.from_file(APP_PATH, default_timeout=30)
+    at.session_state["session_token"] = token
+    at.run()
+    assert at.session_state["authenticated"]
+    assert at.session_state["username"] == "someone"
+    assert not dict(at.query_params)
+    assert at.session_state["session_cookie_pending"] is None
+
+    session_tokens._cache.discard(token.rpartition(".")[0])
+    with monkeypatch.context() as patch:
+        fail_reads(patch)
+        at.run()
+    assert at.session_state["authenticated"]
+    assert at.session_state["session_token"] == token
+
+    session_tokens.revoke_session(token)
+    at.run()
+    assert not at.session_state["authenticated"]
+    assert at.session_state["session_token"] is None
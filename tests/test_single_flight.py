@@ -0,0 +1,110 @@
+import threading
+import time
+import pytest
+from chatbot import Chatbot, SingleFlight
+from exception import ModelResponseError
+from fakes import FakeBackend
+
+class Upstream:
+    """A token stream that yields one chunk every `interval` seconds, optionally failing part-way."""
+
+    def __init__(self, chunks=6, interval=0.02, fail_after=None):
+        self.chunks = chunks
+        self.interval = interval
+        self.fail_after = fail_after
+        self.calls = 0
+        self.sent = 0
+        self.closed = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        try:
+            for n in range(self.chunks):
+                if n == self.fail_after:
+                    raise ModelResponseError("upstream failed")
+                time.sleep(self.interval)
+                self.sent += 1
+                yield f"t{n} "
+        finally:
+            self.closed.set()
+
+def read_in_thread(stream):
+    """Consume a stream in another thread once it has joined its flight.
+
+    Returns the thread and a dict with the chunks read and the error raised.
+    """
+    result = {"chunks": [], "error": None}
+    # A generator only joins the flight when first advanced
+    first = next(stream)
+
+    def read():
+        result["chunks"].append(first)
+        try:
+            for chunk in stream:
+                result["chunks"].append(chunk)
+        except Exception as e:
+            result["error"] = e
+    thread = threading.Thread(target=read)
+    thread.start()
+    return thread, result
+
+def test_follower_gets_the_whole_reply_when_the_leader_leaves_early():
+    flights, upstream = SingleFlight(), Upstream()
+    leader = flights.stream("key", upstream)
+    assert next(leader) == "t0 "
+    follower, result = read_in_thread(flights.stream("key", Upstream()))
+    assert next(leader) == "t1 "
+    leader.close()
+    follower.join(timeout=5)
+    assert result == {"chunks": [f"t{n} " for n in range(6)], "error": None}
+    assert upstream.calls == 1
+
+def test_upstream_error_reaches_every_caller():
+    flights, upstream = SingleFlight(), Upstream(fail_after=3)
+    leader, leader_result = read_in_thread(flights.stream("key", upstream))
+    follower, follower_result = read_in_thread(flights.stream("key", upstream))
+    leader.join(timeout=5)
+    follower.join(timeout=5)
+    for result in (leader_result, follower_result):
+        assert result["chunks"] == ["t0 ", "t1 ", "t2 "]
+        assert isinstance(result["error"], ModelResponseError)
+    assert upstream.calls == 1
+
+def test_erroring_follower_does_not_affect_the_leader():
+    flights, upstream = SingleFlight(), Upstream()
+    leader, result = read_in_thread(flights.stream("key", upstream))
+    follower = flights.stream("key", upstream)
+    next(follower)
+    with pytest.raises(RuntimeError):
+        follower.throw(RuntimeError("the follower's page failed"))
+    leader.join(timeout=5)
+    assert result == {"chunks": [f"t{n} " for n in range(6)], "error": None}
+
+def test_upstream_is_cancelled_once_the_last_caller_leaves():
+    flights, upstream = SingleFlight(), Upstream(chunks=100)
+    first, second = flights.stream("key", upstream), flights.stream("key", upstream)
+    next(first)
+    next(second)
+    first.close()
+    time.sleep(0.05)
+    assert not upstream.closed.is_set()
+    second.close()
+    assert upstream.closed.wait(timeout=1)
+    assert upstream.sent < 100
+    # A later caller starts a fresh call rather than joining the cancelled one
+    assert list(flights.stream("key", Upstream(chunks=2))) == ["t0 ", "t1 "]
+
+class StreamingBackend(FakeBackend):
+    def stream(self, prompt):
+        yield from Upstream(interval=0.02)()
+
+def test_chatbot_follower_reply_is_complete_and_remembered_when_the_leader_leaves():
+    chatbot = Chatbot(backend=StreamingBackend())
+    leader = chatbot.stream_response("Tell me a story", session_id="a")
+    assert next(leader) == "t0 "
+    follower, result = read_in_thread(chatbot.stream_response("Tell me a story", session_id="b"))
+    leader.close()
+    follower.join(timeout=5)
+    assert "".join(result["chunks"]) == "".join(f"t{n} " for n in range(6))
+    assert chatbot.get_memory(None, "b").chat_memory.messages[-1].content == "t0 t1 t2 t3 t4 t5 "
+    assert chatbot.get_memory(None, "a").chat_memory.messages == []
@@ -0,0 +1,89 @@
+import datetime
+import random
+import threading
+import time
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+import db
+from db import ChatHistory, _create_sqlite_engines
+from read_models import recent_chats_query
+from bench import percentile
+
+USERS = 200
+
+def make_database(path, profile):
+    engine, read_engine = _create_sqlite_engines(db.make_url(f"sqlite:///{path}"), profile)
+    db.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO users (id, username, email, hashed_password, is_active, login_count) "
+                             "VALUES (?, ?, ?, 'x', 1, 0)",
+                             [(user_id, f"u{user_id}", f"u{user_id}@example.com") for user_id in range(1, USERS + 1)])
+    return engine, read_engine
+
+def save_turn(engine, user_id):
+    with engine.begin() as conn:
+        conn.execute(insert(ChatHistory).values(user_id=user_id, user_message="question " * 20,
+                                                bot_response="answer " * 80, timestamp=datetime.datetime.utcnow()))
+
+@pytest.mark.parametrize("profile", ["default", "sqlite_production"])
+def test_profile_journal_mode_and_read_only_pool(tmp_path, profile):
+    engine, read_engine = make_database(tmp_path / "profile.db", profile)
+    with read_engine.connect() as conn:
+        mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+    assert mode == ("wal" if profile == "sqlite_production" else "delete")
+    if profile == "sqlite_production":
+        with pytest.raises(OperationalError):
+            save_turn(read_engine, 1)
+    engine.dispose()
+    read_engine.dispose()
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("profile", ["default", "sqlite_production"])
+def test_write_throughput_and_read_latency_under_concurrency(tmp_path, profile, report):
+    """4 writers saving turns and 8 readers loading recent history for 5 s, on the old and new profile."""
+    engine, read_engine = make_database(tmp_path / "bench.db", profile)
+    for _ in range(2000):
+        save_turn(engine, random.randint(1, USERS))
+    stop = threading.Event()
+    lock = threading.Lock()
+    writes, read_latencies, errors = [0], [], [0]
+
+    def writer():
+        rng = random.Random()
+        while not stop.is_set():
+            try:
+                save_turn(engine, rng.randint(1, USERS))
+                with lock:
+                    writes[0] += 1
+            except OperationalError:
+                with lock:
+                    errors[0] += 1
+
+    def reader():
+        rng = random.Random()
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with read_engine.connect() as conn:
+                    conn.execute(recent_chats_query(rng.randint(1, USERS), 50)).all()
+            except OperationalError:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                read_latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=writer) for _ in range(4)] + [threading.Thread(target=reader) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(5)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    read_engine.dispose()
+
+    report(f"{profile:>17}: {writes[0] / 5:.0f} writes/s, {len(read_latencies) / 5:.0f} reads/s, "
+           f"read p50 {percentile(read_latencies, 50) * 1000:.1f} ms, p99 {percentile(read_latencies, 99) * 1000:.1f} ms, "
+           f"{errors[0]} lock errors")
@@ -0,0 +1,68 @@
+import threading
+import time
+from sqlalchemy import func, select
+from db import ErrorLog, engine, read_engine
+from write_behind import WriteBehindQueue
+
+def count_errors(error_type: str) -> int:
+    with read_engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(ErrorLog).where(ErrorLog.error_type == error_type)).scalar()
+
+def row(error_type: str):
+    return {"user_id": None, "error_type": error_type, "error_message": "m"}
+
+def test_rows_are_written_in_batches():
+    writer = WriteBehindQueue(engine, batch_size=50, flush_interval_ms=50)
+    for _ in range(120):
+        writer.put(ErrorLog.__table__, row("batched"))
+    writer.flush(timeout=10)
+    assert count_errors("batched") == 120
+    assert writer.stats()["batches"] < 10
+    writer.close()
+
+def test_writer_survives_a_failing_hook():
+    writer = WriteBehindQueue(engine, flush_interval_ms=10, put_timeout=0.5, max_attempts=1)
+
+    def broken_hook(conn, rows):
+        raise KeyError("missing")
+
+    writer.put(ErrorLog.__table__, row("hooked"), in_transaction=broken_hook)
+    writer.flush(timeout=10)
+    assert writer.stats()["writer_alive"]
+    assert writer.stats()["dropped"] == 1
+    assert count_errors("hooked") == 0  # Rolled back with its hook
+
+    # Later rows still go through the queue rather than waiting out put_timeout
+    start = time.monotonic()
+    for _ in range(20):
+        writer.put(ErrorLog.__table__, row("after-hook"))
+    assert time.monotonic() - start < 0.5
+    writer.flush(timeout=10)
+    assert count_errors("after-hook") == 20
+    assert writer.stats()["inline_writes"] == 0
+    writer.close()
+
+def test_failing_callback_does_not_stop_the_writer():
+    writer = WriteBehindQueue(engine, flush_interval_ms=10)
+
+    def broken_callback(rows):
+        raise ValueError("boom")
+
+    writer.put(ErrorLog.__table__, row("callback"), on_written=broken_callback)
+    writer.flush(timeout=10)
+    assert writer.stats()["writer_alive"]
+    assert count_errors("callback") == 1
+    writer.close()
+
+def test_dead_writer_thread_is_restarted():
+    writer = WriteBehindQueue(engine, flush_interval_ms=10, put_timeout=0.5)
+    dead = threading.Thread(target=lambda: None)
+    dead.start()
+    dead.join()
+    writer._thread = dead  # As if the thread had died
+    writer.put(ErrorLog.__table__, row("restarted"))
+    writer.flush(timeout=10)
+    assert count_errors("restarted") == 1
+    stats = writer.stats()
+    assert stats["writer_alive"] and stats["writer_restarts"] == 1 and stats["inline_writes"] == 0
+    writer.close()
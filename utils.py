@@ -1,29 +1,32 @@
 import asyncio
 import os
 import time
+import uuid
 from datetime import datetime
 from functools import lru_cache
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import streamlit as st
 from sqlalchemy.exc import SQLAlchemyError
-from db import ChatHistory, get_db
+from db import get_async_db, get_read_db
+from read_models import (
+    ChatRecord, SessionPreview, fetch_chat_context, fetch_recent_chats, fetch_session_turns
+)
 from logger import get_logger
+from config import HISTORY_PREVIEW_LENGTH, SEARCH_CONTEXT_TURNS, SESSION_PAGE_SIZE, RATE_LIMIT_TRUST_FORWARDED_FOR
 
 # Get logger
 logger = get_logger()
 
 #@lru_cache(maxsize=100)
-def get_user_chat_history(user_id: int, max_records: int = 100) -> List[ChatHistory]:
+def get_user_chat_history(user_id: int, max_records: int = 100) -> List[ChatRecord]:
     """Get chat history for a specific user with caching for performance."""
     try:
         start_time = time.time()
-        with get_db() as db:
-            history = db.query(ChatHistory).filter(
-                ChatHistory.user_id == user_id
-            ).order_by(ChatHistory.timestamp.desc()).limit(max_records).all()
+        with get_read_db() as db:
+            history = fetch_recent_chats(db, user_id, max_records)  # Chronological order
             
             logger.info(f"Retrieved {len(history)} history records in {time.time() - start_time:.3f}s")
-            return list(reversed(history))  # Return in chronological order
+            return history
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_user_chat_history: {str(e)}")
         return []
@@ -31,7 +34,35 @@ def get_user_chat_history(user_id: int, max_records: int = 100) -> List[ChatHist
         logger.error(f"Unexpected error in get_user_chat_history: {str(e)}")
         return []
 
-def format_chat_history(history: List[ChatHistory]) -> List[str]:
+def get_chat_context(user_id: int, chat_id: int, turns: int = SEARCH_CONTEXT_TURNS) -> List[ChatRecord]:
+    """Get a turn with the turns around it, e.g. to show a search result in context."""
+    try:
+        with get_read_db() as db:
+            return fetch_chat_context(db, user_id, chat_id, turns)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in get_chat_context: {str(e)}")
+        return []
+
+def get_session_turns(user_id: int, session_id: int, cursor: Optional[Tuple[datetime, int]] = None,
+                      limit: int = SESSION_PAGE_SIZE) -> Tuple[List[ChatRecord], Optional[Tuple[datetime, int]]]:
+    """Get a page of a conversation's turns, the latest page when `cursor` is None.
+
+    Returns the turns in chronological order and the cursor of the page before
+    them, or None when there are no earlier turns.
+    """
+    try:
+        start_time = time.time()
+        with get_read_db() as db:
+            turns = fetch_session_turns(db, user_id, session_id, cursor, limit)
+
+        logger.info(f"Retrieved {len(turns)} turns of session {session_id} in {time.time() - start_time:.3f}s")
+        earlier = (turns[0].timestamp, turns[0].id) if len(turns) == limit else None
+        return turns, earlier
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in get_session_turns: {str(e)}")
+        return [], None
+
+def format_chat_history(history: List[ChatRecord]) -> List[str]:
     """Format chat history for display in the sidebar."""
     try:
         formatted_history = []
@@ -45,6 +76,21 @@ def format_chat_history(history: List[ChatHistory]) -> List[str]:
         logger.error(f"Error formatting chat history: {str(e)}")
         return ["Error loading history"]
 
+def format_session_previews(previews: List[SessionPreview]) -> List[str]:
+    """Format sidebar conversation rows for display."""
+    try:
+        formatted_history = []
+        for chat_session in previews:
+            date_str = chat_session.last_activity.strftime("%m-%d %H:%M")
+            preview = chat_session.preview or "New chat"
+            # Previews are stored one character past the display length to detect truncation
+            user_msg = preview[:HISTORY_PREVIEW_LENGTH] + "..." if len(preview) > HISTORY_PREVIEW_LENGTH else preview
+            formatted_history.append(f"{date_str}: {user_msg} ({chat_session.turn_count})")
+        return formatted_history
+    except Exception as e:
+        logger.error(f"Error formatting conversation previews: {str(e)}")
+        return ["Error loading history"]
+
 def format_timestamp(timestamp: datetime) -> str:
     """Format timestamp for display."""
     try:
@@ -64,8 +110,16 @@ def initialize_session_state() -> None:
             'messages': [],
             'loaded_history': False,
             'error': None,
-            'login_attempts': 0,
-            'last_attempt_time': None
+            'pending_request': None,
+            'history_pages': 1,  # Sidebar preview pages loaded so far
+            'search_focus': None,  # chat_history id of the search result being viewed
+            'chat_session_id': None,  # Open conversation; None until the first message of a new chat
+            'earlier_turns_cursor': None,  # Keyset cursor of the open conversation's unloaded turns
+            'session_token': None,  # Signed login session token, also kept in a cookie to survive reloads
+            'session_cookie_read': False,  # Whether the cookie sent when this browser session opened was used
+            'session_cookie_pending': None,  # Token to write to the browser's cookie, or "" to clear it
+            'login_not_before': None,  # (username, time.time()) before which this browser may not try it again
+            'session_id': uuid.uuid4().hex  # Identifies this browser session's conversation memory
         }
         
         # Initialize any missing variables
@@ -75,6 +129,18 @@ def initialize_session_state() -> None:
     except Exception as e:
         logger.error(f"Error initializing session state: {str(e)}")
 
+def get_client_ip() -> Optional[str]:
+    """The browser's IP address, or None if Streamlit cannot tell (e.g. in tests)."""
+    try:
+        if RATE_LIMIT_TRUST_FORWARDED_FOR:
+            forwarded_for = st.context.headers.get("X-Forwarded-For")
+            if forwarded_for:
+                return forwarded_for.split(",")[0].strip()
+        return st.context.ip_address
+    except Exception as e:
+        logger.error(f"Error getting client IP address: {str(e)}")
+        return None
+
 def load_css() -> str:
     """Load custom CSS for the app with caching."""
     try:
@@ -92,20 +158,11 @@ def load_css() -> str:
 def clear_session_on_logout() -> None:
     """Clear all session state variables on logout."""
     try:
-        keys_to_preserve = ['login_attempts', 'last_attempt_time']
-        preserved_values = {key: st.session_state.get(key) for key in keys_to_preserve}
-        
-        # Clear session state
+        # Clear session state; login throttling is kept server-side by rate_limit
         for key in list(st.session_state.keys()):
-            if key not in keys_to_preserve:
-                del st.session_state[key]
+            del st.session_state[key]
         
-        # Reinitialize with preserved values
         initialize_session_state()
-        
-        # Restore preserved values
-        for key, value in preserved_values.items():
-            st.session_state[key] = value
             
         logger.info("Session cleared on logout")
     except Exception as e:
@@ -118,13 +175,14 @@ def handle_error(error_message: str, log_error: bool = True) -> None:
     st.error(error_message)
     time.sleep(2)  # Give user time to read the error
 
-async def fetch_chat_history_async(user_id: int, max_records: int = 100) -> List[ChatHistory]:
-    """Asynchronously fetch chat history."""
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(
-        None, 
-        lambda: get_user_chat_history(user_id, max_records)
-    )
+async def fetch_chat_history_async(user_id: int, max_records: int = 100) -> List[ChatRecord]:
+    """Asynchronously fetch chat history, archived turns included, in chronological order."""
+    try:
+        async with get_async_db() as db:
+            return await db.run_sync(fetch_recent_chats, user_id, max_records)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in fetch_chat_history_async: {str(e)}")
+        return []
 
 # Added setup_logging function to match app.py references
 def setup_logging(level="INFO", log_format=None, log_file=None):
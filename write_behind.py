@@ -0,0 +1,297 @@
+import atexit
+import queue
+import threading
+import time
+import logging
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy import Table, insert
+from sqlalchemy.engine import Connection, Engine
+from db import engine
+from config import (
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_INTERVAL_MS,
+    WRITE_BEHIND_MAX_QUEUE,
+    WRITE_BEHIND_PUT_TIMEOUT,
+    WRITE_BEHIND_MAX_ATTEMPTS,
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Called with the rows of one table once they have been committed
+OnWritten = Callable[[List[Dict[str, Any]]], None]
+# Called inside the inserting transaction with the rows, primary keys filled in
+InTransaction = Callable[[Connection, List[Dict[str, Any]]], None]
+# (table, row, on_written, in_transaction, upsert)
+_Item = Tuple[Table, Dict[str, Any], Optional[OnWritten], Optional[InTransaction], bool]
+
+# Wakes the writer thread so it flushes immediately
+_FLUSH = object()
+
+def upsert_statement(dialect_name: str, table: Table):
+    """Insert rows into `table`, replacing the non-key columns of any row with the same primary key."""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise NotImplementedError(f"Upserts are not supported on {dialect_name}")
+    statement = dialect_insert(table)
+    keys = [column.name for column in table.primary_key.columns]
+    return statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={column.name: statement.excluded[column.name] for column in table.columns if column.name not in keys}
+    )
+
+class WriteBehindQueue:
+    """Buffers rows in memory and inserts them from a background thread.
+
+    Rows are written in batches: each flush inserts every queued row for a
+    table with one multi-row INSERT, and all tables in one transaction, once
+    `batch_size` rows are waiting or `flush_interval_ms` has passed since the
+    first one. When the queue is full, put() blocks, slowing callers to the
+    database's pace; if it stays full for `put_timeout` seconds the row is
+    written inline instead of being dropped. close() drains the queue and is
+    registered to run at interpreter exit.
+    """
+
+    def __init__(self, engine: Engine, batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval_ms: float = WRITE_BEHIND_FLUSH_INTERVAL_MS, max_queue: int = WRITE_BEHIND_MAX_QUEUE,
+                 put_timeout: float = WRITE_BEHIND_PUT_TIMEOUT, max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.put_timeout = put_timeout
+        self.max_attempts = max_attempts
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._rows = 0
+        self._inline = 0
+        self._dropped = 0
+        self._restarts = 0
+        self._thread = self._start_writer()
+        atexit.register(self.close)
+
+    def _start_writer(self) -> threading.Thread:
+        thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        thread.start()
+        return thread
+
+    def _ensure_writer(self) -> None:
+        """Restart the writer thread if it has died, so queued rows are not left waiting for put_timeout."""
+        if self._thread.is_alive():
+            return
+        with self._lock:
+            if not self._thread.is_alive() and not self._closed.is_set():
+                logger.error("Write-behind writer thread was not running; restarting it")
+                self._restarts += 1
+                self._thread = self._start_writer()
+
+    def put(self, table: Table, row: Dict[str, Any], on_written: Optional[OnWritten] = None,
+            in_transaction: Optional[InTransaction] = None, upsert: bool = False) -> None:
+        """Queue a row for insertion into `table`.
+
+        `in_transaction` runs in the same transaction as the insert, for writes
+        that must commit or roll back with it; `on_written` runs after commit.
+        With `upsert`, a row replaces any existing one with the same primary
+        key, and the last of several queued for one key wins.
+        """
+        item = (table, row, on_written, in_transaction, upsert)
+        if self._closed.is_set():
+            self._write_batch([item])
+            return
+        self._ensure_writer()
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            logger.warning(f"Write-behind queue full for {self.put_timeout}s, writing {table.name} row inline")
+            with self._lock:
+                self._inline += 1
+            self._write_batch([item])
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Block until every row queued so far has been written."""
+        done = threading.Event()
+        self._ensure_writer()
+        try:
+            self._queue.put((_FLUSH, done, None), timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Stop accepting queued rows and write everything still waiting."""
+        if self._closed.is_set():
+            return
+        self.flush(timeout)
+        self._closed.set()
+        # Rows that raced in after the final flush
+        self._write_batch(self._drain())
+
+    def stats(self) -> Dict[str, float]:
+        """Report queue depth, batches written and their average size."""
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "batches": self._batches,
+                "rows": self._rows,
+                "avg_batch_size": self._rows / self._batches if self._batches else 0.0,
+                "inline_writes": self._inline,
+                "dropped": self._dropped,
+                "writer_alive": self._thread.is_alive(),
+                "writer_restarts": self._restarts,
+            }
+
+    def _drain(self) -> List[_Item]:
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item[0] is _FLUSH:
+                item[1].set()
+            else:
+                items.append(item)
+
+    def _collect(self) -> Tuple[List[_Item], List[threading.Event]]:
+        """Wait for the first row, then gather more until the batch is full or the interval ends."""
+        items, flushes = [], []
+        first = self._queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if first[0] is _FLUSH:
+                # Flush requests end the batch early; everything queued before them is in it
+                flushes.append(first[1])
+                return items, flushes
+            items.append(first)
+            remaining = deadline - time.monotonic()
+            if len(items) >= self.batch_size or remaining <= 0:
+                return items, flushes
+            try:
+                first = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return items, flushes
+
+    def _run(self) -> None:
+        while True:
+            items, flushes = self._collect()
+            try:
+                self._write_batch(items)
+            except Exception as e:
+                # Never let one batch stop the writer: every later put() would wait out put_timeout
+                logger.error(f"Write-behind dropped a batch of {len(items)} rows: {str(e)}")
+                with self._lock:
+                    self._dropped += len(items)
+            finally:
+                for done in flushes:
+                    done.set()
+
+    def _write_batch(self, items: List[_Item]) -> None:
+        if not items:
+            return
+        rows_by_table, callbacks, hooks, upserts = self._group(items)
+
+        start_time = time.time()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with self.engine.begin() as conn:
+                    written = self._insert(conn, rows_by_table, hooks, upserts)
+                break
+            except Exception as e:
+                # Database errors, and errors from in-transaction hooks, which roll the batch back too
+                logger.error(f"Write-behind flush of {len(items)} rows failed (attempt {attempt}): {str(e)}")
+                if attempt == self.max_attempts:
+                    if len(items) > 1:
+                        # Retry row by row so one bad row does not take the rest of the batch with it
+                        for item in items:
+                            self._write_single(item)
+                    else:
+                        with self._lock:
+                            self._dropped += 1
+                    return
+                time.sleep(0.1 * 2 ** attempt)
+
+        with self._lock:
+            self._batches += 1
+            self._rows += len(items)
+        logger.debug(f"Wrote {len(items)} queued rows in {(time.time() - start_time) * 1000:.1f}ms")
+        self._notify(callbacks, written)
+
+    def _write_single(self, item: _Item) -> None:
+        rows_by_table, callbacks, hooks, upserts = self._group([item])
+        try:
+            with self.engine.begin() as conn:
+                written = self._insert(conn, rows_by_table, hooks, upserts)
+        except Exception as e:
+            logger.error(f"Dropping {item[0].name} row after failed write: {str(e)}")
+            with self._lock:
+                self._dropped += 1
+            return
+        with self._lock:
+            self._batches += 1
+            self._rows += 1
+        self._notify(callbacks, written)
+
+    @staticmethod
+    def _group(items: List[_Item]):
+        rows_by_table: Dict[Table, List[Dict[str, Any]]] = defaultdict(list)
+        callbacks: Dict[Table, List[OnWritten]] = defaultdict(list)
+        hooks: Dict[Table, List[InTransaction]] = defaultdict(list)
+        upserts: Set[Table] = set()
+        for table, row, on_written, in_transaction, upsert in items:
+            rows_by_table[table].append(row)
+            if on_written is not None and on_written not in callbacks[table]:
+                callbacks[table].append(on_written)
+            if in_transaction is not None and in_transaction not in hooks[table]:
+                hooks[table].append(in_transaction)
+            if upsert:
+                upserts.add(table)
+        return rows_by_table, callbacks, hooks, upserts
+
+    @staticmethod
+    def _insert(conn: Connection, rows_by_table: Dict[Table, List[Dict[str, Any]]],
+                hooks: Dict[Table, List[InTransaction]], upserts: Set[Table]) -> Dict[Table, List[Dict[str, Any]]]:
+        """Insert each table's rows with one multi-row INSERT and run its in-transaction hooks."""
+        written = {}
+        for table, rows in rows_by_table.items():
+            if table in upserts:
+                # One statement may not update a row twice, so keep only the last row for each key
+                keys = [column.name for column in table.primary_key.columns]
+                rows = list({tuple(row[key] for key in keys): row for row in rows}.values())
+                conn.execute(upsert_statement(conn.dialect.name, table), rows)
+            elif hooks.get(table):
+                # Hooks need the generated keys, so have the INSERT return them in row order
+                pk = table.primary_key.columns[0]
+                ids = conn.execute(insert(table).returning(pk, sort_by_parameter_order=True), rows).scalars().all()
+                rows = [{**row, pk.name: id_} for row, id_ in zip(rows, ids)]
+                for hook in hooks[table]:
+                    hook(conn, rows)
+            else:
+                conn.execute(insert(table), rows)
+            written[table] = rows
+        return written
+
+    @staticmethod
+    def _notify(callbacks: Dict[Table, List[OnWritten]], written: Dict[Table, List[Dict[str, Any]]]) -> None:
+        for table, fns in callbacks.items():
+            for fn in fns:
+                try:
+                    fn(written[table])
+                except Exception as e:
+                    logger.error(f"Write-behind callback failed for {table.name}: {str(e)}")
+
+_write_behind: Optional[WriteBehindQueue] = None
+_write_behind_lock = threading.Lock()
+
+def get_write_behind() -> WriteBehindQueue:
+    """Get the process-wide write-behind queue."""
+    global _write_behind
+    # Locked rather than lru_cache'd: the first callers are often concurrent worker threads
+    with _write_behind_lock:
+        if _write_behind is None:
+            _write_behind = WriteBehindQueue(engine)
+        return _write_behind